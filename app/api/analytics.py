@@ -1,33 +1,50 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
 from datetime import datetime, timedelta
+from typing import List, Optional
 
-from app.database import get_db
+from app.database import engine, get_async_db
+from app.services import archive, rollups
+from app.services.daily_report import DAILY_REPORT_MAX_DAYS, daily_report
+from app.services.report_engine import PERIOD_AVERAGE_METRICS, REPORT_FORMATS, ReportConfig, fetch_report, prepare_report, stream_report
+from app.services.cache import response_cache, cache_key, date_tag, CALCULATED_DATA_TAG, MEASURING_POINTS_TAG
+from app.utils.time_buckets import parse_datetime
 
 router = APIRouter()
 
 @router.get("/analytics/summary")
-def get_analytics_summary(db: Session = Depends(get_db)):
-    """Получить сводную аналитику по всем данным"""
+async def get_analytics_summary(db: AsyncSession = Depends(get_async_db)):
+    """Получить сводную аналитику по всем данным (кэшируется до изменения данных)"""
+    key = cache_key("/analytics/summary")
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
     # Статистика по точкам
-    points_stats = db.execute(text("""
+    points_stats = (await db.execute(text("""
         SELECT 
             COUNT(*) as total_points,
             COUNT(DISTINCT id_parent_point) as hierarchy_levels
         FROM "Measuring_point"
-    """)).first()
-    # Статистика по данным
-    data_stats = db.execute(text("""
+    """))).first()
+    # Статистика по данным: итоги таблицы и холодного архива (порядок - archive.totals)
+    table_stats = (await db.execute(text("""
         SELECT 
             COUNT(*) as total_records,
             MIN(data_and_time) as first_record,
             MAX(data_and_time) as last_record,
-            AVG(parametr_ttr) as global_avg_ttr,
-            AVG(parametr_q) as global_avg_q
+            COUNT(parametr_ttr), SUM(parametr_ttr),
+            COUNT(parametr_q), SUM(parametr_q)
         FROM "Calculated_data"
-    """)).first()
-    return {
+    """))).first()
+    stats = [table_stats]
+    files = archive.archive_files()
+    if files:
+        stats.append(await run_in_threadpool(archive.totals, ("parametr_ttr", "parametr_q"), files))
+    data_stats = archive.merge_totals(stats)
+    return response_cache.set(key, {
         "points_summary": {
             "total_points": points_stats[0],
             "hierarchy_levels": points_stats[1]
@@ -39,76 +56,92 @@ def get_analytics_summary(db: Session = Depends(get_db)):
                 "last": data_stats[2]
             },
             "averages": {
-                "parametr_ttr": float(data_stats[3]) if data_stats[3] else 0,
-                "parametr_q": float(data_stats[4]) if data_stats[4] else 0
+                "parametr_ttr": archive.average(*data_stats[3:5]),
+                "parametr_q": archive.average(*data_stats[5:7])
             }
         }
-    }
+    }, tags=[CALCULATED_DATA_TAG, MEASURING_POINTS_TAG])
 
 @router.get("/analytics/trends")
-def get_analytics_trends(
+async def get_analytics_trends(
     period: str = "month",
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Получить тренды данных за период"""
-    if period == "week":
-        interval = "DATE_TRUNC('week', data_and_time)"
-    elif period == "month":
-        interval = "DATE_TRUNC('month', data_and_time)"
-    else:  # day
-        interval = "DATE(data_and_time)" 
-    trends = db.execute(text(f"""
-        SELECT 
-            {interval} as period,
-            AVG(parametr_ttr) as avg_ttr,
-            AVG(parametr_q) as avg_q,
-            COUNT(*) as record_count
-        FROM "Calculated_data"
-        GROUP BY period
-        ORDER BY period DESC
-        LIMIT 30
-    """)).fetchall()
-    
-    return [dict(row) for row in trends]
+    """Получить тренды данных за период (последние 30 интервалов)"""
+    granularity = {"week": "week", "month": "month"}.get(period, "day")
+    trends = await db.run_sync(rollups.aggregate_periods, granularity, newest_first=True, limit=30)
+    if trends is None:
+        trends = await fetch_report(db, ReportConfig(
+            type="timeseries",
+            interval=granularity,
+            group_by_point=False,
+            metrics=PERIOD_AVERAGE_METRICS,
+            order="desc",
+            limit=30
+        ))
+    if granularity == "day":
+        for row in trends:
+            row["period"] = row["period"].date()
+    return trends
 @router.get("/reports/daily")
-def get_daily_report(
-    date: str = None,  # Если None - берется вчерашний день
-    db: Session = Depends(get_db)
+async def get_daily_report(
+    date: str = None,  # Если None и период не задан - берется вчерашний день
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    point_ids: Optional[List[int]] = Query(None),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Сформировать ежедневный отчет"""
-    if not date:
-        date = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-    report_data = db.execute(text("""
-        SELECT 
-            mp.name_point,
-            mp.id_point,
-            COUNT(cd.id_data) as records_count,
-            AVG(cd.parametr_ttr) as avg_ttr,
-            AVG(cd.parametr_q) as avg_q,
-            MIN(cd.parametr_ttr) as min_ttr,
-            MAX(cd.parametr_ttr) as max_ttr
-        FROM "Measuring_point" mp
-        LEFT JOIN "Calculated_data" cd ON mp.id_point = cd.id_point 
-            AND DATE(cd.data_and_time) = :date
-        GROUP BY mp.id_point, mp.name_point
-        ORDER BY mp.id_point
-    """), {"date": date}).fetchall()
-    return {
-        "report_date": date,
-        "points": [dict(row) for row in report_data]
-    }
+    """
+    Сформировать суточный отчет за день (date) или период start..end (включительно)
+    По каждой точке: итог за период и показатели по суткам; point_ids - выбор точек
+    """
+    if start or end:
+        start, end = start or end, end or start
+    else:
+        date = date or (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        start = end = date
+    try:
+        start_date = parse_datetime(start).date()
+        end_date = parse_datetime(end).date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format, expected YYYY-MM-DD")
+    days = (end_date - start_date).days + 1
+    if days < 1 or days > DAILY_REPORT_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Period must be from 1 to {DAILY_REPORT_MAX_DAYS} days")
+    point_ids = sorted(set(point_ids)) if point_ids is not None else None
+
+    key = cache_key(
+        "/reports/daily",
+        start=start_date,
+        end=end_date,
+        point_ids=",".join(map(str, point_ids)) if point_ids is not None else None
+    )
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+    points = await db.run_sync(daily_report, start_date, end_date, point_ids)
+    tags = [date_tag(start_date + timedelta(days=i)) for i in range(days)] + [MEASURING_POINTS_TAG]
+    return response_cache.set(key, {
+        "report_date": start_date if days == 1 else None,
+        "start": start_date,
+        "end": end_date,
+        "points": points
+    }, tags=tags)
 @router.post("/reports/generate")
-def generate_custom_report(
-    report_config: dict,
-    db: Session = Depends(get_db)
-):
-    """Сгенерировать кастомный отчет по конфигурации"""
-    # Пример конфигурации отчета
-    # {
-    #     "type": "summary",
-    #     "date_range": {"start": "2024-01-01", "end": "2024-01-31"},
-    #     "point_ids": [1, 2, 3],
-    #     "metrics": ["parametr_ttr", "parametr_q"]
-    # } 
-    # Здесь будет логика генерации отчета по конфигурации
-    return {"status": "report_generated", "config": report_config}
\ No newline at end of file
+def generate_custom_report(report_config: ReportConfig):
+    """
+    Сгенерировать отчет по конфигурации (см. app/services/report_engine.py)
+    {
+        "type": "summary",
+        "date_range": {"start": "2024-01-01", "end": "2024-01-31"},
+        "point_ids": [1, 2, 3],
+        "metrics": ["parametr_ttr", "parametr_q"]
+    }
+    Строки отдаются потоком в NDJSON (format="ndjson") или CSV (format="csv")
+    """
+    plan, parameters = prepare_report(report_config, engine.dialect.name)
+    return StreamingResponse(
+        stream_report(report_config.format, plan, parameters),
+        media_type=REPORT_FORMATS[report_config.format],
+        headers={"X-Report-Columns": ",".join(plan.columns)}
+    )
@@ -1,144 +1,256 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
-from sqlalchemy import text
+from sqlalchemy import select
+from starlette.concurrency import run_in_threadpool
+import heapq
 
-from app.database import get_db
+from app.database import get_async_db
 from app.models.models import CalculatedData as CalculatedDataModel
-from app.schemas.schemas import CalculatedData as CalculatedDataSchema, CalculatedDataCreate, CalculatedDataUpdate
+from app.schemas.schemas import CalculatedData as CalculatedDataSchema, CalculatedDataCreate, CalculatedDataUpdate, BatchCreateResponse
 from app.crud.crud import crud_calculated_data, crud_measuring_point
+from app.utils.pagination import next_cursor_headers
+from app.utils.time_buckets import parse_datetime
+from app.services import archive, rollups
+from app.services.columnar import columnar_response, negotiate
+from app.services.downsampling import DOWNSAMPLE_MAX_POINTS, DOWNSAMPLING_METHODS, downsample_point
+from app.services.lean_read import DATA_FIELDS, DATA_SELECT_COLUMNS, rows_response
+from app.services.report_engine import METRIC_COLUMNS, PERIOD_AVERAGE_METRICS, ReportConfig, fetch_report
+from app.services.water_mass import DERIVE_Q_H2O_ON_INGEST
 
 router = APIRouter()
 
+# Столбцы Calculated_data и их типы для колоночных форматов ответа
+DATA_COLUMNS = CalculatedDataModel.__table__.columns
+DATA_COLUMN_TYPES = {column.key: column.type for column in DATA_COLUMNS}
+AGGREGATED_COLUMNS = ("period", "avg_ttr", "avg_q", "record_count")
+
+def data_columns_response(media_type: str, rows, headers=None) -> Response:
+    return columnar_response(media_type, rows, DATA_COLUMNS.keys(), DATA_COLUMN_TYPES, headers)
+
 # 1. Базовые CRUD операции
 @router.get("/calculated-data/", response_model=List[CalculatedDataSchema])
-def get_calculated_data(
+async def get_calculated_data(
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Получить все расчетные данные"""
-    return crud_calculated_data.get_all(db, skip, limit)
+    """
+    Получить все расчетные данные в порядке (data_and_time, id_data)
+    Курсор следующей страницы возвращается в заголовке X-Next-Cursor
+    """
+    try:
+        rows = await crud_calculated_data.get_all(db, skip, limit, cursor, columns=DATA_SELECT_COLUMNS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return rows_response(rows, next_cursor_headers(rows, limit, crud_calculated_data.cursor_key))
 
-@router.get("/calculated-data/{data_id}", response_model=CalculatedDataSchema)
-def get_calculated_data_point(data_id: int, db: Session = Depends(get_db)):  # int вместо float
+@router.get("/calculated-data/{data_id:int}", response_model=CalculatedDataSchema)
+async def get_calculated_data_point(data_id: int, db: AsyncSession = Depends(get_async_db)):  # int вместо float
     """Получить конкретные расчетные данные по ID"""
-    data = crud_calculated_data.get(db, data_id)
+    data = await crud_calculated_data.get(db, data_id)
     if not data:
         raise HTTPException(status_code=404, detail="Calculated data not found")
     return data
 
 @router.post("/calculated-data/", response_model=CalculatedDataSchema)
-def create_calculated_data(
+async def create_calculated_data(
     data: CalculatedDataCreate,
-    db: Session = Depends(get_db)
+    derive_q_h2o: bool = DERIVE_Q_H2O_ON_INGEST,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Создать новые расчетные данные"""
+    """
+    Создать новые расчетные данные
+    derive_q_h2o=true - parametr_q_H2O рассчитывается по ТТР и объему, переданное значение не используется
+    """
     # Проверяем существует ли точка измерения
-    if not crud_measuring_point.get(db, data.id_point):
+    if not await crud_measuring_point.get(db, data.id_point):
         raise HTTPException(status_code=404, detail="Measuring point not found")
-    return crud_calculated_data.create(db, data)
+    return await crud_calculated_data.create(db, data, derive_q_h2o=derive_q_h2o)
 
-@router.put("/calculated-data/{data_id}", response_model=CalculatedDataSchema)
-def update_calculated_data(
+@router.put("/calculated-data/{data_id:int}", response_model=CalculatedDataSchema)
+async def update_calculated_data(
     data_id: int,  # int вместо float
     data_update: CalculatedDataUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Обновить расчетные данные"""
-    updated = crud_calculated_data.update(db, data_id, data_update)
+    updated = await crud_calculated_data.update(db, data_id, data_update)
     if not updated:
         raise HTTPException(status_code=404, detail="Calculated data not found")
     return updated
 
-@router.delete("/calculated-data/{data_id}")
-def delete_calculated_data(data_id: int, db: Session = Depends(get_db)):  # int вместо float
+@router.delete("/calculated-data/{data_id:int}")
+async def delete_calculated_data(data_id: int, db: AsyncSession = Depends(get_async_db)):  # int вместо float
     """Удалить расчетные данные"""
-    if not crud_calculated_data.delete(db, data_id):
+    if not await crud_calculated_data.delete(db, data_id):
         raise HTTPException(status_code=404, detail="Calculated data not found")
     return {"message": "Calculated data deleted successfully"}
 
 # 2. Специальные операции для данных
 @router.get("/calculated-data/point/{point_id}", response_model=List[CalculatedDataSchema])
-def get_data_by_point(
+async def get_data_by_point(
     point_id: int,  # int вместо float
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Получить расчетные данные по ID точки измерения"""
-    if not crud_measuring_point.get(db, point_id):
+    """
+    Получить расчетные данные по ID точки измерения (курсор в X-Next-Cursor)
+    Accept: application/vnd.apache.arrow.stream или application/msgpack - колоночный ответ
+    """
+    media_type = negotiate(accept)
+    if not await crud_measuring_point.get(db, point_id):
         raise HTTPException(status_code=404, detail="Measuring point not found")
-    return crud_calculated_data.get_by_point(db, point_id, skip, limit)
+    try:
+        rows = await crud_calculated_data.get_by_point(
+            db, point_id, skip, limit, cursor, columns=DATA_SELECT_COLUMNS if media_type is None else DATA_COLUMNS
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = next_cursor_headers(rows, limit, crud_calculated_data.cursor_key)
+    if media_type is not None:
+        return data_columns_response(media_type, rows, headers)
+    return rows_response(rows, headers)
 
 @router.get("/calculated-data/date-range", response_model=List[CalculatedDataSchema])
-def get_data_by_date_range(
+async def get_data_by_date_range(
     start_date: str,
     end_date: str,
     point_id: Optional[int] = None,  # int вместо float
-    db: Session = Depends(get_db)
+    accept: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Получить данные за временной период"""
-    query = db.query(CalculatedDataModel).filter(
-        CalculatedDataModel.data_and_time.between(start_date, end_date)
+    """
+    Получить данные за временной период
+    Accept: application/vnd.apache.arrow.stream или application/msgpack - колоночный ответ
+    """
+    media_type = negotiate(accept)
+    try:
+        start, end = parse_datetime(start_date), parse_datetime(end_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use ISO format")
+    query = select(CalculatedDataModel).where(
+        CalculatedDataModel.data_and_time.between(start, end)
     )
     if point_id:
-        query = query.filter(CalculatedDataModel.id_point == point_id)
-        if not crud_measuring_point.get(db, point_id):
+        query = query.where(CalculatedDataModel.id_point == point_id)
+        if not await crud_measuring_point.get(db, point_id):
             raise HTTPException(status_code=404, detail="Measuring point not found")
-    return query.order_by(CalculatedDataModel.data_and_time).all()
+    query = query.order_by(CalculatedDataModel.data_and_time, CalculatedDataModel.id_data)
+    # Строки Core без объектов ORM и валидации схемой
+    names = list(DATA_COLUMNS.keys()) if media_type is not None else list(DATA_FIELDS)
+    rows = await db.execute(query.with_only_columns(*(DATA_COLUMNS if media_type is not None else DATA_SELECT_COLUMNS)))
+    files = archive.archive_files(start, end)
+    if files:
+        # Строки холодного архива за период - в общем порядке (data_and_time, id_data)
+        archive_rows = await run_in_threadpool(lambda: list(archive.iter_rows(
+            [name if name in archive.ARCHIVE_COLUMNS else "NULL" for name in names], ["data_and_time", "id_data"],
+            files, [point_id] if point_id else None, start, end, end_inclusive=True,
+        )))
+        positions = names.index("data_and_time"), names.index("id_data")
+        rows = list(heapq.merge(rows, archive_rows, key=lambda row: (row[positions[0]], row[positions[1]])))
+    if media_type is not None:
+        return data_columns_response(media_type, rows)
+    return rows_response(rows)
+
+@router.get("/calculated-data/downsampled")
+async def get_downsampled_data(
+    point_id: int,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    metrics: List[str] = Query(["parametr_ttr", "parametr_q"]),
+    max_points: int = Query(1500, ge=3, le=DOWNSAMPLE_MAX_POINTS),
+    method: str = "lttb",
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Ряды показателей точки для графика, прореженные на сервере до max_points отсчетов
+    method: lttb (форма ряда) или minmax (минимум и максимум в интервалах времени);
+    metrics - столбцы (parametr_ttr) или короткие имена (ttr)
+    """
+    if method not in DOWNSAMPLING_METHODS:
+        raise HTTPException(status_code=400, detail=f"Unsupported method. Use one of: {', '.join(DOWNSAMPLING_METHODS)}")
+    columns = []
+    for metric in metrics:
+        column = METRIC_COLUMNS.get(metric, metric)
+        if column not in METRIC_COLUMNS.values():
+            raise HTTPException(status_code=400, detail=f"Unsupported metric: {metric}. Columns: {', '.join(METRIC_COLUMNS.values())}")
+        if column not in columns:
+            columns.append(column)
+    try:
+        start = parse_datetime(start_date) if start_date else None
+        end = parse_datetime(end_date) if end_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use ISO format")
+    if not await crud_measuring_point.get(db, point_id):
+        raise HTTPException(status_code=404, detail="Measuring point not found")
+    return await db.run_sync(downsample_point, point_id, columns, start, end, max_points, method)
 
-@router.post("/calculated-data/batch", response_model=List[CalculatedDataSchema])
-def create_batch_calculated_data(
+@router.post("/calculated-data/batch", response_model=BatchCreateResponse)
+async def create_batch_calculated_data(
     data_list: List[CalculatedDataCreate],
-    db: Session = Depends(get_db)
+    counts_only: bool = False,
+    derive_q_h2o: bool = DERIVE_Q_H2O_ON_INGEST,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Пакетное добавление расчетных данных"""
-    results = []
-    for data in data_list:
-        # Проверяем точку измерения
-        if not crud_measuring_point.get(db, data.id_point):
-            raise HTTPException(status_code=404, detail=f"Measuring point {data.id_point} not found")
-        created = crud_calculated_data.create(db, data)
-        results.append(created)
-    return results
+    """
+    Пакетное добавление расчетных данных в одной транзакции
+    Строки с ошибками (нет точки измерения, ошибка БД) пропускаются и попадают в errors;
+    counts_only=true возвращает только количество без созданных строк;
+    derive_q_h2o=true - parametr_q_H2O рассчитывается по ТТР и объему
+    """
+    inserted, rows, errors = await crud_calculated_data.create_bulk(
+        db, data_list, return_rows=not counts_only, derive_q_h2o=derive_q_h2o
+    )
+    return {
+        "inserted": inserted,
+        "failed": len(errors),
+        "errors": errors,
+        "items": None if counts_only else rows
+    }
 
 @router.get("/calculated-data/aggregated")
-def get_aggregated_data(
+async def get_aggregated_data(
     aggregation: str = "daily",  # daily, weekly, monthly
     point_id: Optional[int] = None,  # int вместо float
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    db: Session = Depends(get_db)
+    accept: Optional[str] = Header(None),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Получить агрегированные данные"""
-    # Определяем интервал агрегации
-    if aggregation == "daily":
-        interval = "DATE(data_and_time)"
-    elif aggregation == "weekly":
-        interval = "DATE_TRUNC('week', data_and_time)"
-    else:  # monthly
-        interval = "DATE_TRUNC('month', data_and_time)" 
-    # Строим запрос
-    sql = f"""
-        SELECT 
-            {interval} as period,
-            AVG(parametr_ttr) as avg_ttr,
-            AVG(parametr_q) as avg_q,
-            COUNT(*) as record_count
-        FROM "Calculated_data"
-        WHERE 1=1
     """
-    params = {}
-    if point_id:
-        sql += " AND id_point = :point_id"
-        params["point_id"] = point_id
-    if start_date:
-        sql += " AND data_and_time >= :start_date"
-        params["start_date"] = start_date
-    if end_date:
-        sql += " AND data_and_time <= :end_date"
-        params["end_date"] = end_date
-    sql += " GROUP BY period ORDER BY period"
-    result = db.execute(text(sql), params)
-    return [dict(row) for row in result]
\ No newline at end of file
+    Получить агрегированные данные (из предрасчитанных агрегатов, если они подходят)
+    Accept: application/vnd.apache.arrow.stream или application/msgpack - колоночный ответ
+    """
+    media_type = negotiate(accept)
+    period = {"daily": "day", "weekly": "week"}.get(aggregation, "month")
+    try:
+        start = parse_datetime(start_date) if start_date else None
+        end = parse_datetime(end_date) if end_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use ISO format")
+    aggregated = await db.run_sync(rollups.aggregate_periods, period, point_id, start, end)
+    if aggregated is None:
+        # Границы не совпадают с интервалами агрегатов - считаем по исходным строкам;
+        # конец периода со временем включается, как в агрегатах
+        aggregated = await fetch_report(db, ReportConfig(
+            type="timeseries",
+            interval=period,
+            group_by_point=False,
+            metrics=PERIOD_AVERAGE_METRICS,
+            date_range={
+                "start": start.isoformat() if start else None,
+                "end": end.isoformat() if end else None
+            },
+            point_ids=[point_id] if point_id else None
+        ))
+    if period == "day":
+        for row in aggregated:
+            row["period"] = row["period"].date()
+    if media_type is not None:
+        return columnar_response(media_type, [[row[name] for name in AGGREGATED_COLUMNS] for row in aggregated], AGGREGATED_COLUMNS)
+    return aggregated
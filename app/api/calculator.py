@@ -1,9 +1,14 @@
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response, JSONResponse
+from pydantic import BaseModel, ValidationError
 from typing import List, Optional, Dict, Any
 import logging
 
+import numpy as np
+
 from app.services.humidity_calculations import HumidityCalculator
+from app.services.metrics import CALCULATOR_CALLS, CALCULATOR_ROWS
 from app.utils.units_converter import UnitsConverter
 from app.schemas.schemas import (
     GasVolumeInput,
@@ -12,18 +17,27 @@ from app.schemas.schemas import (
     VolumeResult,
     VolumeDifference,
     GasMixtureRequest,
-    GasMixtureResponse
+    GasMixtureResponse,
+    BatchCalculationRequest,
+    BatchCalculationResponse
 )
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Ограничение размера пакета для /calculator/batch
+MAX_BATCH_ROWS = 1_000_000
+# Бинарный формат: float64 little-endian, колонки записаны подряд
+BINARY_MEDIA_TYPE = "application/octet-stream"
+BINARY_DTYPE = np.dtype("<f8")
+
 @router.post("/calculator/single-volume", response_model=SingleVolumeResponse)
 async def calculate_single_volume(request: SingleVolumeRequest):
     """
     Расчет влагосодержания для одного/двух объемов газа
     Соответствует п. 6.3.1 ТЗ
     """
+    CALCULATOR_CALLS.labels("single_volume").inc()
     if len(request.volumes) == 0:
         raise HTTPException(status_code=400, detail="At least one volume required")
     if len(request.volumes) > 2:
@@ -63,6 +77,7 @@ async def calculate_single_volume(request: SingleVolumeRequest):
             results.append(result)
             total_water_masses.append(water_mass_grams)
         
+        CALCULATOR_ROWS.labels("single_volume").inc(len(results))
         # Расчет разницы если два объема
         difference = None
         if len(total_water_masses) == 2:
@@ -86,8 +101,11 @@ async def calculate_gas_mixture(request: GasMixtureRequest):
     Расчет параметров смеси газов
     Соответствует п. 6.3.2 ТЗ
     """
+    CALCULATOR_CALLS.labels("gas_mixture").inc()
     if len(request.components) == 0:
         raise HTTPException(status_code=400, detail="At least one component required")
+    if request.dew_point_method not in HumidityCalculator.DEW_POINT_METHODS:
+        raise HTTPException(status_code=400, detail=f"Unsupported dew point method: {request.dew_point_method}")
     
     try:
         total_volume = 0
@@ -112,9 +130,13 @@ async def calculate_gas_mixture(request: GasMixtureRequest):
             weighted_humidity_sum += humidity_content * base_volume
         
         # Расчет параметров смеси
+        CALCULATOR_ROWS.labels("gas_mixture").inc(len(request.components))
         mixture_water_content = weighted_humidity_sum / total_volume if total_volume > 0 else 0
         total_water_mass_grams = mixture_water_content * total_volume
-        mixture_dew_point = HumidityCalculator.calculate_mixture_dew_point(mixture_water_content)
+        mixture_dew_point = HumidityCalculator.calculate_mixture_dew_point(
+            mixture_water_content,
+            method=request.dew_point_method
+        )
         
         # Конвертируем общий объем обратно в тыс. куб. м для отображения
         display_volume = UnitsConverter.convert_volume(total_volume, 'cubic_meter', 'thousand_cubic_meters')
@@ -126,6 +148,91 @@ async def calculate_gas_mixture(request: GasMixtureRequest):
             mixture_dew_point=round(mixture_dew_point, 2)
         )
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error in gas mixture calculation: {e}")
-        raise HTTPException(status_code=500, detail=f"Calculation error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Calculation error: {str(e)}")
+
+@router.post(
+    "/calculator/batch",
+    response_model=BatchCalculationResponse,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": BatchCalculationRequest.model_json_schema()
+                },
+                BINARY_MEDIA_TYPE: {
+                    "schema": {"type": "string", "format": "binary"},
+                    "description": "float64 LE: N значений ТТР, затем N объемов"
+                }
+            }
+        }
+    }
+)
+async def calculate_batch(
+    request: Request,
+    volume_unit: str = "thousand_cubic_meters",
+    dew_point_unit: str = "celsius"
+):
+    """
+    Пакетный расчет влагосодержания по п. 6.2.2 ТЗ для колонок (ТТР, объем)
+    JSON: {"dew_points": [...], "gas_volumes": [...]}, ответ по колонкам.
+    application/octet-stream: float64 LE, N ТТР и затем N объемов (единицы
+    в query-параметрах); ответ в том же формате - N влагосодержаний,
+    N масс воды и N базовых объемов, число строк в заголовке X-Row-Count.
+    """
+    CALCULATOR_CALLS.labels("batch").inc()
+    body = await request.body()
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    binary = content_type == BINARY_MEDIA_TYPE
+    
+    if binary:
+        if len(body) % (2 * BINARY_DTYPE.itemsize) != 0:
+            raise HTTPException(status_code=400, detail="Binary body must contain two float64 columns of equal length")
+        columns = np.frombuffer(body, dtype=BINARY_DTYPE)
+        dew_points, gas_volumes = np.split(columns, 2)
+    else:
+        try:
+            payload = BatchCalculationRequest.model_validate_json(body)
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+        if len(payload.dew_points) != len(payload.gas_volumes):
+            raise HTTPException(status_code=400, detail="dew_points and gas_volumes must have equal length")
+        dew_points = np.asarray(payload.dew_points, dtype=np.float64)
+        gas_volumes = np.asarray(payload.gas_volumes, dtype=np.float64)
+        volume_unit = payload.volume_unit
+        dew_point_unit = payload.dew_point_unit
+    
+    if len(dew_points) == 0:
+        raise HTTPException(status_code=400, detail="At least one volume required")
+    if len(dew_points) > MAX_BATCH_ROWS:
+        raise HTTPException(status_code=413, detail=f"Maximum {MAX_BATCH_ROWS} rows supported")
+    
+    try:
+        base_volumes = UnitsConverter.convert_volume_array(gas_volumes, volume_unit, 'cubic_meter')
+        base_dew_points = UnitsConverter.convert_dew_point_array(dew_points, dew_point_unit, 'celsius')
+        humidity_content = HumidityCalculator.calculate_humidity_content_array(base_dew_points)
+        water_mass_grams = HumidityCalculator.calculate_water_mass_array(humidity_content, base_volumes)
+    except Exception as e:
+        logger.error(f"Error in batch calculation: {e}")
+        raise HTTPException(status_code=500, detail=f"Calculation error: {str(e)}")
+    CALCULATOR_ROWS.labels("batch").inc(len(humidity_content))
+    
+    if binary:
+        result = np.concatenate([humidity_content, water_mass_grams, base_volumes]).astype(BINARY_DTYPE, copy=False)
+        return Response(
+            content=result.tobytes(),
+            media_type=BINARY_MEDIA_TYPE,
+            headers={"X-Row-Count": str(len(humidity_content))}
+        )
+    
+    # Колонки уже проверены NumPy - отдаем без повторной валидации pydantic
+    return JSONResponse(content={
+        "count": len(humidity_content),
+        "water_content_per_cubic_meter": humidity_content.tolist(),
+        "total_water_mass": water_mass_grams.tolist(),
+        "base_volume_cubic_meters": base_volumes.tolist()
+    })
@@ -0,0 +1,50 @@
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+
+from app.database import get_async_db
+from app.models.models import ThresholdExcursion as ThresholdExcursionModel
+from app.schemas.schemas import ThresholdExcursion as ThresholdExcursionSchema
+from app.utils.time_buckets import parse_datetime
+
+router = APIRouter()
+
+EXCURSION_STATUSES = ("open", "closed", "all")
+
+@router.get("/excursions", response_model=List[ThresholdExcursionSchema])
+async def get_excursions(
+    status: str = "all",
+    point_id: Optional[int] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    skip: int = 0,
+    limit: int = 100,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Превышения расхода воды над порогом (parametr_q_H2O > parametr_q_H2O_porog), новые первыми
+    status: open - продолжаются, closed - завершены, all - все;
+    start_date/end_date - превышения, пересекающиеся с периодом
+    """
+    if status not in EXCURSION_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Unsupported status. Use one of: {', '.join(EXCURSION_STATUSES)}")
+    try:
+        start = parse_datetime(start_date) if start_date else None
+        end = parse_datetime(end_date) if end_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use ISO format")
+
+    query = select(ThresholdExcursionModel)
+    if status == "open":
+        query = query.where(ThresholdExcursionModel.ended_at.is_(None))
+    elif status == "closed":
+        query = query.where(ThresholdExcursionModel.ended_at.isnot(None))
+    if point_id is not None:
+        query = query.where(ThresholdExcursionModel.id_point == point_id)
+    if start is not None:
+        query = query.where(or_(ThresholdExcursionModel.ended_at.is_(None), ThresholdExcursionModel.ended_at > start))
+    if end is not None:
+        query = query.where(ThresholdExcursionModel.started_at <= end)
+    query = query.order_by(ThresholdExcursionModel.started_at.desc(), ThresholdExcursionModel.id_excursion.desc())
+    return list(await db.scalars(query.offset(skip).limit(limit)))
@@ -0,0 +1,63 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+from typing import Dict, Any
+import logging
+
+from app.services.jobs import JOB_TYPES, JobQueueFull, job_manager
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+class JobRequest(BaseModel):
+    job_type: str  # calculated_data, custom_report, calculator, report
+    parameters: Dict[str, Any] = {}
+    format: str = "excel"
+
+def get_job_or_404(job_id: str) -> dict:
+    status = job_manager.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+@router.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    """
+    Поставить выгрузку или отчет в очередь фоновых задач
+    Возвращает id задачи; состояние - GET /jobs/{job_id}, результат - GET /jobs/{job_id}/result
+    """
+    try:
+        return job_manager.submit(request.job_type, request.parameters, request.format)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid job parameters: {str(e)}")
+
+@router.get("/jobs/types")
+async def get_job_types():
+    """Типы задач и форматы результата"""
+    return {job_type: list(formats) for job_type, formats in JOB_TYPES.items()}
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Состояние задачи: queued, running, done, failed; progress.rows - записано строк"""
+    return get_job_or_404(job_id)
+
+@router.get("/jobs/{job_id}/result")
+async def download_job_result(job_id: str):
+    """Скачать результат завершенной задачи"""
+    status = get_job_or_404(job_id)
+    if status["status"] == "failed":
+        raise HTTPException(status_code=409, detail=f"Job failed: {status.get('error')}")
+    if status["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Job is {status['status']}")
+    return FileResponse(job_manager.result_path(status), media_type=status["media_type"], filename=status["filename"])
+
+@router.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """Удалить задачу и ее результат (выполняющуюся задачу удалить нельзя)"""
+    status = get_job_or_404(job_id)
+    if status["status"] in ("queued", "running"):
+        raise HTTPException(status_code=409, detail=f"Job is {status['status']}")
+    job_manager.delete(job_id)
+    return {"message": "Job deleted successfully"}
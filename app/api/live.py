@@ -0,0 +1,154 @@
+from fastapi import APIRouter, Header, HTTPException, Query, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from typing import List, Optional
+import asyncio
+import logging
+
+from app.database import AsyncSessionLocal
+from app.services.live_feed import (
+    LIVE_HEARTBEAT_SECONDS,
+    LIVE_MAX_POINTS,
+    LiveHubFull,
+    LiveMessage,
+    Subscriber,
+    live_hub,
+    replay_messages,
+)
+from app.utils.time_buckets import parse_datetime
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+def check_point_ids(point_ids: List[int]) -> List[int]:
+    if not point_ids:
+        raise ValueError("point_ids is required")
+    if len(point_ids) > LIVE_MAX_POINTS:
+        raise ValueError(f"Too many points, maximum {LIVE_MAX_POINTS}")
+    return sorted(set(point_ids))
+
+async def subscribe_with_replay(point_ids: List[int], since: Optional[str], after_id: Optional[int]):
+    """
+    Подписаться и получить пропущенные сообщения; подписка оформляется до запроса
+    повтора, чтобы не потерять строки, записанные во время него
+    """
+    since_value = parse_datetime(since) if since else None
+    subscriber = live_hub.subscribe(point_ids)
+    try:
+        if since_value is None and after_id is None:
+            return subscriber, []
+        async with AsyncSessionLocal() as db:
+            return subscriber, await replay_messages(db, point_ids, since_value, after_id)
+    except Exception:
+        live_hub.unsubscribe(subscriber)
+        raise
+
+async def live_messages(subscriber: Subscriber, replay: List[LiveMessage], timeout: Optional[float] = None):
+    """Повтор, затем новые сообщения; строки из повтора, пришедшие и через очередь, пропускаются"""
+    replayed = {message.event_id for message in replay if message.event_id is not None}
+    for message in replay:
+        yield message
+    while True:
+        message = await subscriber.next(timeout)
+        if message is not None and message.event_id in replayed:
+            continue
+        yield message
+
+def format_sse(event: str, data: str, event_id: Optional[int] = None) -> str:
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {data}"]
+    return "\n".join(lines) + "\n\n"
+
+def dropped_data(count: int) -> str:
+    return f'{{"type": "dropped", "count": {count}}}'
+
+@router.get("/live/sse")
+async def live_sse(
+    point_ids: List[int] = Query(...),
+    since: Optional[str] = None,
+    last_event_id: Optional[int] = Header(None),
+):
+    """
+    Поток новых расчетных данных и превышений порога по точкам (Server-Sent Events)
+    События: reading (id события - id_data), excursion, dropped - клиент не успевал
+    читать и часть сообщений пропущена. Повтор при переподключении: since - строки
+    позже момента, заголовок Last-Event-ID - строки с id_data больше указанного.
+    """
+    try:
+        point_ids = check_point_ids(point_ids)
+        subscriber, replay = await subscribe_with_replay(point_ids, since, last_event_id)
+    except LiveHubFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def events():
+        try:
+            async for message in live_messages(subscriber, replay, LIVE_HEARTBEAT_SECONDS):
+                dropped = subscriber.take_dropped()
+                if dropped:
+                    yield format_sse("dropped", dropped_data(dropped))
+                if message is None:
+                    # Комментарий SSE: соединение живо
+                    yield ": ping\n\n"
+                    continue
+                yield format_sse(message.event, message.data, message.event_id)
+        finally:
+            live_hub.unsubscribe(subscriber)
+
+    # Генератор может не запуститься (клиент отключился до первого события) и его finally не выполнится:
+    # подписка снимается и после отправки ответа
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    }, background=BackgroundTask(live_hub.unsubscribe, subscriber))
+
+@router.websocket("/live/ws")
+async def live_websocket(
+    websocket: WebSocket,
+    point_ids: List[int] = Query(...),
+    since: Optional[str] = None,
+    after_id: Optional[int] = None,
+):
+    """
+    Поток новых расчетных данных и превышений порога по точкам (WebSocket)
+    Сообщения - JSON с полем type: reading, excursion, dropped.
+    Повтор при переподключении: since или after_id (id_data последнего полученного показания).
+    """
+    try:
+        point_ids = check_point_ids(point_ids)
+        subscriber, replay = await subscribe_with_replay(point_ids, since, after_id)
+    except (LiveHubFull, ValueError) as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e))
+        return
+
+    await websocket.accept()
+
+    async def send():
+        async for message in live_messages(subscriber, replay):
+            dropped = subscriber.take_dropped()
+            if dropped:
+                await websocket.send_text(dropped_data(dropped))
+            await websocket.send_text(message.data)
+
+    async def receive():
+        # Сообщения клиента не используются; чтение нужно, чтобы заметить отключение
+        while True:
+            await websocket.receive_text()
+
+    tasks = [asyncio.ensure_future(send()), asyncio.ensure_future(receive())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled() and task.exception() is not None \
+                    and not isinstance(task.exception(), WebSocketDisconnect):
+                logger.warning(f"Live websocket closed with error: {task.exception()}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        live_hub.unsubscribe(subscriber)
+
+@router.get("/live/stats")
+async def live_stats():
+    """Подписчики и счетчики рассылки текущего процесса"""
+    return live_hub.stats()
@@ -1,135 +1,179 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
 
-from app.database import get_db
-from app.models.models import MeasuringPoint as MeasuringPointModel, CalculatedData as CalculatedDataModel
+from app.database import get_async_db
+from app.models.models import CalculatedData as CalculatedDataModel
 from app.schemas.schemas import MeasuringPoint as MeasuringPointSchema, MeasuringPointCreate, MeasuringPointUpdate, CalculatedData as CalculatedDataSchema
 from app.crud.crud import crud_measuring_point, crud_calculated_data
+from app.utils.pagination import next_cursor_headers, set_next_cursor
+from app.services import archive
+from app.services.cache import response_cache, cache_key, point_tag
+from app.services.hierarchy import hierarchy_cache
+from app.services.lean_read import DATA_SELECT_COLUMNS, rows_response
+from app.services.name_search import search_points
 
 router = APIRouter()
 
+# Столбцы статистики точки (count и sum в порядке archive.totals)
+STATISTICS_COLUMNS = ("parametr_ttr", "parametr_q", "parametr_q_H2O", "parametr_q_H2O_porog")
+
 # Базовые CRUD операции
 @router.get("/measuring-points/", response_model=List[MeasuringPointSchema])
-def get_measuring_points(
+async def get_measuring_points(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Получить список всех точек измерений с пагинацией"""
-    return crud_measuring_point.get_all(db, skip=skip, limit=limit)
+    """Получить список всех точек измерений с пагинацией (курсор в X-Next-Cursor)"""
+    try:
+        points = await crud_measuring_point.get_all(db, skip=skip, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    set_next_cursor(response, points, limit, crud_measuring_point.cursor_key)
+    return points
 
-@router.get("/measuring-points/{point_id}", response_model=MeasuringPointSchema)
-def get_measuring_point(point_id: int, db: Session = Depends(get_db)):
+@router.get("/measuring-points/{point_id:int}", response_model=MeasuringPointSchema)
+async def get_measuring_point(point_id: int, db: AsyncSession = Depends(get_async_db)):
     """Получить детальную информацию о точке измерения по ID"""
-    point = crud_measuring_point.get(db, point_id)
+    point = await crud_measuring_point.get(db, point_id)
     if not point:
         raise HTTPException(status_code=404, detail="Measuring point not found")
     return point
 
 @router.post("/measuring-points/", response_model=MeasuringPointSchema)
-def create_measuring_point(
+async def create_measuring_point(
     point: MeasuringPointCreate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Создать новую точку измерения"""
-    # Проверяем нет ли точки с таким ID
-    if crud_measuring_point.get(db, point.id_point):
-        raise HTTPException(status_code=400, detail="Point with this ID already exists")
-    return crud_measuring_point.create(db, point)
-
-@router.put("/measuring-points/{point_id}", response_model=MeasuringPointSchema)
-def update_measuring_point(
+    """Создать новую точку измерения (id_point генерируется автоматически)"""
+    return await crud_measuring_point.create(db, point)
+
+@router.put("/measuring-points/{point_id:int}", response_model=MeasuringPointSchema)
+async def update_measuring_point(
     point_id: int,
     point_update: MeasuringPointUpdate,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Обновить информацию о точке измерения"""
-    updated = crud_measuring_point.update(db, point_id, point_update)
+    parent_id = point_update.id_parent_point
+    if parent_id is not None:
+        index = await hierarchy_cache.get(db)
+        # Новый родитель не может быть самой точкой или ее потомком - иначе в иерархии цикл
+        if parent_id == point_id or parent_id in index.descendant_ids(point_id):
+            raise HTTPException(status_code=400, detail="Parent point cannot be the point itself or its descendant")
+    updated = await crud_measuring_point.update(db, point_id, point_update)
     if not updated:
         raise HTTPException(status_code=404, detail="Measuring point not found")
     return updated
 
-@router.delete("/measuring-points/{point_id}")
-def delete_measuring_point(point_id: int, db: Session = Depends(get_db)):
+@router.delete("/measuring-points/{point_id:int}")
+async def delete_measuring_point(point_id: int, db: AsyncSession = Depends(get_async_db)):
     """Удалить точку измерения"""
-    if not crud_measuring_point.delete(db, point_id):
+    if not await crud_measuring_point.delete(db, point_id):
         raise HTTPException(status_code=404, detail="Measuring point not found")
     return {"message": "Measuring point deleted successfully"}
 
 # Специальные операции для точек
 @router.get("/measuring-points/{point_id}/calculated-data", response_model=List[CalculatedDataSchema])
-def get_point_calculated_data(
+async def get_point_calculated_data(
     point_id: int,
     skip: int = 0,
     limit: int = 100,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Получить все расчетные данные для конкретной точки"""
+    """Получить все расчетные данные для конкретной точки (курсор в X-Next-Cursor)"""
     # Проверяем существует ли точка
-    if not crud_measuring_point.get(db, point_id):
+    if not await crud_measuring_point.get(db, point_id):
         raise HTTPException(status_code=404, detail="Measuring point not found")
-    return crud_calculated_data.get_by_point(db, point_id, skip, limit)
+    try:
+        rows = await crud_calculated_data.get_by_point(db, point_id, skip, limit, cursor, columns=DATA_SELECT_COLUMNS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return rows_response(rows, next_cursor_headers(rows, limit, crud_calculated_data.cursor_key))
 
 @router.get("/measuring-points/tree")
-def get_measuring_points_tree(db: Session = Depends(get_db)):
-    """Получить иерархию точек измерений (родитель-потомок)"""
-    points = crud_measuring_point.get_all(db)
-    # Строим дерево
-    tree = []
-    for point in points:
-        if point.id_parent_point is None:
-            tree.append({
-                "point": MeasuringPointSchema.from_orm(point),
-                "children": [
-                    MeasuringPointSchema.from_orm(child) for child in points
-                    if child.id_parent_point == point.id_point
-                ]
-            })
-    return tree
+async def get_measuring_points_tree(db: AsyncSession = Depends(get_async_db)):
+    """Получить полную иерархию точек измерений (родитель-потомок на любую глубину)"""
+    index = await hierarchy_cache.get(db)
+    return Response(content=index.tree_json(), media_type="application/json")
+
+async def get_hierarchy_index(db: AsyncSession, point_id: int):
+    index = await hierarchy_cache.get(db)
+    if point_id not in index:
+        raise HTTPException(status_code=404, detail="Measuring point not found")
+    return index
+
+@router.get("/measuring-points/{point_id:int}/subtree")
+async def get_measuring_point_subtree(point_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Получить поддерево точки измерения со всеми потомками"""
+    index = await get_hierarchy_index(db, point_id)
+    return index.subtree(point_id)
+
+@router.get("/measuring-points/{point_id:int}/ancestors", response_model=List[MeasuringPointSchema])
+async def get_measuring_point_ancestors(point_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Получить цепочку родителей точки (от корня к непосредственному родителю)"""
+    index = await get_hierarchy_index(db, point_id)
+    return index.ancestors(point_id)
+
+@router.get("/measuring-points/{point_id:int}/descendants", response_model=List[MeasuringPointSchema])
+async def get_measuring_point_descendants(point_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Получить всех потомков точки (обход в ширину)"""
+    index = await get_hierarchy_index(db, point_id)
+    return index.descendants(point_id)
 
 @router.get("/measuring-points/search", response_model=List[MeasuringPointSchema])
-def search_measuring_points(
+async def search_measuring_points(
     query: str,
     skip: int = 0,
     limit: int = 50,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Поиск точек измерений по названию"""
-    points = db.query(MeasuringPointModel).filter(
-        MeasuringPointModel.name_point.ilike(f"%{query}%")
-    ).offset(skip).limit(limit).all()
-    return points
+    """Поиск точек измерений по названию (без учета регистра и ё/е, по убыванию сходства)"""
+    return await search_points(db, query, skip, limit)
 
 @router.get("/measuring-points/{point_id}/statistics")
-def get_point_statistics(point_id: int, db: Session = Depends(get_db)):
-    """Получить статистику по точке измерения"""
-    point = crud_measuring_point.get(db, point_id)
+async def get_point_statistics(point_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Получить статистику по точке измерения (кэшируется до изменения данных точки)"""
+    key = cache_key("/measuring-points/statistics", point_id=point_id)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+    point = await crud_measuring_point.get(db, point_id)
     if not point:
         raise HTTPException(status_code=404, detail="Measuring point not found")
-    # Статистика по расчетным данным
-    data_stats = db.execute(text("""
+    # Статистика по расчетным данным: итоги таблицы и холодного архива (порядок - archive.totals)
+    table_stats = (await db.execute(text("""
         SELECT 
             COUNT(*) as total_records,
-            AVG(parametr_ttr) as avg_ttr,
-            AVG(parametr_q) as avg_q,
-            AVG(parametr_q_H2O) as avg_q_H2O,
-            AVG(parametr_q_H2O_porog) as avg_q_H2O_porog,
             MIN(data_and_time) as first_record,
-            MAX(data_and_time) as last_record
+            MAX(data_and_time) as last_record,
+            COUNT(parametr_ttr), SUM(parametr_ttr),
+            COUNT(parametr_q), SUM(parametr_q),
+            COUNT(parametr_q_H2O), SUM(parametr_q_H2O),
+            COUNT(parametr_q_H2O_porog), SUM(parametr_q_H2O_porog)
         FROM "Calculated_data" 
         WHERE id_point = :point_id
-    """), {"point_id": point_id}).first()
-    return {
+    """), {"point_id": point_id})).first()
+    stats = [table_stats]
+    files = archive.archive_files()
+    if files:
+        stats.append(await run_in_threadpool(archive.totals, STATISTICS_COLUMNS, files, [point_id]))
+    data_stats = archive.merge_totals(stats)
+    return response_cache.set(key, {
         "point_info": MeasuringPointSchema.from_orm(point),
         "statistics": {
             "total_records": data_stats[0],
-            "average_ttr": float(data_stats[1]) if data_stats[1] else 0,
-            "average_q": float(data_stats[2]) if data_stats[2] else 0,
-            "average_q_H2O": float(data_stats[3]) if data_stats[3] else 0,
-            "average_q_H2O_porog": float(data_stats[4]) if data_stats[4] else 0,
-            "first_record": data_stats[5],
-            "last_record": data_stats[6]
+            "average_ttr": archive.average(*data_stats[3:5]),
+            "average_q": archive.average(*data_stats[5:7]),
+            "average_q_H2O": archive.average(*data_stats[7:9]),
+            "average_q_H2O_porog": archive.average(*data_stats[9:11]),
+            "first_record": data_stats[1],
+            "last_record": data_stats[2]
         }
-    }
\ No newline at end of file
+    }, tags=[point_tag(point_id)])
\ No newline at end of file
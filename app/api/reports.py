@@ -1,20 +1,39 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from pydantic import BaseModel
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 from datetime import datetime, timedelta
+import asyncio
 import logging
 
-from app.database import get_db
+from app.database import get_async_db
+from app.models.models import MeasuringPoint
+from app.services import water_balance, water_intrusion
+from app.services.process_pool import PROCESS_POOL_WORKERS, run_in_process
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+
+def parse_report_date(value: str, end_of_range: bool = False) -> datetime:
+    """Дата ISO; дата без времени для конца периода включает весь день"""
+    parsed = datetime.fromisoformat(value)
+    if end_of_range and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
 # Схемы для запросов и ответов
 class WaterIntrusionRequest(BaseModel):
     start_date: str
     end_date: str
     duration: str = "last_month"
+    # None - все точки
+    point_ids: Optional[List[int]] = None
+    window: int = Field(water_intrusion.WATER_INTRUSION_WINDOW, ge=2, le=1000)
+    min_severity: float = Field(water_intrusion.WATER_INTRUSION_MIN_SEVERITY, gt=0)
+    limit: Optional[int] = Field(None, ge=1)
 
 class InputOutputSummaryRequest(BaseModel):
     input_point_ids: List[int]
@@ -27,31 +46,36 @@ class InputOutputSummaryRequest(BaseModel):
 @router.post("/reports/water-intrusion-events")
 async def find_water_intrusion_events(
     request: WaterIntrusionRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Отчет 'Поиск места попадания воды'"""
+    """
+    Отчет 'Поиск места попадания воды'
+    Ступенчатый рост ТТР или расхода воды по каждой точке за период,
+    события упорядочены по значимости (см. app/services/water_intrusion.py)
+    """
     try:
-        # Временная заглушка с тестовыми данными
-        mock_events = [
-            {
-                "event_date": "2024-01-01 08:00",
-                "location": "Шекснинское ЛПУМГ",
-                "description": "Выключен из работы участок 251-291 км г/п Грязовец-Ленинград 1",
-                "event_code": "315",
-                "event_type": "Останов-пуск участков"
-            },
-            {
-                "event_date": "2024-01-02 14:30",
-                "location": "Вуктыльское ЛПУМГ",
-                "description": "МГ «В-У-2» приступили к продувке и заполнению участка 2,6-35 км",
-                "event_code": "315",
-                "event_type": "Останов-пуск участков"
-            }
-        ]
+        start = parse_report_date(request.start_date)
+        end = parse_report_date(request.end_date, end_of_range=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use ISO format (YYYY-MM-DD)")
+    try:
+        points_table = MeasuringPoint.__table__
+        points_query = select(points_table.c.id_point, points_table.c.name_point)
+        if request.point_ids is not None:
+            points_query = points_query.where(points_table.c.id_point.in_(request.point_ids))
+        names = {point_id: name for point_id, name in await db.execute(points_query)}
+
+        groups = water_intrusion.split_points(sorted(names), PROCESS_POOL_WORKERS * 4)
+        results = await asyncio.gather(*[
+            run_in_process(water_intrusion.scan_points, group, start, end, request.window, request.min_severity)
+            for group in groups
+        ])
+        events = water_intrusion.rank_events([event for result in results for event in result], names, request.limit)
         return {
             "report_period": f"{request.start_date} - {request.end_date}",
-            "events_found": len(mock_events),
-            "events": mock_events,
+            "points_scanned": len(names),
+            "events_found": len(events),
+            "events": events,
             "generated_at": datetime.now().isoformat()
         }
     except Exception as e:
@@ -61,44 +85,34 @@ async def find_water_intrusion_events(
 @router.post("/reports/input-output-summary")
 async def get_input_output_summary(
     request: InputOutputSummaryRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """Сводка по группам точек 'вход/выход'"""
+    """
+    Сводка по группам точек 'вход/выход'
+    Средние ТТР, объем, влагосодержание и масса воды по точкам и группам
+    с передискретизацией к data_interval (hourly/daily)
+    """
+    granularity = water_balance.DATA_INTERVALS.get(request.data_interval)
+    if granularity is None:
+        raise HTTPException(status_code=400, detail=f"Unsupported data_interval. Use one of: {', '.join(water_balance.DATA_INTERVALS)}")
+    try:
+        start = parse_report_date(request.start_date)
+        end = parse_report_date(request.end_date, end_of_range=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use ISO format (YYYY-MM-DD)")
     try:
-        # Временная заглушка с тестовыми данными
-        summary_data = {
-            "summary": {
-                "input_points_count": len(request.input_point_ids),
-                "output_points_count": len(request.output_point_ids),
-                "input_total_water": 1250.75,
-                "output_total_water": 1180.45,
-                "water_difference": -70.3,
-                "avg_input_dew_point": -13.2,
-                "avg_output_dew_point": -12.1,
-                "dew_point_difference": 1.1
-            },
-            "input_points": [
-                {
-                    "point_id": point_id,
-                    "avg_dew_point": -13.2,
-                    "avg_volume": 625.38,
-                    "avg_water_content": 0.052
-                }
-                for point_id in request.input_point_ids
-            ],
-            "output_points": [
-                {
-                    "point_id": point_id,
-                    "avg_dew_point": -12.1,
-                    "avg_volume": 590.23,
-                    "avg_water_content": 0.048
-                }
-                for point_id in request.output_point_ids
-            ],
-            "period": {
-                "start_date": request.start_date,
-                "end_date": request.end_date
-            }
+        summary_data = await db.run_sync(
+            water_balance.balance_report,
+            request.input_point_ids,
+            request.output_point_ids,
+            start,
+            end,
+            granularity
+        )
+        summary_data["period"] = {
+            "start_date": request.start_date,
+            "end_date": request.end_date,
+            "data_interval": request.data_interval
         }
         return summary_data
     except Exception as e:
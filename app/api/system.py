@@ -1,20 +1,24 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Response
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 import datetime
 import sys
 import fastapi
 
-from app.database import get_db
+from app.database import get_async_db, pool_status
+from app.services.cache import response_cache
+from app.services.metrics import collect_database_metrics
+from app.services.report_engine import plan_cache_stats
 
 router = APIRouter()
 
 @router.get("/health")
-def health_check(db: Session = Depends(get_db)):
+async def health_check(db: AsyncSession = Depends(get_async_db)):
     """Проверка здоровья приложения и базы данных"""
     try:
         # Проверяем подключение к БД
-        db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT 1"))
         db_status = "healthy"
     except Exception as e:
         db_status = f"unhealthy: {str(e)}"
@@ -35,20 +39,21 @@ def get_version():
     }
 
 @router.get("/metrics")
-def get_metrics(db: Session = Depends(get_db)):
-    """Метрики для мониторинга (Prometheus format)"""
-    # Количество точек
-    points_count = db.execute(text('SELECT COUNT(*) FROM "Measuring_point"')).scalar()
-    # Количество данных
-    data_count = db.execute(text('SELECT COUNT(*) FROM "Calculated_data"')).scalar()
-    # Последняя запись
-    last_record = db.execute(text('SELECT MAX(data_and_time) FROM "Calculated_data"')).scalar()
-    return {
-        "points_total": points_count,
-        "data_total": data_count,
-        "last_record_time": last_record.isoformat() if last_record else None,
-        "uptime": "TODO"  # Можно добавить время работы
-    }
+async def get_metrics(db: AsyncSession = Depends(get_async_db)):
+    """Метрики для мониторинга (Prometheus text format)"""
+    await collect_database_metrics(db)
+    # Content-Type задается заголовком: media_type="text/..." получил бы второй charset
+    return Response(content=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+@router.get("/cache/stats")
+def get_cache_stats():
+    """Статистика кэша ответов и кэша планов отчетов (попадания и промахи считаются в текущем процессе)"""
+    return {**response_cache.stats(), "report_plans": plan_cache_stats()}
+
+@router.get("/db/pool")
+def get_db_pool_status():
+    """Состояние пулов соединений: занятые/свободные соединения, ожидание выдачи, таймауты"""
+    return pool_status()
 
 @router.get("/config")
 def get_config():
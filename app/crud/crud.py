@@ -1,65 +1,238 @@
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, tuple_
+from datetime import datetime
+from sqlalchemy.exc import SQLAlchemyError
+from typing import List, Optional, Sequence, Tuple, Dict, Any
 from app.models.models import MeasuringPoint, CalculatedData
 from app.schemas.schemas import MeasuringPointCreate, MeasuringPointUpdate, CalculatedDataCreate, CalculatedDataUpdate
+from app.utils.pagination import decode_cursor
+from app.services import rollups
+from app.services.excursions import excursion_engine
+from app.services.live_feed import live_hub
+from app.services.cache import response_cache, calculated_data_tags, measuring_point_tags
+from app.services.hierarchy import hierarchy_cache
+from app.services.name_search import name_search_cache
+from app.services.water_mass import fill_q_h2o
+
+# Размер пачки для пакетной вставки (одна команда INSERT ... VALUES на пачку)
+BULK_CHUNK_SIZE = 1000
+
+def model_values(model, data: Dict[str, Any]) -> Dict[str, Any]:
+    """Оставить только поля, которые есть в таблице модели (в схемах есть дополнительные поля)"""
+    columns = model.__table__.columns.keys()
+    return {field: value for field, value in data.items() if field in columns}
+
+def row_values(obj) -> Dict[str, Any]:
+    """Значения столбцов таблицы объекта модели"""
+    return {column: getattr(obj, column) for column in type(obj).__table__.columns.keys()}
+
+def excursion_sample(values: Dict[str, Any]) -> tuple:
+    """Отсчет для проверки порога расхода воды из значений строки Calculated_data"""
+    return (values.get("id_point"), values.get("data_and_time"), values.get("parametr_q_H2O"), values.get("parametr_q_H2O_porog"))
 
 class CRUDMeasuringPoint:
-    def get(self, db: Session, id_point: int) -> Optional[MeasuringPoint]:
-        return db.query(MeasuringPoint).filter(MeasuringPoint.id_point == id_point).first()
-    def get_all(self, db: Session, skip: int = 0, limit: int = 100) -> List[MeasuringPoint]:
-        return db.query(MeasuringPoint).offset(skip).limit(limit).all()
-    def get_by_parent(self, db: Session, parent_id: int) -> List[MeasuringPoint]:
-        return db.query(MeasuringPoint).filter(MeasuringPoint.id_parent_point == parent_id).all()
-    def create(self, db: Session, measuring_point: MeasuringPointCreate) -> MeasuringPoint:
-        db_measuring_point = MeasuringPoint(**measuring_point.dict())
+    async def get(self, db: AsyncSession, id_point: int) -> Optional[MeasuringPoint]:
+        return await db.get(MeasuringPoint, id_point)
+    async def get_all(self, db: AsyncSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None) -> List[MeasuringPoint]:
+        """Точки по возрастанию id_point; cursor - keyset-пагинация вместо skip"""
+        query = select(MeasuringPoint).order_by(MeasuringPoint.id_point)
+        if cursor:
+            (last_id,) = decode_cursor(cursor, (int,))
+            query = query.where(MeasuringPoint.id_point > last_id)
+        else:
+            query = query.offset(skip)
+        return list(await db.scalars(query.limit(limit)))
+    @staticmethod
+    def cursor_key(point: MeasuringPoint) -> tuple:
+        return (point.id_point,)
+    async def get_existing_ids(self, db: AsyncSession, ids: List[int]) -> set:
+        if not ids:
+            return set()
+        return set(await db.scalars(select(MeasuringPoint.id_point).where(MeasuringPoint.id_point.in_(ids))))
+    async def get_by_parent(self, db: AsyncSession, parent_id: int) -> List[MeasuringPoint]:
+        return list(await db.scalars(select(MeasuringPoint).where(MeasuringPoint.id_parent_point == parent_id)))
+    async def create(self, db: AsyncSession, measuring_point: MeasuringPointCreate) -> MeasuringPoint:
+        db_measuring_point = MeasuringPoint(**model_values(MeasuringPoint, measuring_point.dict()))
         db.add(db_measuring_point)
-        db.commit()
-        db.refresh(db_measuring_point)
+        await db.commit()
+        await db.refresh(db_measuring_point)
+        response_cache.invalidate(measuring_point_tags(db_measuring_point.id_point))
+        hierarchy_cache.invalidate()
+        name_search_cache.invalidate()
         return db_measuring_point
-    def update(self, db: Session, id_point: int, measuring_point: MeasuringPointUpdate) -> Optional[MeasuringPoint]:
-        db_measuring_point = self.get(db, id_point)
+    async def update(self, db: AsyncSession, id_point: int, measuring_point: MeasuringPointUpdate) -> Optional[MeasuringPoint]:
+        db_measuring_point = await self.get(db, id_point)
         if db_measuring_point:
-            update_data = measuring_point.dict(exclude_unset=True)
+            update_data = model_values(MeasuringPoint, measuring_point.dict(exclude_unset=True))
             for field, value in update_data.items():
                 setattr(db_measuring_point, field, value)
-            db.commit()
-            db.refresh(db_measuring_point)
+            await db.commit()
+            await db.refresh(db_measuring_point)
+            response_cache.invalidate(measuring_point_tags(id_point))
+            hierarchy_cache.invalidate()
+            name_search_cache.invalidate()
         return db_measuring_point
-    def delete(self, db: Session, id_point: int) -> bool:
-        db_measuring_point = self.get(db, id_point)
+    async def delete(self, db: AsyncSession, id_point: int) -> bool:
+        db_measuring_point = await self.get(db, id_point)
         if db_measuring_point:
-            db.delete(db_measuring_point)
-            db.commit()
+            await db.delete(db_measuring_point)
+            await db.commit()
+            response_cache.invalidate(measuring_point_tags(id_point))
+            hierarchy_cache.invalidate()
+            name_search_cache.invalidate()
             return True
         return False
 
 class CRUDCalculatedData:
-    def get(self, db: Session, id_data: int) -> Optional[CalculatedData]:
-        return db.query(CalculatedData).filter(CalculatedData.id_data == id_data).first()
-    def get_all(self, db: Session, skip: int = 0, limit: int = 100) -> List[CalculatedData]:
-        return db.query(CalculatedData).offset(skip).limit(limit).all()
-    def get_by_point(self, db: Session, id_point: int, skip: int = 0, limit: int = 100) -> List[CalculatedData]:
-        return db.query(CalculatedData).filter(CalculatedData.id_point == id_point).offset(skip).limit(limit).all()
-    def create(self, db: Session, calculated_data: CalculatedDataCreate) -> CalculatedData:
-        db_calculated_data = CalculatedData(**calculated_data.dict())
+    async def get(self, db: AsyncSession, id_data: int) -> Optional[CalculatedData]:
+        return await db.get(CalculatedData, id_data)
+    async def get_all(self, db: AsyncSession, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, columns: Optional[Sequence] = None) -> List[CalculatedData]:
+        return await self._paginate(db, select(CalculatedData), skip, limit, cursor, columns)
+    async def get_by_point(self, db: AsyncSession, id_point: int, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, columns: Optional[Sequence] = None) -> List[CalculatedData]:
+        return await self._paginate(db, select(CalculatedData).where(CalculatedData.id_point == id_point), skip, limit, cursor, columns)
+    async def _paginate(self, db: AsyncSession, query, skip: int, limit: int, cursor: Optional[str], columns: Optional[Sequence] = None) -> List[CalculatedData]:
+        """
+        Стабильный порядок (data_and_time, id_data), строки без времени - в конце
+        по id_data. При наличии cursor страница начинается после ключа из токена
+        (keyset), skip игнорируется. columns - строки Core с этими столбцами вместо объектов ORM
+        """
+        async def fetch(page_query) -> list:
+            if columns is not None:
+                return list(await db.execute(page_query.with_only_columns(*columns)))
+            return list(await db.scalars(page_query))
+
+        untimed = query.where(CalculatedData.data_and_time.is_(None)).order_by(CalculatedData.id_data)
+        if not cursor:
+            return await fetch(
+                query.order_by(CalculatedData.data_and_time.nulls_last(), CalculatedData.id_data).offset(skip).limit(limit)
+            )
+        last_time, last_id = decode_cursor(cursor, (datetime, int))
+        if last_time is None:
+            return await fetch(untimed.where(CalculatedData.id_data > last_id).limit(limit))
+        # Сравнение строк с NULL не выполняется, поэтому строки без времени дочитываются отдельным запросом
+        rows = await fetch(
+            query.where(tuple_(CalculatedData.data_and_time, CalculatedData.id_data) > tuple_(last_time, last_id))
+            .order_by(CalculatedData.data_and_time, CalculatedData.id_data)
+            .limit(limit)
+        )
+        if len(rows) < limit:
+            rows += await fetch(untimed.limit(limit - len(rows)))
+        return rows
+    @staticmethod
+    def cursor_key(data: CalculatedData) -> tuple:
+        return (data.data_and_time, data.id_data)
+    async def create(self, db: AsyncSession, calculated_data: CalculatedDataCreate, derive_q_h2o: bool = False) -> CalculatedData:
+        values = model_values(CalculatedData, calculated_data.dict())
+        if derive_q_h2o:
+            fill_q_h2o([values])
+        db_calculated_data = CalculatedData(**values)
         db.add(db_calculated_data)
-        db.commit()
-        db.refresh(db_calculated_data)
+        await db.flush()
+        key = (db_calculated_data.id_point, db_calculated_data.data_and_time)
+        await db.run_sync(rollups.refresh, [key])
+        async with excursion_engine.stage(db, samples=[excursion_sample(values)]) as excursions:
+            await db.commit()
+        response_cache.invalidate(calculated_data_tags([key]))
+        await db.refresh(db_calculated_data)
+        live_hub.publish_changes([row_values(db_calculated_data)], excursions)
         return db_calculated_data
-    def update(self, db: Session, id_data: int, calculated_data: CalculatedDataUpdate) -> Optional[CalculatedData]:
-        db_calculated_data = self.get(db, id_data)
+    async def create_bulk(
+        self,
+        db: AsyncSession,
+        items: List[CalculatedDataCreate],
+        return_rows: bool = True,
+        chunk_size: int = BULK_CHUNK_SIZE,
+        derive_q_h2o: bool = False
+    ) -> Tuple[int, list, List[Dict[str, Any]]]:
+        """
+        Пакетная вставка в одной транзакции: существование точек проверяется
+        одним запросом, строки вставляются пачками через executemany (с RETURNING,
+        если нужны созданные строки). Ошибочные строки не прерывают загрузку,
+        а возвращаются в списке ошибок. Возвращает (вставлено, строки, ошибки).
+        derive_q_h2o - расход воды рассчитывается по ТТР и объему для всей пачки сразу.
+        """
+        table = CalculatedData.__table__
+        errors = []
+        existing_points = await crud_measuring_point.get_existing_ids(db, list({item.id_point for item in items}))
+        
+        pending = []
+        for index, item in enumerate(items):
+            if item.id_point not in existing_points:
+                errors.append({"index": index, "id_point": item.id_point, "detail": "Measuring point not found"})
+                continue
+            pending.append((index, model_values(CalculatedData, item.dict())))
+        if derive_q_h2o:
+            fill_q_h2o([params for _, params in pending])
+        
+        stmt = insert(table)
+        # Созданные строки нужны и для рассылки подписчикам (app/services/live_feed.py)
+        returning = return_rows or live_hub.has_subscribers()
+        if returning:
+            stmt = stmt.returning(*table.columns, sort_by_parameter_order=True)
+        
+        inserted = 0
+        written_rows = []
+        written_keys = []
+        samples = []
+        for start in range(0, len(pending), chunk_size):
+            chunk = pending[start:start + chunk_size]
+            try:
+                async with db.begin_nested():
+                    result = await db.execute(stmt, [params for _, params in chunk])
+                    if returning:
+                        written_rows.extend(result.all())
+                inserted += len(chunk)
+                written_keys.extend((params["id_point"], params["data_and_time"]) for _, params in chunk)
+                samples.extend(excursion_sample(params) for _, params in chunk)
+            except SQLAlchemyError:
+                # Пачка откатилась до точки сохранения - повторяем построчно, чтобы найти ошибочные строки
+                for index, params in chunk:
+                    try:
+                        async with db.begin_nested():
+                            result = await db.execute(stmt, [params])
+                            if returning:
+                                written_rows.extend(result.all())
+                        inserted += 1
+                        written_keys.append((params["id_point"], params["data_and_time"]))
+                        samples.append(excursion_sample(params))
+                    except SQLAlchemyError as e:
+                        errors.append({"index": index, "id_point": params["id_point"], "detail": str(getattr(e, "orig", e))})
+        
+        await db.run_sync(rollups.refresh, written_keys)
+        async with excursion_engine.stage(db, samples=samples) as excursions:
+            await db.commit()
+        if written_keys:
+            response_cache.invalidate(calculated_data_tags(written_keys))
+        live_hub.publish_changes([row._mapping for row in written_rows], excursions)
+        errors.sort(key=lambda error: error["index"])
+        return inserted, written_rows if return_rows else [], errors
+    async def update(self, db: AsyncSession, id_data: int, calculated_data: CalculatedDataUpdate) -> Optional[CalculatedData]:
+        db_calculated_data = await self.get(db, id_data)
         if db_calculated_data:
-            update_data = calculated_data.dict(exclude_unset=True)
+            old_key = (db_calculated_data.id_point, db_calculated_data.data_and_time)
+            update_data = model_values(CalculatedData, calculated_data.dict(exclude_unset=True))
             for field, value in update_data.items():
                 setattr(db_calculated_data, field, value)
-            db.commit()
-            db.refresh(db_calculated_data)
+            await db.flush()
+            keys = [old_key, (db_calculated_data.id_point, db_calculated_data.data_and_time)]
+            await db.run_sync(rollups.refresh, keys)
+            async with excursion_engine.stage(db, changed=keys) as excursions:
+                await db.commit()
+            live_hub.publish_changes(excursions=excursions)
+            response_cache.invalidate(calculated_data_tags(keys))
+            await db.refresh(db_calculated_data)
         return db_calculated_data
-    def delete(self, db: Session, id_data: int) -> bool:
-        db_calculated_data = self.get(db, id_data)
+    async def delete(self, db: AsyncSession, id_data: int) -> bool:
+        db_calculated_data = await self.get(db, id_data)
         if db_calculated_data:
-            db.delete(db_calculated_data)
-            db.commit()
+            key = (db_calculated_data.id_point, db_calculated_data.data_and_time)
+            await db.delete(db_calculated_data)
+            await db.flush()
+            await db.run_sync(rollups.refresh, [key])
+            async with excursion_engine.stage(db, changed=[key]) as excursions:
+                await db.commit()
+            live_hub.publish_changes(excursions=excursions)
+            response_cache.invalidate(calculated_data_tags([key]))
             return True
         return False
 
@@ -17,12 +17,20 @@ from app.api import (
     system,
     calculator,
     reports,
-    export
+    export,
+    jobs,
+    excursions,
+    live
 )
-from app.database import engine, Base
+from app.database import engine, async_engine, Base
+from app.services.metrics import MetricsMiddleware, instrument_engine
+from app.services.jobs import job_manager
+from app.services.process_pool import shutdown_process_pool
 
-# Создаем таблицы в базе данных
-Base.metadata.create_all(bind=engine)
+# Схема БД ведется миграциями (alembic upgrade head); create_all оставлен
+# для локальной разработки и включается переменной DB_AUTO_CREATE_SCHEMA
+if os.getenv("DB_AUTO_CREATE_SCHEMA", "false").lower() == "true":
+    Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="Gas Humidity Calculation System API",
@@ -39,8 +47,30 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+@app.on_event("shutdown")
+async def dispose_async_engine():
+    """Закрыть соединения асинхронного пула при остановке приложения"""
+    await async_engine.dispose()
+
+@app.on_event("startup")
+async def start_job_cleanup():
+    """Периодическая очистка каталога фоновых задач"""
+    job_manager.start_cleanup()
+
+@app.on_event("shutdown")
+def stop_process_pool():
+    """Остановить очистку задач и пул процессов отчетов"""
+    job_manager.stop_cleanup()
+    shutdown_process_pool()
+
+# Метрики Prometheus (GET /metrics): задержки по маршрутам и длительность SQL
+app.add_middleware(MetricsMiddleware)
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+
 # Подключаем все роутеры
 app.include_router(measuring_points.router, prefix="/api/v1", tags=["Точки измерений"])
 app.include_router(calculated_data.router, prefix="/api/v1", tags=["Расчетные данные"])
@@ -48,6 +78,9 @@ app.include_router(analytics.router, prefix="/api/v1", tags=["Аналитика
 app.include_router(calculator.router, prefix="/api/v1", tags=["Калькулятор влажности"])
 app.include_router(reports.router, prefix="/api/v1", tags=["Специализированные отчеты"])
 app.include_router(export.router, prefix="/api/v1", tags=["Экспорт данных"])
+app.include_router(jobs.router, prefix="/api/v1", tags=["Фоновые задачи"])
+app.include_router(excursions.router, prefix="/api/v1", tags=["Превышения порогов"])
+app.include_router(live.router, prefix="/api/v1", tags=["Поток данных"])
 app.include_router(system.router, tags=["Система"])
 
 @app.get("/")
@@ -63,6 +96,9 @@ def read_root():
             "Калькулятор влажности",
             "Специализированные отчеты",
             "Экспорт данных",
+            "Фоновые задачи",
+            "Превышения порогов",
+            "Поток данных",
             "Системa"
         ]
     }
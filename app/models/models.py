@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean, Float
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Boolean, Float, Index, text
 from sqlalchemy.orm import relationship
 from app.database import Base
 
@@ -25,4 +25,50 @@ class CalculatedData(Base):
     parametr_q_H2O_porog = Column(Float)
     id_point = Column(Integer, ForeignKey("Measuring_point.id_point"))
     # Связь с точкой измерения
-    measuring_point = relationship("MeasuringPoint", back_populates="calculated_data")
\ No newline at end of file
+    measuring_point = relationship("MeasuringPoint", back_populates="calculated_data")
+    # Индексы для выборок временных рядов (см. migrations/versions/0002)
+    __table_args__ = (
+        Index("ix_calculated_data_point_time", "id_point", "data_and_time"),
+        Index("ix_calculated_data_time_id", "data_and_time", "id_data"),
+        Index("ix_calculated_data_time_brin", "data_and_time", postgresql_using="brin"),
+    )
+
+class CalculatedDataRollup(Base):
+    __tablename__ = "Calculated_data_rollup"
+    # Агрегаты Calculated_data по точке и интервалу (hour, day, month)
+    granularity = Column(String(5), primary_key=True)
+    id_point = Column(Integer, ForeignKey("Measuring_point.id_point"), primary_key=True)
+    bucket_start = Column(DateTime, primary_key=True)
+    record_count = Column(Integer)
+    # count/sum/min/max по каждому параметру (count - число непустых значений)
+    count_ttr = Column(Integer)
+    sum_ttr = Column(Float)
+    min_ttr = Column(Float)
+    max_ttr = Column(Float)
+    count_q = Column(Integer)
+    sum_q = Column(Float)
+    min_q = Column(Float)
+    max_q = Column(Float)
+    count_q_H2O = Column(Integer)
+    sum_q_H2O = Column(Float)
+    min_q_H2O = Column(Float)
+    max_q_H2O = Column(Float)
+
+class ThresholdExcursion(Base):
+    __tablename__ = "Threshold_excursion"
+    # Превышение parametr_q_H2O над parametr_q_H2O_porog: интервал [started_at, ended_at),
+    # ended_at пуст, пока превышение продолжается (app/services/excursions.py)
+    id_excursion = Column(Integer, primary_key=True)
+    id_point = Column(Integer, ForeignKey("Measuring_point.id_point"), nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    ended_at = Column(DateTime)
+    # Порог в момент начала, наибольшее значение и число отсчетов выше порога
+    threshold = Column(Float)
+    peak_value = Column(Float)
+    peak_at = Column(DateTime)
+    sample_count = Column(Integer)
+    __table_args__ = (
+        Index("ix_threshold_excursion_point_start", "id_point", "started_at"),
+        Index("ix_threshold_excursion_open", "id_point",
+              postgresql_where=text("ended_at IS NULL"), sqlite_where=text("ended_at IS NULL")),
+    )
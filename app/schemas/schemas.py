@@ -58,6 +58,31 @@ class CalculatedData(CalculatedDataBase):
     class Config:
         from_attributes = True
 
+# Результат пакетной загрузки расчетных данных
+class BatchRowError(BaseModel):
+    index: int
+    id_point: Optional[int] = None
+    detail: str
+
+class BatchCreateResponse(BaseModel):
+    inserted: int
+    failed: int
+    errors: List[BatchRowError]
+    items: Optional[List[CalculatedData]] = None
+
+# Превышение порога расхода воды (ended_at пуст - превышение продолжается)
+class ThresholdExcursion(BaseModel):
+    id_excursion: int
+    id_point: int
+    started_at: datetime
+    ended_at: Optional[datetime] = None
+    threshold: Optional[float] = None
+    peak_value: Optional[float] = None
+    peak_at: Optional[datetime] = None
+    sample_count: Optional[int] = None
+    class Config:
+        from_attributes = True
+
 # Схемы для калькулятора влажности
 class GasVolumeInput(BaseModel):
     gas_volume: float
@@ -89,6 +114,7 @@ class SingleVolumeResponse(BaseModel):
 
 class GasMixtureRequest(BaseModel):
     components: List[GasVolumeInput]
+    dew_point_method: str = "table"  # table (Приложение Г), exact (обращение формулы п. 6.2.2)
 
 class GasMixtureResponse(BaseModel):
     mixture_volume: float
@@ -96,6 +122,19 @@ class GasMixtureResponse(BaseModel):
     total_water_mass: float
     mixture_dew_point: float
 
+# Схемы для пакетного расчета (колоночный формат)
+class BatchCalculationRequest(BaseModel):
+    dew_points: List[float]
+    gas_volumes: List[float]
+    volume_unit: str = "thousand_cubic_meters"
+    dew_point_unit: str = "celsius"
+
+class BatchCalculationResponse(BaseModel):
+    count: int
+    water_content_per_cubic_meter: List[float]
+    total_water_mass: List[float]
+    base_volume_cubic_meters: List[float]
+
 # Схемы для отчетов
 class WaterIntrusionRequest(BaseModel):
     start_date: str
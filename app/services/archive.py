@@ -0,0 +1,364 @@
+"""
+Холодный архив Calculated_data: закрытые месяцы в Parquet на локальном диске
+Архивация переносит строки месяцев старше ARCHIVE_HOT_MONTHS полных месяцев
+из таблицы в файлы ARCHIVE_DIR/month=YYYY-MM/part-NNNNN.parquet (строки
+упорядочены по точке и времени) и удаляет их из таблицы. Запуск, например из cron:
+
+    python -m app.services.archive run
+    python -m app.services.archive list
+
+Отчеты (/reports/generate, фоновые custom_report, /reports/daily,
+/reports/input-output-summary), /analytics/trends и /calculated-data/aggregated
+читают архив через встроенную DuckDB: DuckDB считает по файлам нужных месяцев
+частичные агрегаты (count/sum/min/max, читаются только нужные столбцы и группы
+строк), они объединяются с частичными агрегатами по таблице (см. report_engine,
+interval_rollups). Агрегаты
+Calculated_data_rollup при архивации не меняются и продолжают учитывать
+архивные строки; часовые агрегаты архивных месяцев пересчитываются из архива.
+
+Выборки исходных строк (/calculated-data/date-range, прореживание, поиск
+попадания воды, выгрузки) и пересчет превышений порога читают строки архива
+через iter_rows и объединяют их со строками таблицы в общем порядке;
+статистика точки и /analytics/summary складывают итоги таблицы и архива
+(totals, merge_totals). Постраничные списки и чтение/правка строки по id_data
+работают со строками таблицы.
+
+Каждая строка хранится либо в таблице, либо в архиве. Файл появляется до
+commit удаления: если commit не прошел, строки месяца учитываются дважды до
+повторного запуска, который удаляет из таблицы уже архивированные строки.
+
+Пакеты pyarrow (архивация) и duckdb (чтение архива) необязательны, пока архив пуст.
+"""
+import argparse
+import logging
+import os
+import re
+import threading
+from datetime import date, datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from sqlalchemy import delete, func, select
+
+from app.models.models import CalculatedData
+from app.services.partitions import add_months, month_start
+from app.utils.time_buckets import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.abspath("archive"))
+# Полных месяцев, которые остаются в таблице кроме текущего
+ARCHIVE_HOT_MONTHS = int(os.getenv("ARCHIVE_HOT_MONTHS", "12"))
+# Строк за одно чтение из курсора и в одной группе строк Parquet
+ARCHIVE_CHUNK_SIZE = 100000
+# Строк за одно чтение результата DuckDB при потоковой выдаче
+ARCHIVE_FETCH_SIZE = 5000
+
+ARCHIVE_COLUMNS = ("id_data", "id_point", "data_and_time", "parametr_ttr", "parametr_q",
+                   "parametr_q_H2O", "parametr_q_H2O_porog")
+
+raw_table = CalculatedData.__table__
+
+_MONTH_DIR_RE = re.compile(r"^month=(\d{4})-(\d{2})$")
+
+_connection = None
+_connection_lock = threading.Lock()
+
+
+def month_dir(month: date) -> str:
+    return os.path.join(ARCHIVE_DIR, f"month={month:%Y-%m}")
+
+
+def month_files(month: date) -> List[str]:
+    directory = month_dir(month)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in os.listdir(directory)
+        if name.startswith("part-") and name.endswith(".parquet")
+    )
+
+
+def archived_months() -> List[date]:
+    """Месяцы, по которым в архиве есть файлы"""
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    months = []
+    for name in os.listdir(ARCHIVE_DIR):
+        match = _MONTH_DIR_RE.match(name)
+        if match:
+            month = date(int(match.group(1)), int(match.group(2)), 1)
+            if month_files(month):
+                months.append(month)
+    return sorted(months)
+
+
+def archive_files(start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[str]:
+    """Файлы месяцев, пересекающихся с [start, end] (None - без ограничения)"""
+    files = []
+    for month in archived_months():
+        if start is not None and datetime.combine(add_months(month, 1), datetime.min.time()) <= start:
+            continue
+        if end is not None and datetime.combine(month, datetime.min.time()) > end:
+            continue
+        files.extend(month_files(month))
+    return files
+
+
+def archive_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ("id_data", pa.int64()),
+        ("id_point", pa.int64()),
+        ("data_and_time", pa.timestamp("us")),
+        ("parametr_ttr", pa.float64()),
+        ("parametr_q", pa.float64()),
+        ("parametr_q_H2O", pa.float64()),
+        ("parametr_q_H2O_porog", pa.float64()),
+    ])
+
+
+def _archived_ids(month: date) -> set:
+    import pyarrow.parquet as pq
+
+    ids = set()
+    for path in month_files(month):
+        ids.update(pq.read_table(path, columns=["id_data"]).column(0).to_pylist())
+    return ids
+
+
+def archive_month(db, month: date) -> int:
+    """
+    Перенести строки месяца в новый файл архива и удалить их из таблицы (commit - у вызывающего)
+    Строки, уже записанные в архив прошлым запуском, только удаляются. Возвращает число записанных строк.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if db.get_bind().dialect.name == "postgresql":
+        # Удаление видит тот же снимок, что и чтение: строки, записанные во время архивации, остаются в таблице
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    start = datetime.combine(month, datetime.min.time())
+    end = datetime.combine(add_months(month, 1), datetime.min.time())
+    in_month = (raw_table.c.data_and_time >= start, raw_table.c.data_and_time < end)
+
+    archived = _archived_ids(month)
+    schema = archive_schema()
+    os.makedirs(month_dir(month), exist_ok=True)
+    path = os.path.join(month_dir(month), f"part-{len(month_files(month)):05d}.parquet")
+    part_path = path + ".tmp"
+
+    stmt = (
+        select(*[raw_table.c[column] for column in ARCHIVE_COLUMNS])
+        .where(*in_month)
+        .order_by(raw_table.c.id_point, raw_table.c.data_and_time, raw_table.c.id_data)
+    )
+    written = 0
+    writer = None
+    try:
+        result = db.execute(stmt, execution_options={"yield_per": ARCHIVE_CHUNK_SIZE})
+        for chunk in result.partitions():
+            rows = [row for row in chunk if row[0] not in archived] if archived else chunk
+            if not rows:
+                continue
+            if writer is None:
+                writer = pq.ParquetWriter(part_path, schema, compression="zstd")
+            columns = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            writer.write_table(pa.Table.from_arrays(columns, schema=schema))
+            written += len(rows)
+        if writer is not None:
+            writer.close()
+            writer = None
+        db.execute(delete(raw_table).where(*in_month))
+        if written:
+            os.replace(part_path, path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    return written
+
+
+def closed_months(db, hot_months: int = ARCHIVE_HOT_MONTHS) -> List[date]:
+    """Месяцы со строками в таблице старше hot_months полных месяцев до текущего"""
+    boundary = add_months(month_start(datetime.now()), -hot_months)
+    first = db.execute(
+        select(func.min(raw_table.c.data_and_time))
+        .where(raw_table.c.data_and_time < datetime.combine(boundary, datetime.min.time()))
+    ).scalar()
+    if first is None:
+        return []
+    if isinstance(first, str):
+        first = datetime.fromisoformat(first)
+    months = []
+    month = month_start(first)
+    while month < boundary:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def duckdb_cursor():
+    """Курсор встроенной DuckDB: соединение в памяти на процесс, отдельный курсор на запрос"""
+    global _connection
+    try:
+        import duckdb
+    except ImportError:
+        raise RuntimeError("Parquet archive is present but duckdb is not installed")
+    with _connection_lock:
+        if _connection is None:
+            _connection = duckdb.connect(":memory:")
+            # Метаданные файлов Parquet (схема, статистики групп строк) кэшируются между запросами
+            _connection.execute("SET enable_object_cache = true")
+    return _connection.cursor()
+
+
+def parquet_source(files: Sequence[str]) -> str:
+    """Источник FROM для списка файлов архива (пути берутся из каталога архива, не из запроса)"""
+    paths = ", ".join("'" + path.replace("'", "''") + "'" for path in files)
+    return f"read_parquet([{paths}])"
+
+
+def query(sql: str, parameters: Optional[Dict[str, object]], files: Sequence[str]) -> List[tuple]:
+    """Выполнить запрос DuckDB; {source} в тексте заменяется источником по файлам"""
+    cursor = duckdb_cursor()
+    try:
+        return cursor.execute(sql.format(source=parquet_source(files)), parameters or {}).fetchall()
+    finally:
+        cursor.close()
+
+
+def iter_query(sql: str, parameters: Optional[Dict[str, object]], files: Sequence[str]) -> Iterator[tuple]:
+    """То же, что query, с чтением результата блоками"""
+    cursor = duckdb_cursor()
+    try:
+        cursor.execute(sql.format(source=parquet_source(files)), parameters or {})
+        while True:
+            rows = cursor.fetchmany(ARCHIVE_FETCH_SIZE)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def _conditions(point_ids: Optional[Sequence[int]], start: Optional[datetime], end: Optional[datetime],
+                end_inclusive: bool = False):
+    """Условия WHERE и параметры DuckDB: точки и период [start, end) ([start, end] при end_inclusive)"""
+    conditions = ["data_and_time IS NOT NULL"]
+    parameters = {}
+    if point_ids is not None:
+        conditions.append(f"id_point IN ({', '.join(str(int(point_id)) for point_id in point_ids) or 'NULL'})")
+    if start is not None:
+        conditions.append("data_and_time >= $start")
+        parameters["start"] = start
+    if end is not None:
+        conditions.append("data_and_time <= $end" if end_inclusive else "data_and_time < $end")
+        parameters["end"] = end
+    return conditions, parameters
+
+
+def _column(name: str) -> str:
+    # Столбцы архива - в кавычках, остальное (NULL, выражения) - как есть
+    return f'"{name}"' if name in ARCHIVE_COLUMNS else name
+
+
+def interval_rollups(granularity: str, point_ids: Optional[List[int]], start: Optional[datetime],
+                     end: Optional[datetime], metric_columns: Dict[str, str], files: Sequence[str]) -> List[tuple]:
+    """Агрегаты архива по точке и интервалу (hour/day/month) в порядке столбцов Calculated_data_rollup"""
+    aggregates = ["count(*)"]
+    for column in metric_columns.values():
+        aggregates += [f'count("{column}")', f'sum("{column}")', f'min("{column}")', f'max("{column}")']
+    conditions, parameters = _conditions(point_ids, start, end)
+    conditions.append("id_point IS NOT NULL")
+    return query(
+        f"SELECT '{granularity}', id_point, CAST(date_trunc('{granularity}', data_and_time) AS TIMESTAMP), "
+        + ", ".join(aggregates)
+        + " FROM {source} WHERE " + " AND ".join(conditions) + " GROUP BY 2, 3",
+        parameters,
+        files,
+    )
+
+
+def iter_rows(columns: Sequence[str], order_by: Sequence[str], files: Sequence[str],
+              point_ids: Optional[Sequence[int]] = None, start: Optional[datetime] = None,
+              end: Optional[datetime] = None, end_inclusive: bool = False) -> Iterator[tuple]:
+    """
+    Исходные строки архива за период в порядке order_by
+    columns - столбцы Calculated_data или выражения DuckDB (epoch(data_and_time), NULL);
+    строки объединяются со строками таблицы в том же порядке (heapq.merge).
+    """
+    conditions, parameters = _conditions(point_ids, start, end, end_inclusive)
+    return iter_query(
+        f"SELECT {', '.join(map(_column, columns))} FROM {{source}} WHERE {' AND '.join(conditions)} "
+        f"ORDER BY {', '.join(map(_column, order_by))}",
+        parameters,
+        files,
+    )
+
+
+def totals(metric_columns: Sequence[str], files: Sequence[str], point_ids: Optional[Sequence[int]] = None) -> tuple:
+    """Итоги архива: count(*), min и max времени, затем count и sum каждого столбца"""
+    conditions, parameters = _conditions(point_ids, None, None)
+    aggregates = ["count(*)", "min(data_and_time)", "max(data_and_time)"]
+    for column in metric_columns:
+        aggregates += [f'count("{column}")', f'sum("{column}")']
+    # Строки без времени в архив не попадают - условие по времени итоги не меняет
+    return query(f"SELECT {', '.join(aggregates)} FROM {{source}} WHERE {' AND '.join(conditions)}",
+                 parameters, files)[0]
+
+
+def merge_totals(rows: Iterable[Sequence]) -> list:
+    """Сложить итоги (таблица и архив) в порядке totals; время - datetime"""
+    rows = list(rows)
+    first = [parse_datetime(row[1]) for row in rows if row[1] is not None]
+    last = [parse_datetime(row[2]) for row in rows if row[2] is not None]
+    merged = [sum(row[0] or 0 for row in rows), min(first, default=None), max(last, default=None)]
+    for i in range(3, len(rows[0])):
+        values = [row[i] for row in rows if row[i] is not None]
+        merged.append(sum(values) if values else None)
+    return merged
+
+
+def average(count, total) -> float:
+    """Среднее по count и sum из итогов (0, если значений нет)"""
+    return float(total / count) if count and total else 0
+
+
+def main():
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Архив Calculated_data в Parquet")
+    parser.add_argument("command", choices=["run", "list"])
+    parser.add_argument("--hot-months", type=int, default=ARCHIVE_HOT_MONTHS,
+                        help="полных месяцев, которые остаются в таблице кроме текущего")
+    parser.add_argument("--month", action="append", help="архивировать только указанные месяцы (YYYY-MM)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "list":
+        for month in archived_months():
+            files = month_files(month)
+            size = sum(os.path.getsize(path) for path in files)
+            print(f"{month:%Y-%m}  файлов: {len(files)}  {size / 1024 / 1024:.1f} МБ")
+        return
+
+    if args.month:
+        months = [month_start(datetime.strptime(value, "%Y-%m")) for value in args.month]
+    else:
+        with SessionLocal() as db:
+            months = closed_months(db, args.hot_months)
+    for month in months:
+        # Каждый месяц - отдельная транзакция
+        db = SessionLocal()
+        try:
+            written = archive_month(db, month)
+            db.commit()
+        finally:
+            db.close()
+        logger.info(f"{month:%Y-%m}: в архив записано строк: {written}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Кэш ответов аналитических эндпоинтов (TTL + LRU) с инвалидацией по тегам
+Записи помечаются тегами затронутых данных (точка, дата, таблица); CRUD после
+commit сбрасывает записи с тегами измененных строк. Бэкенд выбирается через
+CACHE_BACKEND: memory (по умолчанию, свой кэш в каждом процессе) или redis
+(общий для нескольких воркеров, нужен пакет redis и CACHE_REDIS_URL).
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+from app.utils.time_buckets import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "30"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+# Теги: любые изменения таблицы, конкретной точки, конкретных суток
+CALCULATED_DATA_TAG = "calculated_data"
+MEASURING_POINTS_TAG = "measuring_points"
+
+
+def point_tag(point_id: int) -> str:
+    return f"point:{point_id}"
+
+
+def date_tag(value) -> str:
+    return f"date:{parse_datetime(value).date().isoformat()}"
+
+
+def calculated_data_tags(keys: Iterable) -> set:
+    """Теги для измененных строк Calculated_data с ключами (id_point, data_and_time)"""
+    tags = {CALCULATED_DATA_TAG}
+    for point_id, data_and_time in keys:
+        if point_id is not None:
+            tags.add(point_tag(point_id))
+        if data_and_time is not None:
+            tags.add(date_tag(data_and_time))
+    return tags
+
+
+def measuring_point_tags(point_id: int) -> set:
+    return {MEASURING_POINTS_TAG, point_tag(point_id)}
+
+
+def cache_key(route: str, **params) -> str:
+    """Ключ записи: маршрут и значения параметров в фиксированном порядке"""
+    if not params:
+        return route
+    return route + "?" + "&".join(f"{name}={params[name]}" for name in sorted(params))
+
+
+class MemoryCacheBackend:
+    """Кэш в памяти процесса: OrderedDict в порядке использования, индекс тег -> ключи"""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.tag_index: Dict[str, set] = {}
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value, _ = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, tags: Iterable[str], ttl: float):
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            tags = frozenset(tags)
+            self.entries[key] = (time.monotonic() + ttl, value, tags)
+            for tag in tags:
+                self.tag_index.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        with self.lock:
+            keys = set()
+            for tag in tags:
+                keys |= self.tag_index.get(tag, set())
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tag_index.clear()
+
+    def size(self) -> int:
+        return len(self.entries)
+
+    def _remove(self, key: str):
+        _, _, tags = self.entries.pop(key)
+        for tag in tags:
+            keys = self.tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tag_index[tag]
+
+
+class RedisCacheBackend:
+    """
+    Общий кэш в Redis (или совместимом сервере): значения в JSON с TTL,
+    множество ключей на каждый тег. Вытеснение LRU задается настройкой
+    сервера maxmemory-policy allkeys-lru.
+    """
+    prefix = "response_cache:"
+
+    def __init__(self, url: str = CACHE_REDIS_URL):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis требует пакет redis (pip install redis)")
+        self.client = redis.Redis.from_url(url)
+        self.evictions = 0
+
+    def get(self, key: str):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value, tags: Iterable[str], ttl: float):
+        pipeline = self.client.pipeline()
+        pipeline.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000))
+        for tag in tags:
+            pipeline.sadd(self.prefix + "tag:" + tag, key)
+            pipeline.pexpire(self.prefix + "tag:" + tag, int(ttl * 1000))
+        pipeline.execute()
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        tag_keys = [self.prefix + "tag:" + tag for tag in tags]
+        keys = set()
+        for tag_key in tag_keys:
+            keys |= self.client.smembers(tag_key)
+        if keys:
+            self.client.delete(*[self.prefix + key.decode() for key in keys])
+        if tag_keys:
+            self.client.delete(*tag_keys)
+        return len(keys)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + "*"))
+        if keys:
+            self.client.delete(*keys)
+
+    def size(self) -> int:
+        return sum(1 for key in self.client.scan_iter(self.prefix + "*") if b":tag:" not in key)
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl: float = CACHE_TTL_SECONDS):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            # Недоступный кэш не должен ломать эндпоинт - считаем промахом
+            logger.warning(f"Ошибка чтения кэша: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key: str, value, tags: Iterable[str]):
+        """Сохранить ответ; возвращает значение в JSON-совместимом виде"""
+        value = jsonable_encoder(value)
+        try:
+            self.backend.set(key, value, tags, self.ttl)
+        except Exception as e:
+            logger.warning(f"Ошибка записи в кэш: {e}")
+        return value
+
+    def invalidate(self, tags: Iterable[str]):
+        try:
+            self.invalidations += self.backend.invalidate(tags)
+        except Exception as e:
+            logger.warning(f"Ошибка инвалидации кэша: {e}")
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "backend": CACHE_BACKEND,
+            "ttl_seconds": self.ttl,
+            "entries": self.backend.size(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / requests if requests else None,
+            "invalidated_entries": self.invalidations,
+            "evictions": self.backend.evictions,
+        }
+
+
+def create_backend(name: str = CACHE_BACKEND):
+    if name == "memory":
+        return MemoryCacheBackend()
+    if name == "redis":
+        return RedisCacheBackend()
+    raise ValueError(f"Unsupported CACHE_BACKEND: {name}")
+
+
+response_cache = ResponseCache(create_backend())
@@ -0,0 +1,136 @@
+"""
+Колоночные двоичные форматы ответа для выборок временных рядов
+Формат выбирается по заголовку Accept:
+
+    application/vnd.apache.arrow.stream - Arrow IPC stream (pyarrow.ipc.open_stream,
+                                          pandas: .read_all().to_pandas())
+    application/msgpack                 - msgpack {столбец: [значения]} (pandas.DataFrame(...)),
+                                          дата/время - строки ISO
+    application/json, */*, без Accept   - JSON по схеме эндпоинта
+
+Строки для этих форматов читаются запросом Core без объектов ORM и схем
+Pydantic и раскладываются по столбцам. Пакеты pyarrow и msgpack необязательны:
+если пакет не установлен, формат не предлагается (406, если клиент не
+принимает ничего другого).
+"""
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from fastapi import HTTPException
+from fastapi.responses import Response
+from sqlalchemy import Date, DateTime, Float, Integer
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+MSGPACK = "application/msgpack"
+JSON = "application/json"
+# Синонимы типов в Accept
+MEDIA_TYPE_ALIASES = {
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+}
+
+
+@lru_cache(maxsize=None)
+def _available(module: str) -> bool:
+    try:
+        __import__(module)
+    except ImportError:
+        return False
+    return True
+
+
+FORMAT_MODULES = {
+    ARROW_STREAM: "pyarrow",
+    MSGPACK: "msgpack",
+}
+
+
+def available_formats() -> List[str]:
+    return [media_type for media_type, module in FORMAT_MODULES.items() if _available(module)]
+
+
+def negotiate(accept: Optional[str]) -> Optional[str]:
+    """
+    Колоночный формат, запрошенный заголовком Accept (с учетом q), или None для JSON
+    HTTPException 406, если приемлемы только недоступные форматы
+    """
+    if not accept:
+        return None
+    choices = []
+    for position, part in enumerate(accept.split(",")):
+        media_type, *params = [item.strip() for item in part.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            choices.append((-quality, position, MEDIA_TYPE_ALIASES.get(media_type.lower(), media_type.lower())))
+    available = available_formats()
+    for _, _, media_type in sorted(choices):
+        if media_type in available:
+            return media_type
+        if media_type in (JSON, "application/*", "*/*"):
+            return None
+    if any(media_type in FORMAT_MODULES for _, _, media_type in choices):
+        raise HTTPException(status_code=406, detail=f"Available formats: {', '.join([JSON] + available)}")
+    return None
+
+
+def _arrow_type(column_type):
+    import pyarrow as pa
+
+    if isinstance(column_type, DateTime):
+        return pa.timestamp("us")
+    if isinstance(column_type, Date):
+        return pa.date32()
+    if isinstance(column_type, Integer):
+        return pa.int64()
+    if isinstance(column_type, Float):
+        return pa.float64()
+    return None
+
+
+def _msgpack_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not msgpack serializable")
+
+
+def encode_columns(media_type: str, columns: Dict[str, Sequence], types: Optional[Dict[str, object]] = None) -> bytes:
+    """Столбцы {имя: значения} в Arrow IPC stream или msgpack; types - типы SQLAlchemy столбцов"""
+    if media_type == ARROW_STREAM:
+        import pyarrow as pa
+
+        types = types or {}
+        arrays = [pa.array(values, type=_arrow_type(types[name]) if name in types else None)
+                  for name, values in columns.items()]
+        table = pa.Table.from_arrays(arrays, names=list(columns))
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    import msgpack
+
+    return msgpack.packb({name: list(values) for name, values in columns.items()}, default=_msgpack_default)
+
+
+def rows_to_columns(rows: Iterable, names: Sequence[str]) -> Dict[str, Sequence]:
+    """Строки (кортежи в порядке names) -> {имя: значения}"""
+    rows = list(rows)
+    if not rows:
+        return {name: [] for name in names}
+    return dict(zip(names, zip(*rows)))
+
+
+def columnar_response(media_type: str, rows: Iterable, names: Sequence[str],
+                      types: Optional[Dict[str, object]] = None, headers: Optional[Dict[str, str]] = None) -> Response:
+    return Response(
+        encode_columns(media_type, rows_to_columns(rows, names), types),
+        media_type=media_type,
+        headers={"Vary": "Accept", **(headers or {})},
+    )
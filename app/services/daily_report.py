@@ -0,0 +1,187 @@
+"""
+Суточный отчет по точкам за период (GET /reports/daily)
+Один запрос: точки LEFT JOIN суточные суммы за [start, end). Суммы берутся
+из суточных агрегатов Calculated_data_rollup (строка на точку и сутки, отчет
+за месяц читает ~30 строк на точку) или, при ROLLUPS_ENABLED=false, из исходных
+строк с условием по диапазону data_and_time, которое использует индекс
+(id_point, data_and_time). Исходные строки архивных месяцев суммируются
+по файлам холодного архива и складываются с суммами таблицы.
+"""
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from app.models.models import CalculatedData, CalculatedDataRollup, MeasuringPoint
+from app.services import archive
+from app.services.rollups import METRIC_COLUMNS, ROLLUPS_ENABLED, merge_rollup_rows
+from app.utils.time_buckets import parse_datetime, truncate_expression
+
+# Ограничение длины периода отчета (строк ответа = точки x сутки)
+DAILY_REPORT_MAX_DAYS = 366
+
+points_table = MeasuringPoint.__table__
+raw_table = CalculatedData.__table__
+rollup_table = CalculatedDataRollup.__table__
+
+# Суммы суток в порядке столбцов _daily_source после (id_point, day)
+DAY_COLUMNS = ("record_count", "count_ttr", "sum_ttr", "min_ttr", "max_ttr", "count_q", "sum_q")
+
+
+def _daily_source(dialect_name: str, use_rollups: bool):
+    """Подзапрос (id_point, day, record_count, count/sum/min/max ТТР, count/sum объема) без фильтра периода"""
+    if use_rollups:
+        return (
+            select(
+                rollup_table.c.id_point,
+                rollup_table.c.bucket_start.label("day"),
+                rollup_table.c.record_count,
+                rollup_table.c.count_ttr,
+                rollup_table.c.sum_ttr,
+                rollup_table.c.min_ttr,
+                rollup_table.c.max_ttr,
+                rollup_table.c.count_q,
+                rollup_table.c.sum_q,
+            )
+            .where(rollup_table.c.granularity == "day"),
+            rollup_table.c.bucket_start,
+        )
+    day = truncate_expression(raw_table.c.data_and_time, "day", dialect_name)
+    return (
+        select(
+            raw_table.c.id_point,
+            day.label("day"),
+            func.count().label("record_count"),
+            func.count(raw_table.c.parametr_ttr).label("count_ttr"),
+            func.sum(raw_table.c.parametr_ttr).label("sum_ttr"),
+            func.min(raw_table.c.parametr_ttr).label("min_ttr"),
+            func.max(raw_table.c.parametr_ttr).label("max_ttr"),
+            func.count(raw_table.c.parametr_q).label("count_q"),
+            func.sum(raw_table.c.parametr_q).label("sum_q"),
+        )
+        .group_by(raw_table.c.id_point, day),
+        raw_table.c.data_and_time,
+    )
+
+
+def daily_statement(start: datetime, end: datetime, point_ids: Optional[List[int]], dialect_name: str,
+                    use_rollups: bool = ROLLUPS_ENABLED):
+    source, time_column = _daily_source(dialect_name, use_rollups)
+    # Полуоткрытый диапазон по самому столбцу времени - условие использует индекс
+    source = source.where(time_column >= start, time_column < end)
+    if point_ids is not None:
+        source = source.where(source.selected_columns.id_point.in_(point_ids))
+    days = source.subquery("days")
+    stmt = (
+        select(points_table.c.id_point, points_table.c.name_point, *[days.c[name] for name in days.c.keys() if name != "id_point"])
+        .select_from(points_table.outerjoin(days, days.c.id_point == points_table.c.id_point))
+        .order_by(points_table.c.id_point, days.c.day)
+    )
+    if point_ids is not None:
+        stmt = stmt.where(points_table.c.id_point.in_(point_ids))
+    return stmt
+
+
+def _average(total, count):
+    return total / count if count else None
+
+
+def _add_day(current: dict, values: dict):
+    """Сложить суммы одних суток из таблицы и архива"""
+    for name in DAY_COLUMNS:
+        value = values[name]
+        if value is None:
+            continue
+        if current[name] is None:
+            current[name] = value
+        elif name.startswith("min_"):
+            current[name] = min(current[name], value)
+        elif name.startswith("max_"):
+            current[name] = max(current[name], value)
+        else:
+            current[name] += value
+
+
+def archive_days(start: datetime, end: datetime, point_ids: Optional[List[int]],
+                 files: List[str]) -> Dict[Tuple[int, datetime], dict]:
+    """Суммы по точке и суткам из файлов архива"""
+    rows = archive.interval_rollups("day", point_ids, start, end, METRIC_COLUMNS, files)
+    return {(row["id_point"], row["bucket_start"]): row for row in merge_rollup_rows(rows)}
+
+
+def daily_report(db, start: date, end: date, point_ids: Optional[List[int]] = None) -> List[dict]:
+    """
+    Показатели точек за сутки с start по end включительно: итог за период
+    и список суток с данными (вызывается через AsyncSession.run_sync)
+    """
+    period_start = parse_datetime(start)
+    period_end = parse_datetime(end) + timedelta(days=1)
+    stmt = daily_statement(period_start, period_end, point_ids, db.get_bind().dialect.name)
+    # Суточные агрегаты учитывают архивные строки, исходные строки архивных месяцев - только в файлах архива
+    files = [] if ROLLUPS_ENABLED else archive.archive_files(period_start, period_end)
+
+    names: Dict[int, str] = {}
+    point_days: Dict[int, Dict[datetime, dict]] = {}
+    for row in db.execute(stmt):
+        names[row.id_point] = row.name_point
+        days = point_days.setdefault(row.id_point, {})
+        if row.day is not None:
+            days[parse_datetime(row.day)] = {name: row._mapping[name] for name in DAY_COLUMNS}
+    if files:
+        for (point_id, day), values in archive_days(period_start, period_end, point_ids, files).items():
+            # Как и в запросе, отчет строится по существующим точкам
+            if point_id not in point_days:
+                continue
+            current = point_days[point_id].get(day)
+            if current is None:
+                point_days[point_id][day] = {name: values[name] for name in DAY_COLUMNS}
+            else:
+                _add_day(current, values)
+
+    points: Dict[int, dict] = {}
+    for point_id, days in point_days.items():
+        point = points[point_id] = {
+            "id_point": point_id,
+            "name_point": names[point_id],
+            "records_count": 0,
+            "count_ttr": 0,
+            "sum_ttr": 0.0,
+            "min_ttr": None,
+            "max_ttr": None,
+            "count_q": 0,
+            "sum_q": 0.0,
+            "days": [],
+        }
+        for day in sorted(days):
+            values = days[day]
+            point["records_count"] += values["record_count"]
+            point["count_ttr"] += values["count_ttr"] or 0
+            point["sum_ttr"] += values["sum_ttr"] or 0.0
+            point["count_q"] += values["count_q"] or 0
+            point["sum_q"] += values["sum_q"] or 0.0
+            if values["min_ttr"] is not None:
+                point["min_ttr"] = values["min_ttr"] if point["min_ttr"] is None else min(point["min_ttr"], values["min_ttr"])
+            if values["max_ttr"] is not None:
+                point["max_ttr"] = values["max_ttr"] if point["max_ttr"] is None else max(point["max_ttr"], values["max_ttr"])
+            point["days"].append({
+                "date": day.date(),
+                "records_count": values["record_count"],
+                "avg_ttr": _average(values["sum_ttr"], values["count_ttr"]),
+                "avg_q": _average(values["sum_q"], values["count_q"]),
+                "min_ttr": values["min_ttr"],
+                "max_ttr": values["max_ttr"],
+            })
+
+    return [
+        {
+            "id_point": point["id_point"],
+            "name_point": point["name_point"],
+            "records_count": point["records_count"],
+            "avg_ttr": _average(point["sum_ttr"], point["count_ttr"]),
+            "avg_q": _average(point["sum_q"], point["count_q"]),
+            "min_ttr": point["min_ttr"],
+            "max_ttr": point["max_ttr"],
+            "days": point["days"],
+        }
+        for point in points.values()
+    ]
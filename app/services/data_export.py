@@ -0,0 +1,207 @@
+"""
+Потоковая выгрузка расчетных данных
+Строки читаются серверным курсором (yield_per) и сразу пишутся в ответ,
+поэтому расход памяти не зависит от количества выгружаемых строк.
+Строки холодного архива за период объединяются со строками таблицы в том же порядке.
+"""
+import csv
+import heapq
+import io
+import json
+import tempfile
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+import pandas as pd
+from openpyxl import Workbook
+from sqlalchemy import select
+
+from app.database import SessionLocal
+from app.models.models import CalculatedData
+from app.services import archive
+
+# Количество строк, получаемых из курсора за один раз
+EXPORT_CHUNK_SIZE = 5000
+# Размер блока при отдаче готового XLSX файла
+FILE_CHUNK_SIZE = 1024 * 1024
+
+EXPORT_COLUMNS = [
+    "id_data",
+    "id_point",
+    "data_and_time",
+    "parametr_ttr",
+    "parametr_q",
+    "parametr_q_H2O",
+    "parametr_q_H2O_porog",
+]
+
+STREAMING_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "excel": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+}
+
+
+def _parse_datetime(value: str, end_of_range: bool = False) -> datetime:
+    """Разобрать дату ISO; дата без времени для конца периода включает весь день"""
+    if not isinstance(value, str):
+        raise ValueError("dates must be ISO strings")
+    parsed = datetime.fromisoformat(value)
+    if end_of_range and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def parse_export_parameters(parameters: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Проверить параметры выгрузки:
+    {"date_range": {"start": "2024-01-01", "end": "2024-01-31"}, "point_ids": [1, 2]}
+    Вызывается до начала потока, чтобы ошибки возвращались обычным ответом 400.
+    """
+    date_range = parameters.get("date_range") or {}
+    if not isinstance(date_range, dict):
+        raise ValueError("date_range must be an object with start and end")
+    start = date_range.get("start", parameters.get("start_date"))
+    end = date_range.get("end", parameters.get("end_date"))
+    point_ids = parameters.get("point_ids", parameters.get("measurement_points"))
+
+    if point_ids is not None:
+        if not isinstance(point_ids, list) or not all(isinstance(i, int) for i in point_ids):
+            raise ValueError("point_ids must be a list of integers")
+
+    return {
+        "start": _parse_datetime(start) if start else None,
+        "end": _parse_datetime(end, end_of_range=True) if end else None,
+        "point_ids": point_ids,
+    }
+
+
+def _export_key(row: tuple) -> tuple:
+    # (id_point, data_and_time, id_data); NULL - в конце
+    return (row[1] is None, row[1] or 0, row[2] is None, row[2] or datetime.min, row[0])
+
+
+def iter_calculated_data(start: Optional[datetime], end: Optional[datetime], point_ids: Optional[List[int]]) -> Iterator[tuple]:
+    """Построчно читать расчетные данные через серверный курсор"""
+    table = CalculatedData.__table__
+    stmt = select(*[table.c[name] for name in EXPORT_COLUMNS])
+    if start is not None:
+        stmt = stmt.where(table.c.data_and_time >= start)
+    if end is not None:
+        stmt = stmt.where(table.c.data_and_time < end)
+    if point_ids:
+        stmt = stmt.where(table.c.id_point.in_(point_ids))
+    stmt = stmt.order_by(table.c.id_point, table.c.data_and_time, table.c.id_data)
+
+    db = SessionLocal()
+    try:
+        result = db.execute(stmt, execution_options={"yield_per": EXPORT_CHUNK_SIZE})
+        files = archive.archive_files(start, end)
+        if files:
+            archive_rows = archive.iter_rows(EXPORT_COLUMNS, ["id_point", "data_and_time", "id_data"],
+                                             files, point_ids or None, start, end)
+            yield from heapq.merge(result, archive_rows, key=_export_key)
+        else:
+            for partition in result.partitions():
+                yield from partition
+    finally:
+        db.close()
+
+
+def stream_csv(rows: Iterator[tuple]) -> Iterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+def stream_ndjson(rows: Iterator[tuple]) -> Iterator[bytes]:
+    lines = []
+    for row in rows:
+        record = dict(zip(EXPORT_COLUMNS, row))
+        record["data_and_time"] = record["data_and_time"].isoformat() if record["data_and_time"] else None
+        lines.append(json.dumps(record, ensure_ascii=False))
+        if len(lines) == EXPORT_CHUNK_SIZE:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def stream_xlsx(rows: Iterator[tuple]) -> Iterator[bytes]:
+    """
+    XLSX в режиме write-only: openpyxl сбрасывает строки во временный файл,
+    готовая книга отдается блоками с диска
+    """
+    with tempfile.TemporaryFile(suffix=".xlsx") as tmp:
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet("Data")
+        sheet.append(EXPORT_COLUMNS)
+        for row in rows:
+            sheet.append(list(row))
+        workbook.save(tmp)
+        tmp.seek(0)
+        while True:
+            chunk = tmp.read(FILE_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def stream_rows(format: str, rows: Iterator[tuple]) -> Iterator[bytes]:
+    if format == "csv":
+        return stream_csv(rows)
+    if format == "ndjson":
+        return stream_ndjson(rows)
+    return stream_xlsx(rows)
+
+
+def stream_calculated_data(format: str, start: Optional[datetime], end: Optional[datetime], point_ids: Optional[List[int]]) -> Iterator[bytes]:
+    return stream_rows(format, iter_calculated_data(start, end, point_ids))
+
+
+def calculator_export_frame(parameters: Dict[str, Any]) -> pd.DataFrame:
+    """Таблица выгрузки калькулятора"""
+    # Пример данных для экспорта (в реальности брать из параметров)
+    if parameters.get("calculation_type") == "single_volume":
+        data = {
+            "Параметр": ["Температура точки росы", "Объем газа", "Влагосодержание", "Общее количество воды"],
+            "Значение": [-15.0, 2965.0, 55.2768, 0.16],
+            "Единица измерения": ["°C", "тыс. м³", "мг/м³", "т"]
+        }
+    else:  # gas_mixture
+        data = {
+            "Компонент": ["Газ 1", "Газ 2", "Смесь"],
+            "Температура точки росы (°C)": [-15, 12, -6.03],
+            "Объем (тыс. м³/час)": [2695, 562, 3257],
+            "Влагосодержание (мг/м³)": [107.45, 357.67, 149.32]
+        }
+    return pd.DataFrame(data)
+
+
+def report_export_frame(parameters: Dict[str, Any]) -> pd.DataFrame:
+    """Таблица выгрузки отчетных данных"""
+    # Пример данных отчета
+    report_data = {
+        "Точка замера": ["КС-17 (Вход Цех №2)", "ГИС Надым ГП-2", "УЗПД ГИС-12"],
+        "Средняя ТТР (°C)": [-10.125, -6.986, 7.189],
+        "Период анализа": [
+            "31.05.2021 00:00 - 03.06.2021 06:15",
+            "03.06.2021 09:17 - 03.06.2021 21:34",
+            "02.06.2021 18:02 - 02.06.2021 21:11"
+        ],
+        "Длительность (часы)": [78.25, 12.28, 3.15]
+    }
+    return pd.DataFrame(report_data)
+
+
+def write_excel(dataframe: pd.DataFrame, target) -> None:
+    """Записать таблицу в XLSX (путь или файловый объект)"""
+    with pd.ExcelWriter(target, engine="openpyxl") as writer:
+        dataframe.to_excel(writer, sheet_name="Data", index=False)
@@ -0,0 +1,147 @@
+"""
+Прореживание временных рядов точки для графиков (GET /calculated-data/downsampled)
+Строки за период читаются серверным курсором блоками сразу в массивы NumPy
+(время - секунды от 1970-01-01), после чего каждый показатель прореживается
+до max_points отсчетов:
+
+- lttb - Largest-Triangle-Three-Buckets: из каждой корзины выбирается отсчет,
+  образующий наибольший треугольник с выбранным в предыдущей корзине и средним
+  следующей; форма ряда сохраняется при малом числе точек;
+- minmax - минимум и максимум в каждой из max_points / 2 равных по времени
+  корзин: не теряются пики и провалы.
+
+Ответ содержит не больше max_points отсчетов на показатель независимо от длины периода.
+Строки холодного архива за период добавляются к строкам таблицы.
+"""
+import itertools
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from app.models.models import CalculatedData
+from app.services import archive
+from app.utils.time_buckets import epoch_expression, from_epoch
+
+DOWNSAMPLING_METHODS = ("lttb", "minmax")
+DOWNSAMPLE_MAX_POINTS = 20000
+# Строк за одно чтение из курсора
+DOWNSAMPLE_CHUNK_SIZE = 50000
+
+raw_table = CalculatedData.__table__
+
+
+def lttb(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """Индексы отсчетов, выбранных LTTB (первый и последний всегда входят)"""
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+    # Внутренние отсчеты [1, n - 1) делятся на max_points - 2 корзины
+    edges = (np.arange(max_points - 1) * ((n - 2) / (max_points - 2))).astype(np.int64) + 1
+    edges[-1] = n - 1
+    # Средние корзин нарастающими суммами; для последней корзины "следующая" - последний отсчет
+    sum_x = np.concatenate(([0.0], np.cumsum(x)))
+    sum_y = np.concatenate(([0.0], np.cumsum(y)))
+    sizes = np.diff(edges)
+    average_x = np.append((sum_x[edges[1:]] - sum_x[edges[:-1]]) / sizes, x[-1])
+    average_y = np.append((sum_y[edges[1:]] - sum_y[edges[:-1]]) / sizes, y[-1])
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_x, next_y = average_x[bucket + 1], average_y[bucket + 1]
+        # Удвоенная площадь треугольника (предыдущий выбранный, кандидат, среднее следующей корзины)
+        area = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return selected
+
+
+def min_max(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """Индексы минимума и максимума в каждой из max_points // 2 равных по времени корзин"""
+    n = len(x)
+    buckets = max(max_points // 2, 1)
+    if n <= max_points:
+        return np.arange(n)
+    span = x[-1] - x[0]
+    bucket = np.minimum(((x - x[0]) * (buckets / span)).astype(np.int64), buckets - 1) if span > 0 \
+        else np.zeros(n, dtype=np.int64)
+    # Ряд упорядочен по времени, поэтому корзины - непрерывные отрезки: экстремумы через reduceat без сортировки
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    segment = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, n]))
+    selected = []
+    for extremes in (np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts)):
+        # Первый отсчет отрезка, равный его экстремуму
+        candidates = np.flatnonzero(y == extremes[segment])
+        candidate_segments = segment[candidates]
+        selected.append(candidates[np.r_[True, candidate_segments[1:] != candidate_segments[:-1]]])
+    return np.unique(np.concatenate(selected))
+
+
+DOWNSAMPLERS = {
+    "lttb": lttb,
+    "minmax": min_max,
+}
+
+
+def read_series(db, point_id: int, columns: List[str], start: Optional[datetime],
+                end: Optional[datetime]) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Время (секунды) и значения столбцов точки за [start, end] в порядке времени"""
+    seconds = epoch_expression(raw_table.c.data_and_time, db.get_bind().dialect.name)
+    stmt = select(seconds, *[raw_table.c[column] for column in columns]).where(
+        raw_table.c.id_point == point_id,
+        raw_table.c.data_and_time.isnot(None),
+    )
+    if start is not None:
+        stmt = stmt.where(raw_table.c.data_and_time >= start)
+    if end is not None:
+        stmt = stmt.where(raw_table.c.data_and_time <= end)
+    stmt = stmt.order_by(raw_table.c.data_and_time, raw_table.c.id_data)
+
+    parts: List[List[np.ndarray]] = [[] for _ in range(len(columns) + 1)]
+    result = db.execute(stmt, execution_options={"yield_per": DOWNSAMPLE_CHUNK_SIZE})
+    chunks = result.partitions()
+    files = archive.archive_files(start, end)
+    if files:
+        archive_rows = archive.iter_rows(["epoch(data_and_time)", *columns], ["data_and_time", "id_data"],
+                                         files, [point_id], start, end, end_inclusive=True)
+        chunks = itertools.chain(chunks, iter(lambda: list(itertools.islice(archive_rows, DOWNSAMPLE_CHUNK_SIZE)), []))
+    for chunk in chunks:
+        # None -> NaN
+        for part, values in zip(parts, zip(*chunk)):
+            part.append(np.array(values, dtype=float))
+    arrays = [np.concatenate(part) if part else np.empty(0) for part in parts]
+    if files:
+        # Строки таблицы и архива - в общем порядке времени
+        order = np.argsort(arrays[0], kind="stable")
+        arrays = [array[order] for array in arrays]
+    return arrays[0], dict(zip(columns, arrays[1:]))
+
+
+def downsample_point(db, point_id: int, columns: List[str], start: Optional[datetime], end: Optional[datetime],
+                     max_points: int, method: str = "lttb") -> dict:
+    """Прореженные ряды показателей точки (вызывается через AsyncSession.run_sync)"""
+    times, values = read_series(db, point_id, columns, start, end)
+    series = {}
+    for column, column_values in values.items():
+        present = ~np.isnan(column_values)
+        series_times, series_values = times[present], column_values[present]
+        selected = DOWNSAMPLERS[method](series_times, series_values, max_points)
+        series[column] = {
+            "source_points": int(len(series_values)),
+            "data_and_time": [from_epoch(value) for value in series_times[selected].tolist()],
+            "values": series_values[selected].tolist(),
+        }
+    return {
+        "point_id": point_id,
+        "method": method,
+        "max_points": max_points,
+        "source_rows": int(len(times)),
+        "series": series,
+    }
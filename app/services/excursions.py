@@ -0,0 +1,276 @@
+"""
+Превышения порога расхода воды (parametr_q_H2O > parametr_q_H2O_porog)
+Превышение - интервал отсчетов точки выше порога, хранится в таблице
+Threshold_excursion: открывается первым отсчетом выше порога и закрывается
+первым отсчетом не выше (ended_at). Отсчеты без значения или порога состояние
+не меняют.
+
+Пороги проверяются при каждой записи через CRUD: для точки в памяти хранится
+последний отсчет и открытое превышение, поэтому новые строки сравниваются
+только с этим состоянием, исходные строки не перечитываются. Строки задним
+числом, правки и удаления, а также первая запись по точке после запуска
+пересчитывают превышения точки начиная с затронутого момента. Пересчет читает
+и строки холодного архива (app/services/archive.py), поэтому превышения
+архивных месяцев сохраняются. Полный пересчет (после правок в обход API):
+
+    python -m app.services.excursions rebuild
+"""
+import argparse
+import asyncio
+import copy
+import heapq
+import itertools
+import logging
+from collections import defaultdict
+from contextlib import AsyncExitStack, asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, or_, select, update
+
+from app.models.models import CalculatedData, ThresholdExcursion
+from app.services import archive
+from app.utils.time_buckets import parse_datetime
+
+logger = logging.getLogger(__name__)
+
+# Строк из курсора за одно чтение при пересчете
+EXCURSION_CHUNK_SIZE = 10000
+
+raw_table = CalculatedData.__table__
+excursion_table = ThresholdExcursion.__table__
+
+# (id_point, data_and_time, parametr_q_H2O, parametr_q_H2O_porog)
+Sample = Tuple[int, datetime, Optional[float], Optional[float]]
+
+
+class PointState:
+    """Последний учтенный отсчет точки и открытое превышение (None - значение ниже порога)"""
+    __slots__ = ("last_time", "last_value", "excursion")
+
+    def __init__(self, last_time: Optional[datetime] = None, last_value: Optional[float] = None,
+                 excursion: Optional[dict] = None):
+        self.last_time = last_time
+        self.last_value = last_value
+        self.excursion = excursion
+
+    def copy(self) -> "PointState":
+        return PointState(self.last_time, self.last_value, copy.copy(self.excursion))
+
+
+def advance(state: PointState, samples: Iterable[Tuple[datetime, Optional[float], Optional[float]]]) -> List[dict]:
+    """Учесть отсчеты точки по порядку времени; возвращает открытые, измененные и закрытые превышения"""
+    touched: Dict[int, dict] = {}
+    for time, value, threshold in samples:
+        state.last_time = time
+        if value is not None:
+            state.last_value = value
+        if value is None or threshold is None:
+            continue
+        excursion = state.excursion
+        if value > threshold:
+            if excursion is None:
+                excursion = state.excursion = {
+                    "id_excursion": None,
+                    "started_at": time,
+                    "ended_at": None,
+                    "threshold": threshold,
+                    "peak_value": value,
+                    "peak_at": time,
+                    "sample_count": 0,
+                }
+            excursion["sample_count"] += 1
+            if value > excursion["peak_value"]:
+                excursion["peak_value"] = value
+                excursion["peak_at"] = time
+            touched[id(excursion)] = excursion
+        elif excursion is not None:
+            excursion["ended_at"] = time
+            touched[id(excursion)] = excursion
+            state.excursion = None
+    return list(touched.values())
+
+
+def save_excursions(db, point_id: int, excursions: List[dict]):
+    """Записать превышения точки: новые вставляются (id_excursion заполняется), остальные обновляются"""
+    for excursion in excursions:
+        excursion["id_point"] = point_id
+        values = {key: value for key, value in excursion.items() if key != "id_excursion"}
+        if excursion["id_excursion"] is not None:
+            result = db.execute(
+                update(excursion_table)
+                .where(excursion_table.c.id_excursion == excursion["id_excursion"])
+                .values(**values)
+            )
+            if result.rowcount:
+                continue
+            # Строку удалил пересчет в другом процессе (rebuild) - записываем заново
+        result = db.execute(insert(excursion_table).values(**values))
+        excursion["id_excursion"] = result.inserted_primary_key[0]
+
+
+def replay_point(db, point_id: int, since: Optional[datetime] = None,
+                 touched: Optional[List[dict]] = None) -> PointState:
+    """
+    Пересчитать превышения точки с момента since (None - все) по исходным строкам
+    Пересчет начинается с начала превышения, которое продолжалось в момент since;
+    записанные превышения добавляются в touched.
+    """
+    conditions = [excursion_table.c.id_point == point_id]
+    if since is not None:
+        covering_start = db.execute(
+            select(func.min(excursion_table.c.started_at)).where(
+                excursion_table.c.id_point == point_id,
+                or_(excursion_table.c.ended_at.is_(None), excursion_table.c.ended_at >= since),
+            )
+        ).scalar()
+        since = min(since, parse_datetime(covering_start)) if covering_start is not None else since
+        conditions.append(excursion_table.c.started_at >= since)
+    db.execute(delete(excursion_table).where(*conditions))
+
+    columns = ("data_and_time", "parametr_q_H2O", "parametr_q_H2O_porog", "id_data")
+    stmt = select(*[raw_table.c[column] for column in columns]).where(
+        raw_table.c.id_point == point_id,
+        raw_table.c.data_and_time.isnot(None),
+    )
+    if since is not None:
+        stmt = stmt.where(raw_table.c.data_and_time >= since)
+    stmt = stmt.order_by(raw_table.c.data_and_time, raw_table.c.id_data)
+
+    state = PointState()
+    result = db.execute(stmt, execution_options={"yield_per": EXCURSION_CHUNK_SIZE})
+    partitions = result.partitions()
+    files = archive.archive_files(since, None)
+    if files:
+        # Отсчеты холодного архива - в общем порядке (data_and_time, id_data)
+        archive_rows = archive.iter_rows(columns, ["data_and_time", "id_data"], files, [point_id], since)
+        rows = heapq.merge(result, archive_rows, key=lambda row: (row[0], row[3]))
+        partitions = iter(lambda: list(itertools.islice(rows, EXCURSION_CHUNK_SIZE)), [])
+    for partition in partitions:
+        excursions = advance(state, (row[:3] for row in partition))
+        save_excursions(db, point_id, excursions)
+        if touched is not None:
+            touched.extend(excursions)
+    return state
+
+
+class ExcursionEngine:
+    """Состояние точек в памяти и проверка порогов при записи"""
+
+    def __init__(self):
+        self.states: Dict[int, PointState] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    def _point_lock(self, point_id: int) -> asyncio.Lock:
+        # Создается в работающем цикле событий
+        lock = self._locks.get(point_id)
+        if lock is None:
+            lock = self._locks[point_id] = asyncio.Lock()
+        return lock
+
+    @staticmethod
+    def _is_current(db, point_id: int, state: Optional[PointState], first_time: datetime) -> bool:
+        """
+        Состояние учитывает все строки точки до first_time: последняя такая строка
+        (один поиск по индексу (id_point, data_and_time)) совпадает с последним учтенным
+        отсчетом. Строки, записанные другим процессом приложения, так обнаруживаются.
+        """
+        if state is None or state.last_time is None or first_time <= state.last_time:
+            return False
+        previous = db.execute(
+            select(func.max(raw_table.c.data_and_time))
+            .where(raw_table.c.id_point == point_id, raw_table.c.data_and_time < first_time)
+        ).scalar()
+        return previous is not None and parse_datetime(previous) == state.last_time
+
+    def evaluate(self, db, samples: Iterable[Sample] = (),
+                 changed: Iterable[Tuple[Optional[int], Optional[datetime]]] = ()) -> Tuple[Dict[int, PointState], List[dict]]:
+        """
+        Обновить превышения по новым отсчетам samples и измененным строкам changed
+        (ключи (id_point, data_and_time) до и после правки или удаления). Вызывается
+        в транзакции записи до commit; возвращает новое состояние затронутых точек
+        и записанные превышения.
+        """
+        by_point: Dict[int, list] = defaultdict(list)
+        for point_id, time, value, threshold in samples:
+            if point_id is not None and time is not None:
+                by_point[point_id].append((parse_datetime(time), value, threshold))
+        replay_from: Dict[int, datetime] = {}
+        for point_id, time in changed:
+            if point_id is not None and time is not None:
+                time = parse_datetime(time)
+                replay_from[point_id] = min(time, replay_from.get(point_id, time))
+
+        states = {}
+        touched = []
+        for point_id in by_point.keys() | replay_from.keys():
+            point_samples = sorted(by_point.get(point_id, []), key=lambda sample: sample[0])
+            state = self.states.get(point_id)
+            since = replay_from.get(point_id)
+            if point_samples and not self._is_current(db, point_id, state, point_samples[0][0]):
+                # Состояние неизвестно, устарело или отсчет задним числом - пересчет с первого нового отсчета
+                since = min(point_samples[0][0], since or point_samples[0][0])
+            if since is not None:
+                states[point_id] = replay_point(db, point_id, since, touched)
+                continue
+            state = state.copy()
+            excursions = advance(state, point_samples)
+            save_excursions(db, point_id, excursions)
+            touched.extend(excursions)
+            states[point_id] = state
+        return states, touched
+
+    @asynccontextmanager
+    async def stage(self, db, samples: Iterable[Sample] = (),
+                    changed: Iterable[Tuple[Optional[int], Optional[datetime]]] = ()) -> AsyncIterator[List[dict]]:
+        """
+        Проверить пороги и записать превышения в транзакцию db (без commit); значение
+        блока - открытые, измененные и закрытые превышения. Commit выполняет вызывающий
+        внутри блока: затронутые точки заблокированы до выхода из него, состояние в памяти
+        обновляется при выходе без исключения.
+        Записи по разным точкам не ждут друг друга: блокируются только затронутые точки
+        (по возрастанию id, чтобы записи не ждали друг друга по кругу).
+        """
+        samples, changed = list(samples), list(changed)
+        point_ids = {sample[0] for sample in samples if sample[0] is not None and sample[1] is not None}
+        point_ids.update(point_id for point_id, time in changed if point_id is not None and time is not None)
+        async with AsyncExitStack() as stack:
+            for point_id in sorted(point_ids):
+                await stack.enter_async_context(self._point_lock(point_id))
+            states, touched = await db.run_sync(self.evaluate, samples, changed)
+            yield touched
+            self.states.update(states)
+
+
+def rebuild_all(db, point_ids: Optional[List[int]] = None):
+    """Полный пересчет превышений по исходным строкам"""
+    if point_ids is None:
+        point_ids = list(db.execute(select(raw_table.c.id_point).where(raw_table.c.id_point.isnot(None)).distinct()).scalars())
+        db.execute(delete(excursion_table))
+    for point_id in point_ids:
+        replay_point(db, point_id)
+
+
+excursion_engine = ExcursionEngine()
+
+
+def main():
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Превышения порога расхода воды (Threshold_excursion)")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--point", type=int, action="append", help="пересчитать только указанные точки")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    db = SessionLocal()
+    try:
+        rebuild_all(db, args.point)
+        db.commit()
+    finally:
+        db.close()
+    logger.info("Превышения пересчитаны")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Индекс иерархии точек измерений (Measuring_point.id_parent_point)
+Все точки с глубиной загружаются одним рекурсивным CTE от корней, дерево
+хранится в памяти процесса и сбрасывается при записи точек через CRUD.
+В нескольких воркерах сброс локальный, поэтому у индекса есть TTL.
+"""
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, literal, select
+
+from app.models.models import MeasuringPoint
+from app.schemas.schemas import MeasuringPoint as MeasuringPointSchema
+
+logger = logging.getLogger(__name__)
+
+HIERARCHY_CACHE_TTL_SECONDS = float(os.getenv("HIERARCHY_CACHE_TTL_SECONDS", "300"))
+
+points_table = MeasuringPoint.__table__
+
+
+def hierarchy_query():
+    """Все точки, достижимые от корней, с глубиной (0 - корень)"""
+    tree = (
+        select(points_table.c.id_point, literal(0).label("depth"))
+        .where(points_table.c.id_parent_point.is_(None))
+        .cte("tree", recursive=True)
+    )
+    tree = tree.union_all(
+        select(points_table.c.id_point, tree.c.depth + 1)
+        .join(tree, points_table.c.id_parent_point == tree.c.id_point)
+    )
+    return (
+        select(points_table, tree.c.depth)
+        .join(tree, tree.c.id_point == points_table.c.id_point)
+        .order_by(tree.c.depth, points_table.c.id_point)
+    )
+
+
+class HierarchyIndex:
+    def __init__(self, rows):
+        self.points: Dict[int, dict] = {}
+        self.parents: Dict[int, Optional[int]] = {}
+        self.depths: Dict[int, int] = {}
+        self.children: Dict[Optional[int], List[int]] = defaultdict(list)
+        # Строки идут по глубине и id, поэтому списки детей уже упорядочены
+        for row in rows:
+            values = dict(row._mapping)
+            depth = values.pop("depth")
+            point_id = values["id_point"]
+            self.points[point_id] = MeasuringPointSchema.model_validate(values).model_dump()
+            self.parents[point_id] = values["id_parent_point"]
+            self.depths[point_id] = depth
+            self.children[values["id_parent_point"]].append(point_id)
+        self.built_at = time.monotonic()
+        self._tree_json = None
+
+    def __contains__(self, point_id: int) -> bool:
+        return point_id in self.points
+
+    def subtree(self, point_id: int) -> dict:
+        """Узел {"point", "children"} со всеми потомками"""
+        root = {"point": self.points[point_id], "children": []}
+        # Обход без рекурсии: глубина сети не ограничена стеком Python
+        stack = [(point_id, root)]
+        while stack:
+            current_id, node = stack.pop()
+            for child_id in self.children.get(current_id, ()):
+                child = {"point": self.points[child_id], "children": []}
+                node["children"].append(child)
+                stack.append((child_id, child))
+        return root
+
+    def tree(self) -> List[dict]:
+        """Полное дерево от корней"""
+        return [self.subtree(root_id) for root_id in self.children.get(None, ())]
+
+    def tree_json(self) -> bytes:
+        """Полное дерево в JSON (сериализуется один раз на индекс)"""
+        if self._tree_json is None:
+            self._tree_json = json.dumps(self.tree(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return self._tree_json
+
+    def ancestors(self, point_id: int) -> List[dict]:
+        """Предки точки от корня к непосредственному родителю"""
+        result = []
+        parent_id = self.parents[point_id]
+        while parent_id is not None:
+            result.append(self.points[parent_id])
+            parent_id = self.parents[parent_id]
+        result.reverse()
+        return result
+
+    def descendant_ids(self, point_id: int) -> List[int]:
+        """Все потомки в порядке обхода в ширину"""
+        result = []
+        queue = list(self.children.get(point_id, ()))
+        for child_id in queue:
+            result.append(child_id)
+            queue.extend(self.children.get(child_id, ()))
+        return result
+
+    def descendants(self, point_id: int) -> List[dict]:
+        return [self.points[child_id] for child_id in self.descendant_ids(point_id)]
+
+
+class HierarchyCache:
+    def __init__(self, ttl: float = HIERARCHY_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self.index: Optional[HierarchyIndex] = None
+        # Увеличивается при сбросе: индекс, построенный во время записи, не сохраняется
+        self.generation = 0
+
+    async def get(self, db) -> HierarchyIndex:
+        index = self.index
+        if index is None or time.monotonic() - index.built_at > self.ttl:
+            generation = self.generation
+            index = HierarchyIndex(await db.execute(hierarchy_query()))
+            total = await db.scalar(select(func.count()).select_from(points_table))
+            if total != len(index.points):
+                # Точки в цикле родителей недостижимы от корней и в дерево не попадают
+                logger.warning(f"Иерархия точек: {total - len(index.points)} точек не связаны с корнями (цикл id_parent_point)")
+            if generation == self.generation:
+                self.index = index
+        return index
+
+    def invalidate(self):
+        self.generation += 1
+        self.index = None
+
+
+hierarchy_cache = HierarchyCache()
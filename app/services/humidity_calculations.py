@@ -1,7 +1,10 @@
 import math
+from bisect import bisect_left
 from typing import List, Dict, Tuple
 import logging
 
+import numpy as np
+
 logger = logging.getLogger(__name__)
 
 class HumidityCalculator:
@@ -25,6 +28,19 @@ class HumidityCalculator:
         0.450: 15.7,  0.500: 17.7,  0.600: 20.8,  0.700: 23.4,
         0.800: 25.9,  0.900: 28.0,  1.000: 29.8
     }
+    # Узлы таблицы, отсортированные один раз при загрузке класса
+    TABLE_HUMIDITIES = tuple(sorted(DEW_POINT_TABLE))
+    TABLE_DEW_POINTS = tuple(map(DEW_POINT_TABLE.get, TABLE_HUMIDITIES))
+    _TABLE_HUMIDITIES_ARRAY = np.array(TABLE_HUMIDITIES)
+    _TABLE_DEW_POINTS_ARRAY = np.array(TABLE_DEW_POINTS)
+    
+    # Методы определения ТТР смеси: интерполяция по таблице или обращение формулы
+    DEW_POINT_METHODS = ("table", "exact")
+    # Параметры решателя Ньютона; выше ~120°C формула п. 6.2.2 перестает быть монотонной
+    NEWTON_TOLERANCE = 1e-9
+    NEWTON_MAX_ITERATIONS = 50
+    NEWTON_T_MIN = -100.0
+    NEWTON_T_MAX = 120.0
     
     @classmethod
     def calculate_humidity_content(cls, dew_point: float) -> float:
@@ -65,42 +81,85 @@ class HumidityCalculator:
         return result
     
     @classmethod
-    def calculate_mixture_dew_point(cls, mixture_humidity: float) -> float:
+    def calculate_humidity_content_array(cls, dew_points) -> np.ndarray:
+        """
+        Векторный расчет влагосодержания для массива ТТР
+        Та же формула п. 6.2.2 ТЗ, что и в calculate_humidity_content
         """
-        Расчет ТТР смеси газов по таблице из Приложения Г
-        Использует метод интерполяции из п. 6.2.2 и 6.3.2 ТЗ
+        t = np.asarray(dew_points, dtype=np.float64)
+        
+        out_of_range = np.count_nonzero((t < -50) | (t > 50))
+        if out_of_range:
+            logger.warning(f"ТТР за пределами обычного диапазона: {out_of_range} значений")
+        
+        with np.errstate(over='ignore'):
+            part1 = (np.exp(cls.A0 + cls.A1 * t + cls.A2 * t**2) * cls.P_ATM) / cls.P
+            part2 = np.exp(cls.B0 + cls.B1 * t + cls.B2 * t**2)
+            result = part1 + part2
+        
+        # Переполнение экспоненты обрабатываем так же, как скалярная версия
+        return np.where(np.isinf(result), 0.0, result)
+    
+    @classmethod
+    def calculate_water_mass_array(cls, humidity_content, gas_volume) -> np.ndarray:
+        """
+        Векторный расчет количества воды в объемах газа
+        Формула из п. 6.2.2 ТЗ: W = w * V
         """
+        w = np.asarray(humidity_content, dtype=np.float64)
+        v = np.asarray(gas_volume, dtype=np.float64)
+        if np.any(v <= 0):
+            raise ValueError("Объем газа должен быть положительным")
+        if np.any(w < 0):
+            raise ValueError("Влагосодержание не может быть отрицательным")
+        
+        return w * v
+    
+    @classmethod
+    def calculate_mixture_dew_point(cls, mixture_humidity: float, method: str = "table") -> float:
+        """
+        Расчет ТТР смеси газов
+        method="table" - интерполяция по таблице из Приложения Г (п. 6.2.2 и 6.3.2 ТЗ),
+        method="exact" - численное обращение формулы п. 6.2.2 без ограничения диапазоном таблицы
+        Для NaN результат NaN (как в calculate_mixture_dew_point_array)
+        """
+        if method not in cls.DEW_POINT_METHODS:
+            raise ValueError(f"Unsupported dew point method: {method}")
+        
+        if math.isnan(mixture_humidity):
+            return math.nan
+        
         if mixture_humidity <= 0:
             return -50.0  # Минимальное значение
         
+        if method == "exact":
+            result = float(cls.solve_dew_point_array(mixture_humidity))
+            if math.isnan(result):
+                raise ValueError(
+                    f"Влагосодержание {mixture_humidity} вне диапазона решателя ТТР "
+                    f"({cls.NEWTON_T_MIN}...{cls.NEWTON_T_MAX} °C)"
+                )
+            result = round(result, 2)
+            logger.debug(f"Mixture dew point (exact): humidity={mixture_humidity}, result={result}")
+            return result
+        
         if mixture_humidity > 1.0:
             logger.warning(f"Высокое влагосодержание смеси: {mixture_humidity}")
         
-        # Находим ближайшие значения в таблице
-        sorted_humidities = sorted(cls.DEW_POINT_TABLE.keys())
-        
-        if mixture_humidity <= sorted_humidities[0]:
-            return cls.DEW_POINT_TABLE[sorted_humidities[0]]
-        
-        if mixture_humidity >= sorted_humidities[-1]:
-            return cls.DEW_POINT_TABLE[sorted_humidities[-1]]
+        humidities = cls.TABLE_HUMIDITIES
         
-        # Находим ближайшие значения для интерполяции
-        lower_humidity = None
-        upper_humidity = None
+        if mixture_humidity <= humidities[0]:
+            return cls.TABLE_DEW_POINTS[0]
         
-        for i in range(len(sorted_humidities) - 1):
-            if sorted_humidities[i] <= mixture_humidity <= sorted_humidities[i + 1]:
-                lower_humidity = sorted_humidities[i]
-                upper_humidity = sorted_humidities[i + 1]
-                break
+        if mixture_humidity >= humidities[-1]:
+            return cls.TABLE_DEW_POINTS[-1]
         
-        if lower_humidity is None or upper_humidity is None:
-            return cls.DEW_POINT_TABLE[sorted_humidities[0]]
+        # Бинарный поиск интервала [x1, x2], содержащего значение
+        # humidities[0] < x < humidities[-1], поэтому 0 <= i <= len(humidities) - 2
+        i = bisect_left(humidities, mixture_humidity) - 1
         
-        # Линейная интерполяция
-        lower_dew_point = cls.DEW_POINT_TABLE[lower_humidity]
-        upper_dew_point = cls.DEW_POINT_TABLE[upper_humidity]
+        lower_humidity, upper_humidity = humidities[i], humidities[i + 1]
+        lower_dew_point, upper_dew_point = cls.TABLE_DEW_POINTS[i], cls.TABLE_DEW_POINTS[i + 1]
         
         # Интерполяция: y = y1 + (x - x1) * (y2 - y1) / (x2 - x1)
         interpolated_dew_point = lower_dew_point + (mixture_humidity - lower_humidity) * \
@@ -108,4 +167,66 @@ class HumidityCalculator:
         
         result = round(interpolated_dew_point, 2)
         logger.debug(f"Mixture dew point: humidity={mixture_humidity}, result={result}")
-        return result
\ No newline at end of file
+        return result
+    
+    @classmethod
+    def calculate_mixture_dew_point_array(cls, mixture_humidity, method: str = "table") -> np.ndarray:
+        """
+        Векторный расчет ТТР смесей, аналог calculate_mixture_dew_point
+        Интервалы таблицы ищутся через np.searchsorted, для NaN результат NaN
+        """
+        if method not in cls.DEW_POINT_METHODS:
+            raise ValueError(f"Unsupported dew point method: {method}")
+        
+        x = np.asarray(mixture_humidity, dtype=np.float64)
+        
+        if method == "exact":
+            result = cls.solve_dew_point_array(x)
+        else:
+            xp = cls._TABLE_HUMIDITIES_ARRAY
+            fp = cls._TABLE_DEW_POINTS_ARRAY
+            high = np.count_nonzero(x > 1.0)
+            if high:
+                logger.warning(f"Высокое влагосодержание смеси: {high} значений")
+            clipped = np.clip(x, xp[0], xp[-1])
+            i = np.clip(np.searchsorted(xp, clipped, side='left') - 1, 0, len(xp) - 2)
+            result = fp[i] + (clipped - xp[i]) * (fp[i + 1] - fp[i]) / (xp[i + 1] - xp[i])
+        
+        return np.where(x <= 0, -50.0, np.round(result, 2))
+    
+    @classmethod
+    def solve_dew_point_array(cls, humidity_content) -> np.ndarray:
+        """
+        Обращение формулы п. 6.2.2 ТЗ методом Ньютона: ТТР по влагосодержанию
+        Решается ln w(T) = ln w, начальное приближение берется из таблицы Приложения Г
+        Для w <= 0 результат -50, для NaN и для w, которому соответствует ТТР вне
+        [NEWTON_T_MIN, NEWTON_T_MAX], - NaN (решение не ограничивается границей диапазона)
+        """
+        w_target = np.asarray(humidity_content, dtype=np.float64)
+        t_bounds = np.array([cls.NEWTON_T_MIN, cls.NEWTON_T_MAX])
+        w_bounds = np.exp(cls.A0 + cls.A1 * t_bounds + cls.A2 * t_bounds**2) * cls.P_ATM / cls.P \
+            + np.exp(cls.B0 + cls.B1 * t_bounds + cls.B2 * t_bounds**2)
+        in_range = (w_target >= w_bounds[0]) & (w_target <= w_bounds[1])
+        valid = (w_target > 0) & in_range
+        log_target = np.log(np.where(valid, w_target, 1.0))
+        
+        xp = cls._TABLE_HUMIDITIES_ARRAY
+        t = np.interp(np.where(valid, w_target, xp[0]), xp, cls._TABLE_DEW_POINTS_ARRAY)
+        
+        converged = False
+        for _ in range(cls.NEWTON_MAX_ITERATIONS):
+            part1 = np.exp(cls.A0 + cls.A1 * t + cls.A2 * t**2) * cls.P_ATM / cls.P
+            part2 = np.exp(cls.B0 + cls.B1 * t + cls.B2 * t**2)
+            w = part1 + part2
+            dw = part1 * (cls.A1 + 2 * cls.A2 * t) + part2 * (cls.B1 + 2 * cls.B2 * t)
+            # f(T) = ln w(T) - ln w_target, f'(T) = w'(T) / w(T)
+            step = (np.log(w) - log_target) * w / dw
+            t = np.clip(t - step, cls.NEWTON_T_MIN, cls.NEWTON_T_MAX)
+            if np.all(np.abs(step[valid]) < cls.NEWTON_TOLERANCE):
+                converged = True
+                break
+        
+        if not converged:
+            logger.warning("Решатель ТТР не сошелся для части значений влагосодержания")
+        
+        return np.where(valid, t, np.where(w_target <= 0, -50.0, np.nan))
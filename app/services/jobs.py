@@ -0,0 +1,317 @@
+"""
+Фоновые задачи для тяжелых выгрузок и отчетов
+Задача ставится в очередь и сразу получает id; работа (pandas/openpyxl,
+чтение БД курсором) выполняется в общем пуле процессов, результат пишется
+в локальный каталог JOBS_SPOOL_DIR. Состояние и прогресс задачи хранятся
+там же в <id>.json, поэтому их видят все воркеры приложения. Файлы старше
+JOBS_TTL_SECONDS удаляются периодической очисткой. Внешний брокер не нужен.
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.database import engine
+from app.services.data_export import (
+    calculator_export_frame,
+    iter_calculated_data,
+    parse_export_parameters,
+    report_export_frame,
+    stream_rows,
+    write_excel,
+)
+from app.services.process_pool import run_in_process
+from app.services.report_engine import ReportConfig, encode_report_rows, iter_report_rows, prepare_report
+
+logger = logging.getLogger(__name__)
+
+JOBS_SPOOL_DIR = os.getenv("JOBS_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "gas_humidity_jobs"))
+JOBS_TTL_SECONDS = float(os.getenv("JOBS_TTL_SECONDS", "3600"))
+JOBS_CLEANUP_INTERVAL_SECONDS = float(os.getenv("JOBS_CLEANUP_INTERVAL_SECONDS", "60"))
+# Задачи в очереди и в работе (возможно, в другом воркере) удаляются только после такого срока без изменений
+JOBS_STALE_SECONDS = float(os.getenv("JOBS_STALE_SECONDS", "86400"))
+# Одновременно выполняемые задачи и всего принятых (в очереди + в работе) в одном воркере
+JOBS_MAX_CONCURRENT = int(os.getenv("JOBS_MAX_CONCURRENT", "2"))
+JOBS_MAX_PENDING = int(os.getenv("JOBS_MAX_PENDING", "20"))
+# Прогресс записывается не чаще раза в столько секунд
+JOBS_PROGRESS_INTERVAL_SECONDS = 0.5
+
+# Тип задачи -> допустимые форматы результата
+JOB_TYPES = {
+    "calculated_data": ("csv", "ndjson", "excel"),
+    "custom_report": ("ndjson", "csv"),
+    "calculator": ("excel",),
+    "report": ("excel",),
+}
+FORMAT_FILES = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "excel": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+}
+
+_JOB_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+class JobQueueFull(Exception):
+    """Превышено число принятых задач"""
+
+
+def _now() -> str:
+    return datetime.now().isoformat()
+
+
+class JobStore:
+    """Файлы задач в каталоге: <id>.json - состояние, <id>.<ext> - результат"""
+
+    def __init__(self, spool_dir: str = JOBS_SPOOL_DIR):
+        self.spool_dir = spool_dir
+
+    def status_path(self, job_id: str) -> str:
+        return os.path.join(self.spool_dir, f"{job_id}.json")
+
+    def result_path(self, job_id: str, extension: str) -> str:
+        return os.path.join(self.spool_dir, f"{job_id}.{extension}")
+
+    def read(self, job_id: str) -> Optional[dict]:
+        if not _JOB_ID_RE.match(job_id):
+            return None
+        try:
+            with open(self.status_path(job_id), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:
+            logger.warning(f"Поврежден файл состояния задачи {job_id}")
+            return None
+
+    def write(self, status: dict):
+        # Запись через временный файл: читатель не увидит половину JSON
+        os.makedirs(self.spool_dir, exist_ok=True)
+        path = self.status_path(status["job_id"])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(status, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def update(self, job_id: str, **changes) -> dict:
+        status = self.read(job_id) or {"job_id": job_id}
+        status.update(changes)
+        self.write(status)
+        return status
+
+    def remove(self, job_id: str):
+        status = self.read(job_id)
+        paths = [self.status_path(job_id)]
+        if status is not None:
+            extension = FORMAT_FILES[status["format"]][1]
+            paths += [self.result_path(job_id, extension), self.result_path(job_id, extension) + ".part"]
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def job_ids(self) -> Iterator[str]:
+        try:
+            names = os.listdir(self.spool_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            job_id, extension = os.path.splitext(name)
+            if extension == ".json" and _JOB_ID_RE.match(job_id):
+                yield job_id
+
+
+class Progress:
+    """Счетчик строк результата с редкой записью в файл состояния"""
+
+    def __init__(self, store: JobStore, job_id: str):
+        self.store = store
+        self.job_id = job_id
+        self.rows = 0
+        self.written_at = 0.0
+
+    def count(self, rows: Iterator) -> Iterator:
+        for row in rows:
+            self.rows += 1
+            if time.monotonic() - self.written_at >= JOBS_PROGRESS_INTERVAL_SECONDS:
+                self.store.update(self.job_id, progress={"rows": self.rows})
+                self.written_at = time.monotonic()
+            yield row
+
+
+def validate_job(job_type: str, parameters: Dict[str, Any], format: str) -> Dict[str, Any]:
+    """Проверить параметры до постановки в очередь; ValueError - ошибка клиента"""
+    if job_type not in JOB_TYPES:
+        raise ValueError(f"Unsupported job type. Use one of: {', '.join(JOB_TYPES)}")
+    if format not in JOB_TYPES[job_type]:
+        raise ValueError(f"Unsupported format for {job_type}. Use one of: {', '.join(JOB_TYPES[job_type])}")
+    if job_type == "calculated_data":
+        return parse_export_parameters(parameters)
+    if job_type == "custom_report":
+        return ReportConfig.model_validate({**parameters, "format": format}).model_dump()
+    return parameters
+
+
+def _produce(job_type: str, parameters: Dict[str, Any], format: str, progress: Progress) -> Iterator[bytes]:
+    """Содержимое результата блоками (выполняется в процессе пула)"""
+    if job_type == "calculated_data":
+        return stream_rows(format, progress.count(iter_calculated_data(**parameters)))
+    if job_type == "custom_report":
+        config = ReportConfig.model_validate(parameters)
+        plan, query_parameters = prepare_report(config, engine.dialect.name)
+        return encode_report_rows(format, plan.columns, progress.count(iter_report_rows(plan, query_parameters)))
+
+    frame = calculator_export_frame(parameters) if job_type == "calculator" else report_export_frame(parameters)
+    progress.rows = len(frame)
+    output = io.BytesIO()
+    write_excel(frame, output)
+    return iter([output.getvalue()])
+
+
+def run_job(spool_dir: str, job_id: str, job_type: str, parameters: Dict[str, Any], format: str) -> dict:
+    """Выполнить задачу и записать результат в каталог задач (задача пула процессов)"""
+    store = JobStore(spool_dir)
+    store.update(job_id, status="running", started_at=_now())
+    progress = Progress(store, job_id)
+    path = store.result_path(job_id, FORMAT_FILES[format][1])
+    part_path = path + ".part"
+    try:
+        with open(part_path, "wb") as f:
+            for chunk in _produce(job_type, parameters, format, progress):
+                f.write(chunk)
+        os.replace(part_path, path)
+    except Exception as e:
+        logger.error(f"Job {job_id} ({job_type}) failed: {e}")
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        return store.update(job_id, status="failed", error=str(e), finished_at=_now(), progress={"rows": progress.rows})
+    return store.update(
+        job_id,
+        status="done",
+        finished_at=_now(),
+        progress={"rows": progress.rows},
+        size=os.path.getsize(path),
+    )
+
+
+class JobManager:
+    def __init__(self, spool_dir: str = JOBS_SPOOL_DIR, max_concurrent: int = JOBS_MAX_CONCURRENT,
+                 max_pending: int = JOBS_MAX_PENDING, ttl: float = JOBS_TTL_SECONDS,
+                 stale: float = JOBS_STALE_SECONDS):
+        self.store = JobStore(spool_dir)
+        self.max_concurrent = max_concurrent
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.stale = stale
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._cleanup_task: Optional[asyncio.Task] = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Создается в работающем цикле событий
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self._semaphore
+
+    def submit(self, job_type: str, parameters: Dict[str, Any], format: str) -> dict:
+        """Поставить задачу в очередь; ValueError - неверные параметры, JobQueueFull - очередь заполнена"""
+        parameters = validate_job(job_type, parameters, format)
+        if len(self.tasks) >= self.max_pending:
+            raise JobQueueFull(f"Too many jobs in progress ({self.max_pending}), try again later")
+        job_id = uuid.uuid4().hex
+        media_type, extension = FORMAT_FILES[format]
+        status = {
+            "job_id": job_id,
+            "job_type": job_type,
+            "format": format,
+            "status": "queued",
+            "created_at": _now(),
+            "started_at": None,
+            "finished_at": None,
+            "progress": {"rows": 0},
+            "error": None,
+            "size": None,
+            "media_type": media_type,
+            "filename": f"{job_type}_{job_id[:8]}.{extension}",
+        }
+        self.store.write(status)
+        task = asyncio.get_running_loop().create_task(self._run(job_id, job_type, parameters, format))
+        self.tasks[job_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(job_id, None))
+        return status
+
+    async def _run(self, job_id: str, job_type: str, parameters: Dict[str, Any], format: str):
+        async with self.semaphore:
+            try:
+                await run_in_process(run_job, self.store.spool_dir, job_id, job_type, parameters, format)
+            except Exception as e:
+                # Процесс пула упал или задача не сериализуется - состояние пишем здесь
+                logger.error(f"Job {job_id} ({job_type}) crashed: {e}")
+                await run_in_threadpool(self.store.update, job_id, status="failed", error=str(e), finished_at=_now())
+
+    def status(self, job_id: str) -> Optional[dict]:
+        return self.store.read(job_id)
+
+    def result_path(self, status: dict) -> str:
+        return self.store.result_path(status["job_id"], FORMAT_FILES[status["format"]][1])
+
+    def delete(self, job_id: str):
+        self.store.remove(job_id)
+
+    def cleanup(self) -> int:
+        """
+        Удалить завершенные задачи, состояние которых не менялось дольше TTL.
+        Задачи в очереди и в работе могут выполняться другим воркером (выгрузка Excel
+        не обновляет прогресс): они удаляются как потерянные только после срока stale.
+        """
+        removed = 0
+        now = time.time()
+        for job_id in list(self.store.job_ids()):
+            if job_id in self.tasks:
+                continue
+            try:
+                modified = os.path.getmtime(self.store.status_path(job_id))
+            except FileNotFoundError:
+                continue
+            if modified >= now - self.ttl:
+                continue
+            status = self.store.read(job_id)
+            active = status is not None and status.get("status") in ("queued", "running")
+            if active and modified >= now - self.stale:
+                continue
+            self.store.remove(job_id)
+            removed += 1
+        if removed:
+            logger.info(f"Удалено устаревших задач: {removed}")
+        return removed
+
+    async def _cleanup_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await run_in_threadpool(self.cleanup)
+            except Exception as e:
+                logger.warning(f"Ошибка очистки каталога задач: {e}")
+
+    def start_cleanup(self, interval: float = JOBS_CLEANUP_INTERVAL_SECONDS):
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.get_running_loop().create_task(self._cleanup_loop(interval))
+
+    def stop_cleanup(self):
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            self._cleanup_task = None
+
+
+job_manager = JobManager()
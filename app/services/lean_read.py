@@ -0,0 +1,37 @@
+"""
+Облегченное чтение Calculated_data для списочных эндпоинтов
+Строки выбираются запросом Core (кортежи без объектов ORM, identity map и
+связей), словари ответа собираются без валидации схемой Pydantic и
+кодируются в JSON через orjson одним вызовом. Поля и их порядок совпадают со
+схемой CalculatedData, поэтому ответ не отличается от ответа через response_model.
+
+Бенчмарк стоимости строки до и после: benchmarks/bench_lean_reads.py
+"""
+from typing import Dict, Iterable, Optional, Sequence
+
+import orjson
+from fastapi.responses import Response
+from sqlalchemy import null
+
+from app.models.models import CalculatedData
+from app.schemas.schemas import CalculatedData as CalculatedDataSchema
+
+raw_table = CalculatedData.__table__
+
+# Поля ответа в порядке схемы; полей схемы без столбца в таблице (parametr_other) - всегда null
+DATA_FIELDS = tuple(CalculatedDataSchema.model_fields)
+DATA_SELECT_COLUMNS = [
+    raw_table.c[field] if field in raw_table.c else null().label(field)
+    for field in DATA_FIELDS
+]
+
+
+def encode_rows(rows: Iterable[Sequence], names: Sequence[str] = DATA_FIELDS) -> bytes:
+    """Строки (кортежи в порядке names) -> JSON-массив объектов"""
+    # Даты без часового пояса - как у Pydantic (ISO без смещения), UTC - с суффиксом Z
+    return orjson.dumps([dict(zip(names, row)) for row in rows], option=orjson.OPT_UTC_Z)
+
+
+def rows_response(rows: Iterable[Sequence], headers: Optional[Dict[str, str]] = None) -> Response:
+    """JSON-ответ со строками DATA_SELECT_COLUMNS (response_model эндпоинта не применяется)"""
+    return Response(encode_rows(rows), media_type="application/json", headers=headers)
@@ -0,0 +1,197 @@
+"""
+Рассылка новых расчетных данных и превышений порога подписчикам (WebSocket/SSE)
+Строки, записанные через CRUD, после commit публикуются во внутрипроцессный
+хаб; подписчик получает сообщения только по своим точкам. Сообщение
+сериализуется в JSON один раз и раздается всем подписчикам точки.
+
+У каждого подписчика своя очередь ограниченного размера: если клиент не
+успевает читать, старые сообщения вытесняются новыми, а клиент получает
+событие dropped с числом пропущенных и может догрузить их повтором с момента
+последнего полученного сообщения (since/after_id).
+
+Хаб работает в процессе приложения: при нескольких воркерах подписчик
+получает записи, прошедшие через свой воркер.
+"""
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+from sqlalchemy import or_, select
+
+from app.models.models import CalculatedData, ThresholdExcursion
+
+logger = logging.getLogger(__name__)
+
+# Сообщений в очереди одного подписчика
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", "1000"))
+LIVE_MAX_SUBSCRIBERS = int(os.getenv("LIVE_MAX_SUBSCRIBERS", "1000"))
+LIVE_MAX_POINTS = int(os.getenv("LIVE_MAX_POINTS", "500"))
+# Интервал пустых сообщений SSE, чтобы прокси не закрывали простаивающее соединение
+LIVE_HEARTBEAT_SECONDS = float(os.getenv("LIVE_HEARTBEAT_SECONDS", "15"))
+# Строк в повторе при переподключении
+LIVE_REPLAY_LIMIT = int(os.getenv("LIVE_REPLAY_LIMIT", "5000"))
+
+READING_FIELDS = ("id_data", "id_point", "data_and_time", "parametr_ttr", "parametr_q",
+                  "parametr_q_H2O", "parametr_q_H2O_porog")
+EXCURSION_FIELDS = ("id_excursion", "id_point", "started_at", "ended_at", "threshold",
+                    "peak_value", "peak_at", "sample_count")
+
+raw_table = CalculatedData.__table__
+excursion_table = ThresholdExcursion.__table__
+
+
+class LiveMessage(NamedTuple):
+    point_id: int
+    # reading, excursion
+    event: str
+    # id_data для показаний (id события SSE), для превышений None
+    event_id: Optional[int]
+    data: str
+
+
+class LiveHubFull(Exception):
+    """Превышено число подписчиков"""
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def reading_message(values) -> LiveMessage:
+    """Сообщение о строке Calculated_data (словарь или строка результата с полями READING_FIELDS)"""
+    data = {"type": "reading", **{field: values[field] for field in READING_FIELDS}}
+    return LiveMessage(data["id_point"], "reading", data["id_data"], json.dumps(data, default=_json_default))
+
+
+def excursion_message(values) -> LiveMessage:
+    data = {"type": "excursion", **{field: values[field] for field in EXCURSION_FIELDS}}
+    data["status"] = "open" if data["ended_at"] is None else "closed"
+    return LiveMessage(data["id_point"], "excursion", None, json.dumps(data, default=_json_default))
+
+
+class Subscriber:
+    def __init__(self, point_ids: Iterable[int], queue_size: int = LIVE_QUEUE_SIZE):
+        self.point_ids = frozenset(point_ids)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        # Вытеснено сообщений с момента последнего уведомления клиента
+        self.dropped = 0
+
+    def offer(self, message: LiveMessage) -> bool:
+        """Положить сообщение в очередь; при переполнении вытесняется самое старое (False)"""
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            self.queue.get_nowait()
+            self.queue.put_nowait(message)
+            self.dropped += 1
+            return False
+
+    async def next(self, timeout: Optional[float] = None) -> Optional[LiveMessage]:
+        """Следующее сообщение; None, если за timeout сообщений не было"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def take_dropped(self) -> int:
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class LiveHub:
+    """Подписчики по точкам; публикация вызывается из цикла событий после commit"""
+
+    def __init__(self, max_subscribers: int = LIVE_MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self.by_point: Dict[int, Set[Subscriber]] = defaultdict(set)
+        self.subscribers: Set[Subscriber] = set()
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def has_subscribers(self) -> bool:
+        return bool(self.subscribers)
+
+    def subscribe(self, point_ids: Iterable[int]) -> Subscriber:
+        if len(self.subscribers) >= self.max_subscribers:
+            raise LiveHubFull(f"Too many live subscribers ({self.max_subscribers}), try again later")
+        subscriber = Subscriber(point_ids)
+        self.subscribers.add(subscriber)
+        for point_id in subscriber.point_ids:
+            self.by_point[point_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self.subscribers.discard(subscriber)
+        for point_id in subscriber.point_ids:
+            subscribers = self.by_point.get(point_id)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.by_point[point_id]
+
+    def publish(self, messages: Iterable[LiveMessage]):
+        for message in messages:
+            self.published += 1
+            for subscriber in self.by_point.get(message.point_id, ()):
+                self.delivered += 1
+                if not subscriber.offer(message):
+                    self.dropped += 1
+
+    def publish_changes(self, readings: Iterable = (), excursions: Iterable[dict] = ()):
+        """
+        Опубликовать записанные строки (словари или RowMapping) и превышения;
+        сообщения строятся только для точек, на которые есть подписка
+        """
+        if not self.subscribers:
+            return
+        self.publish(reading_message(row) for row in readings if row["id_point"] in self.by_point)
+        self.publish(excursion_message(row) for row in excursions if row["id_point"] in self.by_point)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self.subscribers),
+            "points": len(self.by_point),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "queue_size": LIVE_QUEUE_SIZE,
+            "max_subscribers": self.max_subscribers,
+        }
+
+
+async def replay_messages(db, point_ids: List[int], since: Optional[datetime] = None,
+                          after_id: Optional[int] = None, limit: int = LIVE_REPLAY_LIMIT) -> List[LiveMessage]:
+    """
+    Сообщения, пропущенные клиентом: строки позже since или с id_data больше after_id
+    (Last-Event-ID SSE) в порядке записи, затем превышения, начатые или закрытые позже since
+    """
+    readings = select(*[raw_table.c[field] for field in READING_FIELDS]).where(raw_table.c.id_point.in_(point_ids))
+    if after_id is not None:
+        readings = readings.where(raw_table.c.id_data > after_id).order_by(raw_table.c.id_data)
+    else:
+        readings = readings.where(raw_table.c.data_and_time > since).order_by(raw_table.c.data_and_time, raw_table.c.id_data)
+    messages = [reading_message(row._mapping) for row in await db.execute(readings.limit(limit))]
+
+    if since is not None:
+        excursions = (
+            select(*[excursion_table.c[field] for field in EXCURSION_FIELDS])
+            .where(
+                excursion_table.c.id_point.in_(point_ids),
+                or_(excursion_table.c.started_at > since, excursion_table.c.ended_at > since),
+            )
+            .order_by(excursion_table.c.started_at)
+            .limit(limit)
+        )
+        messages += [excursion_message(row._mapping) for row in await db.execute(excursions)]
+    return messages
+
+
+live_hub = LiveHub()
@@ -0,0 +1,170 @@
+"""
+Метрики Prometheus: задержки HTTP по шаблону маршрута и статусу, запросы в работе,
+длительность SQL-запросов по событиям SQLAlchemy, вызовы калькулятора.
+Отдаются в текстовом формате на GET /metrics (app/api/system.py).
+"""
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event, text
+from starlette.routing import Match
+
+from app.utils.time_buckets import parse_datetime
+
+# Время запуска процесса для app_uptime_seconds
+STARTED_AT = time.time()
+
+# Маршрут для запросов, не совпавших ни с одним шаблоном (не плодим метки по произвольным URL)
+UNMATCHED_ROUTE = "unmatched"
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Длительность обработки HTTP-запроса",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    "http_requests_in_progress",
+    "HTTP-запросы в обработке",
+    ["method", "route"],
+)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds",
+    "Длительность выполнения SQL-запроса",
+    ["engine", "operation"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+DB_QUERY_ERRORS = Counter(
+    "db_query_errors_total",
+    "SQL-запросы, завершившиеся ошибкой",
+    ["engine", "operation"],
+)
+CALCULATOR_CALLS = Counter(
+    "calculator_calls_total",
+    "Вызовы калькулятора влажности",
+    ["calculation"],
+)
+CALCULATOR_ROWS = Counter(
+    "calculator_rows_total",
+    "Рассчитанные строки (объемы, компоненты смеси, строки пакета)",
+    ["calculation"],
+)
+TABLE_ROWS = Gauge(
+    "db_table_rows_estimate",
+    "Оценка числа строк в таблице (pg_class.reltuples)",
+    ["table"],
+)
+LAST_RECORD_TIMESTAMP = Gauge(
+    "calculated_data_last_record_timestamp_seconds",
+    "Метка времени последней записи Calculated_data",
+)
+UPTIME = Gauge("app_uptime_seconds", "Время работы процесса")
+UPTIME.set_function(lambda: time.time() - STARTED_AT)
+
+MONITORED_TABLES = ("Measuring_point", "Calculated_data")
+
+
+def resolve_route(scope) -> str:
+    """Шаблон пути маршрута (например /api/v1/measuring-points/{point_id}) для запроса"""
+    app = scope.get("app")
+    router = getattr(app, "router", None)
+    for route in getattr(router, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", UNMATCHED_ROUTE)
+    return UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: длительность и число запросов в работе по маршруту"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = resolve_route(scope)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        in_progress = HTTP_REQUESTS_IN_PROGRESS.labels(method, route)
+        in_progress.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Время до конца отправки тела, включая потоковые ответы
+            HTTP_REQUEST_DURATION.labels(method, route, str(status["code"])).observe(time.perf_counter() - started)
+            in_progress.dec()
+
+
+def _operation(statement: str) -> str:
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+
+def instrument_engine(sync_engine, name: str):
+    """Гистограмма длительности SQL по событиям before/after_cursor_execute"""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        DB_QUERY_DURATION.labels(name, _operation(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        conn = context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+        DB_QUERY_ERRORS.labels(name, _operation(context.statement or "")).inc()
+
+
+async def collect_database_metrics(db):
+    """
+    Обновить оценки размеров таблиц и время последней записи перед выдачей метрик
+    Без полного сканирования: reltuples из статистики PostgreSQL, максимум времени
+    по индексу (id_point, data_and_time) отдельно для каждой точки.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        # У секционированной таблицы (миграция 0003) статистика только у секций
+        rows = await db.execute(text("""
+            SELECT c.relname,
+                   CASE WHEN c.relkind = 'p' THEN (
+                       SELECT COALESCE(SUM(GREATEST(part.reltuples, 0)), 0)
+                       FROM pg_inherits i JOIN pg_class part ON part.oid = i.inhrelid
+                       WHERE i.inhparent = c.oid
+                   ) ELSE c.reltuples END
+            FROM pg_class c
+            WHERE c.relname = ANY(:tables) AND c.relkind IN ('r', 'p')
+        """), {"tables": list(MONITORED_TABLES)})
+        for table_name, estimate in rows:
+            # -1 - таблица еще не анализировалась
+            TABLE_ROWS.labels(table_name).set(max(estimate, 0))
+    else:
+        # Локальная разработка на SQLite: статистики нет, таблицы небольшие
+        for table_name in MONITORED_TABLES:
+            TABLE_ROWS.labels(table_name).set(await db.scalar(text(f'SELECT COUNT(*) FROM "{table_name}"')))
+
+    last_record = await db.scalar(text("""
+        SELECT MAX(last_record) FROM (
+            SELECT (
+                SELECT MAX(cd.data_and_time) FROM "Calculated_data" cd WHERE cd.id_point = mp.id_point
+            ) AS last_record
+            FROM "Measuring_point" mp
+        ) AS points
+    """))
+    if last_record is not None:
+        # SQLite возвращает результат text()-запроса строкой
+        LAST_RECORD_TIMESTAMP.set(parse_datetime(last_record).timestamp())
@@ -0,0 +1,183 @@
+"""
+Поиск точек измерений по названию с ранжированием по сходству
+PostgreSQL: триграммы pg_trgm по GIN-индексу (миграция 0005). Остальные БД
+(или NAME_SEARCH_BACKEND=memory): триграммный индекс в памяти процесса,
+сбрасывается при записи точек через CRUD, как и индекс иерархии.
+"""
+import os
+import re
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+from sqlalchemy import select, text
+
+from app.models.models import MeasuringPoint
+
+# auto - pg_trgm на PostgreSQL, индекс в памяти на остальных БД; memory - всегда в памяти
+NAME_SEARCH_BACKEND = os.getenv("NAME_SEARCH_BACKEND", "auto")
+NAME_SEARCH_CACHE_TTL_SECONDS = float(os.getenv("NAME_SEARCH_CACHE_TTL_SECONDS", "300"))
+# Минимальная доля триграмм запроса, найденных в названии (как pg_trgm.word_similarity_threshold)
+SIMILARITY_THRESHOLD = 0.6
+
+points_table = MeasuringPoint.__table__
+# Нормализация названия в SQL (то же, что normalize); по этому выражению построен индекс
+NORMALIZED_NAME_SQL = "replace(lower(name_point), 'ё', 'е')"
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize(value: str) -> str:
+    """Регистр и ё/е не различаются: "КС-17 (Вход Цех №2)" -> "кс-17 (вход цех №2)" """
+    return value.casefold().replace("ё", "е")
+
+
+def trigrams(value: str) -> Set[str]:
+    """Триграммы слов как в pg_trgm: слово дополняется двумя пробелами слева и одним справа"""
+    result = set()
+    for word in _WORD_RE.findall(value):
+        padded = f"  {word} "
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class NameSearchIndex:
+    """
+    Триграммный индекс в памяти. Числа общих триграмм для всех точек считаются
+    np.bincount по спискам точек триграмм запроса, вхождения подстроки ищутся
+    в одной строке со всеми названиями, ранжирование векторное.
+    """
+    # Разделитель названий в общей строке: запрос его не содержит, поэтому совпадение не пересекает границу
+    SEPARATOR = "\x00"
+
+    def __init__(self, rows):
+        self.points: List[dict] = []
+        names = []
+        postings: Dict[str, List[int]] = defaultdict(list)
+        for position, row in enumerate(rows):
+            values = dict(row._mapping)
+            name = normalize(values["name_point"] or "")
+            self.points.append(values)
+            names.append(name)
+            for trigram in trigrams(name):
+                postings[trigram].append(position)
+        self.ids = np.array([point["id_point"] for point in self.points], dtype=np.int64)
+        self.postings = {trigram: np.array(positions, dtype=np.int32) for trigram, positions in postings.items()}
+        # Все названия одной строкой в кодах символов (UTF-32) для векторного поиска подстроки
+        self.codes = np.frombuffer(self.SEPARATOR.join(names).encode("utf-32-le"), dtype=np.uint32)
+        lengths = np.array([len(name) + 1 for name in names], dtype=np.int64)
+        self.starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]) if names else np.zeros(0, dtype=np.int64)
+        self.built_at = time.monotonic()
+
+    def _substring_hits(self, query: str):
+        """Маски "название содержит запрос" и "название начинается с запроса" """
+        contains = np.zeros(len(self.points), dtype=bool)
+        prefix = np.zeros(len(self.points), dtype=bool)
+        codes = np.frombuffer(query.encode("utf-32-le"), dtype=np.uint32)
+        if len(codes) > len(self.codes):
+            return contains, prefix
+        # Позиции первого символа, затем отсев по следующим символам запроса
+        offsets = np.flatnonzero(self.codes[:max(len(self.codes) - len(codes) + 1, 0)] == codes[0])
+        for shift in range(1, len(codes)):
+            offsets = offsets[offsets + shift < len(self.codes)]
+            offsets = offsets[self.codes[offsets + shift] == codes[shift]]
+        if len(offsets):
+            positions = np.searchsorted(self.starts, offsets, side="right") - 1
+            contains[positions] = True
+            prefix[positions[self.starts[positions] == offsets]] = True
+        return contains, prefix
+
+    def search(self, query: str, skip: int = 0, limit: int = 50) -> List[dict]:
+        """
+        Точки, название которых содержит запрос или похоже на него (доля общих
+        триграмм не меньше SIMILARITY_THRESHOLD). Порядок: совпадение с начала
+        названия, вхождение подстроки, сходство, id_point.
+        """
+        query = normalize(query).replace(self.SEPARATOR, "").strip()
+        if not self.points:
+            return []
+        if not query:
+            order = np.argsort(self.ids, kind="stable")[skip:skip + limit]
+            return [self.points[i] for i in order]
+
+        query_trigrams = trigrams(query)
+        total = len(query_trigrams) or 1
+        found = [self.postings[trigram] for trigram in query_trigrams if trigram in self.postings]
+        if found:
+            shared = np.bincount(np.concatenate(found), minlength=len(self.points))
+        else:
+            shared = np.zeros(len(self.points), dtype=np.int64)
+        similarity = shared / total
+        contains, prefix = self._substring_hits(query)
+
+        matches = np.flatnonzero(contains | (similarity >= SIMILARITY_THRESHOLD))
+        if not len(matches):
+            return []
+        # Сходство < 1, поэтому признаки вхождения старше его при сравнении
+        score = prefix[matches] * 4.0 + contains[matches] * 2.0 + similarity[matches]
+        wanted = skip + limit
+        if len(matches) > wanted:
+            # Отбор лучших без полной сортировки; равные по score на границе берем все
+            threshold = np.partition(-score, wanted - 1)[wanted - 1]
+            keep = -score <= threshold
+            matches, score = matches[keep], score[keep]
+        order = np.lexsort((self.ids[matches], -score))[skip:wanted]
+        return [self.points[i] for i in matches[order]]
+
+
+class NameSearchCache:
+    def __init__(self, ttl: float = NAME_SEARCH_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self.index: Optional[NameSearchIndex] = None
+        self.generation = 0
+
+    async def get(self, db) -> NameSearchIndex:
+        index = self.index
+        if index is None or time.monotonic() - index.built_at > self.ttl:
+            generation = self.generation
+            index = NameSearchIndex(await db.execute(select(points_table)))
+            if generation == self.generation:
+                self.index = index
+        return index
+
+    def invalidate(self):
+        self.generation += 1
+        self.index = None
+
+
+name_search_cache = NameSearchCache()
+
+
+async def search_points(db, query: str, skip: int = 0, limit: int = 50) -> List[dict]:
+    """Поиск с ранжированием: pg_trgm на PostgreSQL, иначе индекс в памяти"""
+    if NAME_SEARCH_BACKEND == "memory" or db.get_bind().dialect.name != "postgresql":
+        index = await name_search_cache.get(db)
+        return index.search(query, skip, limit)
+
+    query = normalize(query).strip()
+    if not query:
+        rows = await db.execute(select(points_table).order_by(points_table.c.id_point).offset(skip).limit(limit))
+        return [dict(row._mapping) for row in rows]
+    # Выражение совпадает с выражением GIN-индекса ix_measuring_point_name_trgm,
+    # LIKE и <% (word similarity) выполняются по индексу
+    rows = await db.execute(text(f"""
+        SELECT * FROM "Measuring_point"
+        WHERE {NORMALIZED_NAME_SQL} LIKE :contains OR :query <% {NORMALIZED_NAME_SQL}
+        ORDER BY {NORMALIZED_NAME_SQL} LIKE :prefix DESC,
+                 {NORMALIZED_NAME_SQL} LIKE :contains DESC,
+                 word_similarity(:query, {NORMALIZED_NAME_SQL}) DESC,
+                 id_point
+        OFFSET :skip LIMIT :limit
+    """), {
+        "query": query,
+        "contains": f"%{escape_like(query)}%",
+        "prefix": f"{escape_like(query)}%",
+        "skip": skip,
+        "limit": limit,
+    })
+    return [dict(row._mapping) for row in rows]
@@ -0,0 +1,100 @@
+"""
+Помесячное секционирование Calculated_data (PostgreSQL, PARTITION BY RANGE)
+Секционирование включается миграцией 0003 (alembic -x partitioning=monthly upgrade head),
+секции на будущие месяцы создаются заранее этим модулем, например из cron:
+
+    python -m app.services.partitions --months-ahead 3
+"""
+import argparse
+import logging
+from datetime import date, datetime
+from typing import List
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = "Calculated_data"
+DEFAULT_PARTITION = f"{TABLE_NAME}_default"
+# Сколько месяцев вперед держать готовые секции
+MONTHS_AHEAD = 3
+
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{TABLE_NAME}_{month:%Y_%m}"
+
+
+def is_partitioned(connection) -> bool:
+    if connection.dialect.name != "postgresql":
+        return False
+    return bool(connection.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.relname = :table_name
+        )
+    """), {"table_name": TABLE_NAME}).scalar())
+
+
+def create_month_partition(connection, month: date) -> bool:
+    """Создать секцию за месяц; False если она уже существует"""
+    name = partition_name(month)
+    exists = connection.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": f'"{name}"'}).scalar()
+    if exists:
+        return False
+    # Границы секций в DDL нельзя передать параметрами; значения формируются здесь из date
+    connection.execute(text(
+        f'CREATE TABLE "{name}" PARTITION OF "{TABLE_NAME}" '
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    ))
+    logger.info(f"Создана секция {name}")
+    return True
+
+
+def create_default_partition(connection):
+    connection.execute(text(f'CREATE TABLE IF NOT EXISTS "{DEFAULT_PARTITION}" PARTITION OF "{TABLE_NAME}" DEFAULT'))
+
+
+def ensure_monthly_partitions(connection, first_month: date = None, months_ahead: int = MONTHS_AHEAD) -> List[str]:
+    """
+    Создать недостающие секции с first_month (по умолчанию текущий месяц)
+    до текущего месяца + months_ahead включительно
+    """
+    current = month_start(datetime.now())
+    month = month_start(first_month) if first_month else current
+    last = add_months(current, months_ahead)
+    created = []
+    while month <= last:
+        if create_month_partition(connection, month):
+            created.append(partition_name(month))
+        month = add_months(month, 1)
+    return created
+
+
+def main():
+    from app.database import engine
+
+    parser = argparse.ArgumentParser(description="Создание секций Calculated_data на будущие месяцы")
+    parser.add_argument("--months-ahead", type=int, default=MONTHS_AHEAD)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with engine.begin() as connection:
+        if not is_partitioned(connection):
+            logger.error(f'Таблица "{TABLE_NAME}" не секционирована: выполните alembic -x partitioning=monthly upgrade head')
+            raise SystemExit(1)
+        created = ensure_monthly_partitions(connection, months_ahead=args.months_ahead)
+    logger.info(f"Новых секций: {len(created)}")
+
+
+if __name__ == "__main__":
+    main()
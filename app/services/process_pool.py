@@ -0,0 +1,61 @@
+"""
+Общий пул процессов для тяжелых расчетов по NumPy (отчеты по всем точкам)
+Пул создается при первом обращении и живет до остановки приложения. Каждый
+процесс работает со своей БД-сессией; задачи получают на вход только параметры
+(списки точек, границы периода) и возвращают небольшие результаты.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+# 0 - по числу процессоров; 1 - без пула, задачи выполняются в потоке приложения
+PROCESS_POOL_WORKERS = int(os.getenv("PROCESS_POOL_WORKERS", "0")) or os.cpu_count() or 1
+# spawn безопасен для процесса с потоками (uvicorn, пул потоков starlette); fork быстрее стартует
+PROCESS_POOL_START_METHOD = os.getenv("PROCESS_POOL_START_METHOD", "spawn")
+
+_executor: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+
+
+def _init_worker():
+    """Соединения пула, унаследованные при fork, принадлежат родителю - забываем их без закрытия"""
+    from app.database import engine
+    engine.dispose(close=False)
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=PROCESS_POOL_WORKERS,
+                mp_context=multiprocessing.get_context(PROCESS_POOL_START_METHOD),
+                initializer=_init_worker,
+            )
+        return _executor
+
+
+async def run_in_process(func, *args):
+    """Выполнить func(*args) в пуле процессов (функция и аргументы должны сериализоваться pickle)"""
+    if PROCESS_POOL_WORKERS <= 1:
+        return await run_in_threadpool(func, *args)
+    try:
+        return await asyncio.wrap_future(get_process_pool().submit(func, *args))
+    except BrokenProcessPool:
+        # Процесс пула аварийно завершился (например, по OOM) - следующий вызов создаст новый пул
+        shutdown_process_pool()
+        raise
+
+
+def shutdown_process_pool():
+    global _executor
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
@@ -0,0 +1,493 @@
+"""
+Конструктор отчетов по Calculated_data (POST /reports/generate)
+Конфигурация отчета проверяется по белым спискам показателей и агрегатов
+и компилируется в один параметризованный запрос SQLAlchemy Core. Планы
+кэшируются по форме конфигурации (тип, интервал, показатели, какие фильтры
+заданы); значения фильтров передаются только параметрами запроса.
+
+    {
+        "type": "timeseries",
+        "date_range": {"start": "2024-01-01", "end": "2024-01-31"},
+        "point_ids": [1, 2, 3],
+        "metrics": ["parametr_ttr", "max:parametr_q", "count"],
+        "interval": "day"
+    }
+
+Показатель - столбец (parametr_ttr или короткое имя ttr), для агрегирующих
+отчетов с агрегатом через двоеточие (по умолчанию avg); count - число записей.
+
+Если период отчета захватывает месяцы холодного архива (app/services/archive.py),
+агрегаты считаются по частям: по таблице - тем же запросом с частичными
+агрегатами (avg -> sum и count), по архиву - аналогичным запросом DuckDB;
+части складываются по ключам группировки. Строки raw-отчета сливаются в общем порядке.
+"""
+import csv
+import heapq
+import io
+import itertools
+import json
+import os
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from pydantic import BaseModel, Field, field_validator, model_validator
+from sqlalchemy import DateTime, Integer, bindparam, func, select
+from starlette.concurrency import run_in_threadpool
+
+from app.database import SessionLocal
+from app.models.models import CalculatedData
+from app.services import archive
+from app.utils.time_buckets import GRANULARITIES, truncate_expression
+
+REPORT_PLAN_CACHE_SIZE = int(os.getenv("REPORT_PLAN_CACHE_SIZE", "256"))
+# Строк из курсора за одно чтение и строк ответа в одном блоке потока
+REPORT_CHUNK_SIZE = 5000
+
+# raw - записи без агрегации, summary - агрегаты за период, timeseries - агрегаты по интервалам
+REPORT_TYPES = ("raw", "summary", "timeseries")
+# Короткое имя показателя -> столбец Calculated_data
+METRIC_COLUMNS = {
+    "ttr": "parametr_ttr",
+    "q": "parametr_q",
+    "q_H2O": "parametr_q_H2O",
+    "q_H2O_porog": "parametr_q_H2O_porog",
+}
+AGGREGATES = {
+    "avg": func.avg,
+    "min": func.min,
+    "max": func.max,
+    "sum": func.sum,
+    "count": func.count,
+}
+DEFAULT_AGGREGATE = "avg"
+# Показатель "число записей"
+RECORD_COUNT = "count"
+# Средние по интервалам для трендов и /calculated-data/aggregated (avg_ttr, avg_q, record_count)
+PERIOD_AVERAGE_METRICS = ["avg:ttr", "avg:q", RECORD_COUNT]
+REPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+raw_table = CalculatedData.__table__
+_COLUMN_NAMES = {column: name for name, column in METRIC_COLUMNS.items()}
+
+
+def parse_metric(value: str) -> Tuple[Optional[str], str]:
+    """"max:parametr_q" -> ("max", "q"); "ttr" -> (None, "ttr"); "count" -> ("count", "count")"""
+    if value == RECORD_COUNT:
+        return RECORD_COUNT, RECORD_COUNT
+    aggregate, _, name = value.rpartition(":")
+    name = _COLUMN_NAMES.get(name, name)
+    if name not in METRIC_COLUMNS:
+        raise ValueError(f"Unsupported metric: {value}. Columns: {', '.join(METRIC_COLUMNS.values())}")
+    if aggregate and aggregate not in AGGREGATES:
+        raise ValueError(f"Unsupported aggregate: {aggregate}. Use one of: {', '.join(AGGREGATES)}")
+    return aggregate or None, name
+
+
+def parse_range_bound(value: str, end_of_range: bool = False) -> Tuple[datetime, bool]:
+    """
+    Граница периода и признак включения: дата без времени в конце периода
+    включает весь день (граница - начало следующих суток, не включается),
+    дата со временем включается
+    """
+    parsed = datetime.fromisoformat(value)
+    if end_of_range and len(value) == 10:
+        return parsed + timedelta(days=1), False
+    return parsed, True
+
+
+class DateRange(BaseModel):
+    start: Optional[str] = None
+    end: Optional[str] = None
+
+    @field_validator("start", "end")
+    @classmethod
+    def check_date(cls, value):
+        if value is not None:
+            parse_range_bound(value)
+        return value
+
+
+class ReportConfig(BaseModel):
+    type: str = "summary"
+    date_range: DateRange = DateRange()
+    point_ids: Optional[List[int]] = None
+    metrics: List[str] = Field(default_factory=lambda: ["parametr_ttr", "parametr_q"], min_length=1)
+    # Интервал для timeseries: hour, day, week, month
+    interval: str = "day"
+    # Отдельные строки по точкам (для summary/timeseries) или итог по всем выбранным точкам
+    group_by_point: bool = True
+    order: str = "asc"
+    limit: Optional[int] = Field(None, ge=1)
+    format: str = "ndjson"
+
+    @field_validator("type")
+    @classmethod
+    def check_type(cls, value):
+        if value not in REPORT_TYPES:
+            raise ValueError(f"Unsupported report type. Use one of: {', '.join(REPORT_TYPES)}")
+        return value
+
+    @field_validator("interval")
+    @classmethod
+    def check_interval(cls, value):
+        if value not in GRANULARITIES:
+            raise ValueError(f"Unsupported interval. Use one of: {', '.join(GRANULARITIES)}")
+        return value
+
+    @field_validator("order")
+    @classmethod
+    def check_order(cls, value):
+        if value not in ("asc", "desc"):
+            raise ValueError("order must be asc or desc")
+        return value
+
+    @field_validator("format")
+    @classmethod
+    def check_format(cls, value):
+        if value not in REPORT_FORMATS:
+            raise ValueError(f"Unsupported format. Use one of: {', '.join(REPORT_FORMATS)}")
+        return value
+
+    @field_validator("metrics")
+    @classmethod
+    def check_metrics(cls, value):
+        for metric in value:
+            parse_metric(metric)
+        return value
+
+    @model_validator(mode="after")
+    def check_raw_metrics(self):
+        if self.type == "raw" and any(parse_metric(metric)[0] for metric in self.metrics):
+            raise ValueError("raw report accepts columns only, without aggregates and count")
+        return self
+
+
+class ReportShape(NamedTuple):
+    """Все, что определяет текст запроса; значения фильтров сюда не входят"""
+    type: str
+    interval: Optional[str]
+    group_by_point: bool
+    metrics: Tuple[Tuple[Optional[str], str], ...]
+    has_start: bool
+    has_end: bool
+    end_inclusive: bool
+    has_points: bool
+    descending: bool
+    has_limit: bool
+    dialect_name: str
+    # Частичные агрегаты вместо итоговых (для сложения с архивом)
+    partial: bool = False
+
+
+class ReportPlan(NamedTuple):
+    statement: object
+    columns: Tuple[str, ...]
+    shape: ReportShape
+
+
+def report_shape(config: ReportConfig, dialect_name: str) -> ReportShape:
+    metrics = []
+    for metric in config.metrics:
+        aggregate, name = parse_metric(metric)
+        if config.type != "raw":
+            aggregate = aggregate or DEFAULT_AGGREGATE
+        if (aggregate, name) not in metrics:
+            metrics.append((aggregate, name))
+    end_inclusive = config.date_range.end is not None and parse_range_bound(config.date_range.end, end_of_range=True)[1]
+    return ReportShape(
+        type=config.type,
+        interval=config.interval if config.type == "timeseries" else None,
+        group_by_point=config.group_by_point,
+        metrics=tuple(metrics),
+        has_start=config.date_range.start is not None,
+        has_end=config.date_range.end is not None,
+        end_inclusive=end_inclusive,
+        has_points=config.point_ids is not None,
+        descending=config.order == "desc",
+        has_limit=config.limit is not None,
+        dialect_name=dialect_name,
+    )
+
+
+def partial_columns(shape: ReportShape) -> List[Tuple[str, str, Optional[str]]]:
+    """
+    Частичные агрегаты (столбец, агрегат, показатель), из которых складываются
+    показатели отчета по частям данных; avg - из sum и count, count - число записей
+    """
+    columns = {}
+    for aggregate, name in shape.metrics:
+        if name == RECORD_COUNT:
+            parts = [("record_count", RECORD_COUNT, None)]
+        elif aggregate == "avg":
+            parts = [(f"sum_{name}", "sum", name), (f"count_{name}", "count", name)]
+        else:
+            parts = [(f"{aggregate}_{name}", aggregate, name)]
+        for part in parts:
+            columns.setdefault(part[0], part)
+    return list(columns.values())
+
+
+def report_parameters(config: ReportConfig) -> Dict[str, object]:
+    parameters = {}
+    if config.date_range.start is not None:
+        parameters["start"] = parse_range_bound(config.date_range.start)[0]
+    if config.date_range.end is not None:
+        parameters["end"] = parse_range_bound(config.date_range.end, end_of_range=True)[0]
+    if config.point_ids is not None:
+        parameters["point_ids"] = config.point_ids
+    if config.limit is not None:
+        parameters["limit"] = config.limit
+    return parameters
+
+
+@lru_cache(maxsize=REPORT_PLAN_CACHE_SIZE)
+def compile_plan(shape: ReportShape) -> ReportPlan:
+    """Запрос для формы отчета; фильтры и limit - связанные параметры"""
+    time_column = raw_table.c.data_and_time
+    point_column = raw_table.c.id_point
+    conditions = []
+    if shape.has_start:
+        conditions.append(time_column >= bindparam("start", type_=DateTime))
+    if shape.has_end:
+        end = bindparam("end", type_=DateTime)
+        conditions.append(time_column <= end if shape.end_inclusive else time_column < end)
+    if shape.has_points:
+        conditions.append(point_column.in_(bindparam("point_ids", expanding=True)))
+
+    if shape.type == "raw":
+        keys = [point_column, time_column] if shape.group_by_point else [time_column]
+        columns = [raw_table.c.id_data, point_column, time_column] + [
+            raw_table.c[METRIC_COLUMNS[name]] for _, name in shape.metrics
+        ]
+        order = keys + [raw_table.c.id_data]
+        group = []
+    else:
+        keys = [point_column] if shape.group_by_point else []
+        if shape.type == "timeseries":
+            keys.append(truncate_expression(time_column, shape.interval, shape.dialect_name).label("period"))
+        columns = list(keys)
+        if shape.partial:
+            for label, aggregate, name in partial_columns(shape):
+                columns.append(func.count().label(label) if name is None
+                               else AGGREGATES[aggregate](raw_table.c[METRIC_COLUMNS[name]]).label(label))
+        else:
+            for aggregate, name in shape.metrics:
+                if name == RECORD_COUNT:
+                    columns.append(func.count().label("record_count"))
+                else:
+                    columns.append(AGGREGATES[aggregate](raw_table.c[METRIC_COLUMNS[name]]).label(f"{aggregate}_{name}"))
+        order = list(keys)
+        group = list(keys)
+
+    statement = select(*columns).where(*conditions)
+    if group:
+        statement = statement.group_by(*group)
+    if order:
+        statement = statement.order_by(*[key.desc() for key in order] if shape.descending else order)
+    if shape.has_limit:
+        statement = statement.limit(bindparam("limit", type_=Integer))
+    return ReportPlan(statement, tuple(column.key for column in statement.selected_columns), shape)
+
+
+def prepare_report(config: ReportConfig, dialect_name: str) -> Tuple[ReportPlan, Dict[str, object]]:
+    return compile_plan(report_shape(config, dialect_name)), report_parameters(config)
+
+
+def table_plan(plan: ReportPlan) -> ReportPlan:
+    """План части отчета по таблице при чтении архива"""
+    return compile_plan(plan.shape._replace(partial=plan.shape.type != "raw"))
+
+
+def _order_names(shape: ReportShape) -> List[str]:
+    if shape.type == "raw":
+        return (["id_point", "data_and_time"] if shape.group_by_point else ["data_and_time"]) + ["id_data"]
+    return (["id_point"] if shape.group_by_point else []) + (["period"] if shape.type == "timeseries" else [])
+
+
+def archive_query(shape: ReportShape, parameters: Dict[str, object]) -> Tuple[str, Dict[str, object]]:
+    """Запрос DuckDB к архиву в форме table_plan: те же столбцы, фильтры, порядок и limit"""
+    conditions = []
+    values = {}
+    if shape.has_start:
+        conditions.append("data_and_time >= $start")
+        values["start"] = parameters["start"]
+    if shape.has_end:
+        conditions.append("data_and_time <= $end" if shape.end_inclusive else "data_and_time < $end")
+        values["end"] = parameters["end"]
+    if shape.has_points:
+        conditions.append(f"id_point IN ({', '.join(str(int(point_id)) for point_id in parameters['point_ids']) or 'NULL'})")
+
+    keys = []
+    if shape.type == "raw":
+        columns = ["id_data", "id_point", "data_and_time"] + [f'"{METRIC_COLUMNS[name]}"' for _, name in shape.metrics]
+        order = _order_names(shape)
+    else:
+        if shape.group_by_point:
+            keys.append("id_point")
+        if shape.type == "timeseries":
+            keys.append(f"CAST(date_trunc('{shape.interval}', data_and_time) AS TIMESTAMP)")
+        columns = list(keys) + [
+            "count(*)" if name is None else f'{aggregate}("{METRIC_COLUMNS[name]}")'
+            for _, aggregate, name in partial_columns(shape)
+        ]
+        order = [str(position) for position in range(1, len(keys) + 1)]
+
+    sql = f"SELECT {', '.join(columns)} FROM {{source}}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    if keys:
+        sql += " GROUP BY " + ", ".join(str(position) for position in range(1, len(keys) + 1))
+    if order:
+        nulls = "LAST" if _nulls_largest(shape) != shape.descending else "FIRST"
+        direction = f" {'DESC' if shape.descending else 'ASC'} NULLS {nulls}"
+        sql += " ORDER BY " + ", ".join(name + direction for name in order)
+    if shape.has_limit:
+        sql += " LIMIT $limit"
+        values["limit"] = parameters["limit"]
+    return sql, values
+
+
+def _nulls_largest(shape: ReportShape) -> bool:
+    """NULL при сортировке больше любого значения (PostgreSQL) или меньше (SQLite)"""
+    return shape.dialect_name != "sqlite"
+
+
+def _sort_key(shape: ReportShape, positions: List[int]):
+    """Ключ сортировки строк частей в порядке ORDER BY таблицы, включая место NULL"""
+    nulls_largest = _nulls_largest(shape)
+    return lambda row: tuple(
+        ((row[i] is None) == nulls_largest, row[i] if row[i] is not None else 0) for i in positions
+    )
+
+
+def _combine(aggregate: str, current, value):
+    if value is None:
+        return current
+    if current is None:
+        return value
+    if aggregate == "min":
+        return min(current, value)
+    if aggregate == "max":
+        return max(current, value)
+    return current + value
+
+
+def merge_partials(shape: ReportShape, rows: Iterable[tuple], limit: Optional[int]) -> List[tuple]:
+    """Сложить частичные агрегаты частей (строки table_plan) и рассчитать показатели отчета"""
+    parts = partial_columns(shape)
+    key_count = len(_order_names(shape))
+    groups: Dict[tuple, list] = {}
+    for row in rows:
+        key = tuple(row[:key_count])
+        current = groups.get(key)
+        if current is None:
+            groups[key] = list(row[key_count:])
+            continue
+        for i, (_, aggregate, _) in enumerate(parts):
+            current[i] = _combine(aggregate, current[i], row[key_count + i])
+
+    index = {label: i for i, (label, _, _) in enumerate(parts)}
+    result = []
+    for key in sorted(groups, key=_sort_key(shape, list(range(key_count))), reverse=shape.descending):
+        values = groups[key]
+        row = list(key)
+        for aggregate, name in shape.metrics:
+            if name == RECORD_COUNT:
+                row.append(values[index["record_count"]])
+            elif aggregate == "avg":
+                total, count = values[index[f"sum_{name}"]], values[index[f"count_{name}"]]
+                row.append(total / count if count else None)
+            else:
+                row.append(values[index[f"{aggregate}_{name}"]])
+        result.append(tuple(row))
+    return result[:limit] if limit is not None else result
+
+
+def combine_archive(plan: ReportPlan, parameters: Dict[str, object], table_rows: Iterable[tuple],
+                    files: List[str]) -> Iterator[tuple]:
+    """Строки отчета по строкам table_plan из таблицы и запросу к файлам архива"""
+    sql, values = archive_query(plan.shape, parameters)
+    archive_rows = archive.iter_query(sql, values, files)
+    limit = parameters.get("limit")
+    if plan.shape.type == "raw":
+        positions = [plan.columns.index(name) for name in _order_names(plan.shape)]
+        rows = heapq.merge(table_rows, archive_rows, key=_sort_key(plan.shape, positions), reverse=plan.shape.descending)
+        return itertools.islice(rows, limit)
+    return iter(merge_partials(plan.shape, itertools.chain(table_rows, archive_rows), limit))
+
+
+def report_archive_files(parameters: Dict[str, object]) -> List[str]:
+    return archive.archive_files(parameters.get("start"), parameters.get("end"))
+
+
+async def fetch_report(db, config: ReportConfig) -> List[dict]:
+    """Выполнить отчет в асинхронной сессии и вернуть строки целиком (для небольших результатов)"""
+    plan, parameters = prepare_report(config, db.get_bind().dialect.name)
+    files = report_archive_files(parameters)
+    if not files:
+        return [dict(row._mapping) for row in await db.execute(plan.statement, parameters)]
+    table_rows = list(await db.execute(table_plan(plan).statement, parameters))
+    rows = await run_in_threadpool(lambda: list(combine_archive(plan, parameters, table_rows, files)))
+    return [dict(zip(plan.columns, row)) for row in rows]
+
+
+def plan_cache_stats() -> dict:
+    info = compile_plan.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "max_size": info.maxsize}
+
+
+def iter_report_rows(plan: ReportPlan, parameters: Dict[str, object]) -> Iterator[tuple]:
+    """Строки отчета через серверный курсор (с архивом, если период его захватывает)"""
+    files = report_archive_files(parameters)
+    statement = table_plan(plan).statement if files else plan.statement
+    db = SessionLocal()
+    try:
+        result = db.execute(statement, parameters, execution_options={"yield_per": REPORT_CHUNK_SIZE})
+        rows = itertools.chain.from_iterable(result.partitions())
+        yield from combine_archive(plan, parameters, rows, files) if files else rows
+    finally:
+        db.close()
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _chunks(lines: Iterator[str]) -> Iterator[bytes]:
+    block = []
+    for line in lines:
+        block.append(line)
+        if len(block) == REPORT_CHUNK_SIZE:
+            yield "".join(block).encode("utf-8")
+            block = []
+    if block:
+        yield "".join(block).encode("utf-8")
+
+
+def _csv_lines(columns: Tuple[str, ...], rows: Iterator[tuple]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in itertools.chain([columns], rows):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def encode_report_rows(format: str, columns: Tuple[str, ...], rows: Iterator[tuple]) -> Iterator[bytes]:
+    if format == "csv":
+        return _chunks(_csv_lines(columns, rows))
+    return _chunks(
+        json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_json_default) + "\n"
+        for row in rows
+    )
+
+
+def stream_report(format: str, plan: ReportPlan, parameters: Dict[str, object]) -> Iterator[bytes]:
+    return encode_report_rows(format, plan.columns, iter_report_rows(plan, parameters))
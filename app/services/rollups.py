@@ -0,0 +1,317 @@
+"""
+Агрегаты Calculated_data по точке и интервалу (таблица Calculated_data_rollup)
+Часовые агрегаты считаются из исходных строк, суточные - из часовых,
+месячные - из суточных. При записи через CRUD пересчитываются только
+затронутые интервалы, полный пересчет:
+
+    python -m app.services.rollups rebuild
+
+Часовые агрегаты учитывают и строки холодного архива (app/services/archive.py).
+"""
+import argparse
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, literal, select, text
+
+from app.models.models import CalculatedData, CalculatedDataRollup
+from app.services import archive
+from app.utils.time_buckets import bucket_end, is_aligned, parse_datetime, truncate_datetime, truncate_expression
+
+logger = logging.getLogger(__name__)
+
+# Чтение агрегатов эндпоинтами можно отключить; поддержка таблицы при записи работает всегда
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "true").lower() == "true"
+
+# От мелкого к крупному; каждый уровень строится из предыдущего
+ROLLUP_GRANULARITIES = ("hour", "day", "month")
+# Параметр агрегата -> столбец Calculated_data
+METRIC_COLUMNS = {
+    "ttr": "parametr_ttr",
+    "q": "parametr_q",
+    "q_H2O": "parametr_q_H2O",
+}
+
+# Первый ключ pg_advisory_xact_lock(int, int) для блокировок пересчета агрегатов точки
+ROLLUP_LOCK_NAMESPACE = 7001
+
+rollup_table = CalculatedDataRollup.__table__
+raw_table = CalculatedData.__table__
+
+
+def _rollup_columns() -> List[str]:
+    columns = ["granularity", "id_point", "bucket_start", "record_count"]
+    for metric in METRIC_COLUMNS:
+        columns += [f"count_{metric}", f"sum_{metric}", f"min_{metric}", f"max_{metric}"]
+    return columns
+
+
+def _source_select(granularity: str, dialect_name: str, point_ids, start, end):
+    """SELECT агрегатов уровня granularity из исходных строк или из более мелкого уровня"""
+    if granularity == "hour":
+        time_column = raw_table.c.data_and_time
+        point_column = raw_table.c.id_point
+        aggregates = [func.count()]
+        for column in METRIC_COLUMNS.values():
+            value = raw_table.c[column]
+            aggregates += [func.count(value), func.sum(value), func.min(value), func.max(value)]
+        conditions = [point_column.isnot(None), time_column.isnot(None)]
+    else:
+        finer = ROLLUP_GRANULARITIES[ROLLUP_GRANULARITIES.index(granularity) - 1]
+        source = rollup_table.alias("source")
+        time_column = source.c.bucket_start
+        point_column = source.c.id_point
+        aggregates = [func.sum(source.c.record_count)]
+        for metric in METRIC_COLUMNS:
+            aggregates += [
+                func.sum(source.c[f"count_{metric}"]),
+                func.sum(source.c[f"sum_{metric}"]),
+                func.min(source.c[f"min_{metric}"]),
+                func.max(source.c[f"max_{metric}"]),
+            ]
+        conditions = [source.c.granularity == finer]
+
+    if point_ids is not None:
+        conditions.append(point_column.in_(point_ids))
+    if start is not None:
+        conditions.append(time_column >= start)
+    if end is not None:
+        conditions.append(time_column < end)
+
+    bucket = truncate_expression(time_column, granularity, dialect_name)
+    return (
+        select(literal(granularity), point_column, bucket, *aggregates)
+        .where(*conditions)
+        .group_by(point_column, bucket)
+    )
+
+
+def merge_rollup_rows(rows: Iterable[tuple]) -> List[dict]:
+    """Сложить строки агрегатов (в порядке столбцов таблицы) с одинаковыми (уровень, точка, интервал)"""
+    columns = _rollup_columns()
+    merged: Dict[tuple, list] = {}
+    for row in rows:
+        key = tuple(row[:3])
+        current = merged.get(key)
+        if current is None:
+            merged[key] = list(row)
+            continue
+        for i in range(3, len(columns)):
+            value = row[i]
+            if value is None:
+                continue
+            if current[i] is None:
+                current[i] = value
+            elif columns[i].startswith("min_"):
+                current[i] = min(current[i], value)
+            elif columns[i].startswith("max_"):
+                current[i] = max(current[i], value)
+            else:
+                current[i] += value
+    return [dict(zip(columns, row)) for row in merged.values()]
+
+
+def lock_points(db, point_ids: Optional[Iterable[int]]):
+    """
+    PostgreSQL: заблокировать пересчет агрегатов точек до конца транзакции
+    Пересчет удаляет и заново вставляет строки интервалов: без блокировки две
+    транзакции по одной точке вставляют одинаковые ключи. None - все точки
+    (блокируется запись в таблицу агрегатов, чтение не блокируется).
+    Точки блокируются по возрастанию id, чтобы транзакции не ждали друг друга по кругу.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    if point_ids is None:
+        db.execute(text(f'LOCK TABLE "{rollup_table.name}" IN EXCLUSIVE MODE'))
+        return
+    for point_id in sorted(set(point_ids)):
+        db.execute(
+            text("SELECT pg_advisory_xact_lock(:namespace, :point_id)"),
+            {"namespace": ROLLUP_LOCK_NAMESPACE, "point_id": point_id},
+        )
+
+
+def rebuild_range(db, granularity: str, point_ids: Optional[List[int]] = None,
+                  start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """
+    Пересчитать агрегаты уровня granularity для точек и интервалов [start, end)
+    Часовые агрегаты месяцев из архива складываются из строк таблицы и архива.
+    Точки должны быть заблокированы lock_points (это делают refresh и rebuild_all).
+    """
+    conditions = [rollup_table.c.granularity == granularity]
+    if point_ids is not None:
+        conditions.append(rollup_table.c.id_point.in_(point_ids))
+    if start is not None:
+        conditions.append(rollup_table.c.bucket_start >= start)
+    if end is not None:
+        conditions.append(rollup_table.c.bucket_start < end)
+
+    dialect_name = db.get_bind().dialect.name
+    db.execute(delete(rollup_table).where(*conditions))
+    files = archive.archive_files(start, end) if granularity == "hour" else []
+    if files:
+        rows = list(db.execute(_source_select(granularity, dialect_name, point_ids, start, end)))
+        rows += archive.interval_rollups("hour", point_ids, start, end, METRIC_COLUMNS, files)
+        merged = merge_rollup_rows(rows)
+        if merged:
+            db.execute(insert(rollup_table), merged)
+        return
+    db.execute(insert(rollup_table).from_select(
+        _rollup_columns(),
+        _source_select(granularity, dialect_name, point_ids, start, end)
+    ))
+
+
+def refresh(db, keys: Iterable[Tuple[Optional[int], Optional[datetime]]]):
+    """
+    Обновить агрегаты после записи строк с ключами (id_point, data_and_time)
+    Вызывается в той же транзакции до commit, изменения строк уже должны быть в flush
+    """
+    times_by_point: Dict[int, List[datetime]] = defaultdict(list)
+    for point_id, data_and_time in keys:
+        if point_id is not None and data_and_time is not None:
+            times_by_point[point_id].append(parse_datetime(data_and_time))
+    if not times_by_point:
+        return
+    lock_points(db, times_by_point)
+
+    # Точки с одинаковым окном времени (обычно одна и та же метка часа) обновляются одним запросом
+    points_by_window: Dict[Tuple[datetime, datetime], List[int]] = defaultdict(list)
+    for point_id, times in times_by_point.items():
+        points_by_window[(min(times), max(times))].append(point_id)
+
+    for (first, last), point_ids in points_by_window.items():
+        for granularity in ROLLUP_GRANULARITIES:
+            start = truncate_datetime(first, granularity)
+            end = bucket_end(truncate_datetime(last, granularity), granularity)
+            rebuild_range(db, granularity, point_ids, start, end)
+
+
+def rebuild_all(db, point_ids: Optional[List[int]] = None):
+    """Полный пересчет агрегатов (после миграции, массовых правок в обход CRUD)"""
+    lock_points(db, point_ids)
+    for granularity in ROLLUP_GRANULARITIES:
+        rebuild_range(db, granularity, point_ids)
+
+
+def choose_granularity(target: str, start: Optional[datetime], end: Optional[datetime]) -> Optional[str]:
+    """
+    Самый крупный уровень агрегатов, которым можно ответить на запрос с интервалом target
+    и границами start/end (границы должны совпадать с началом интервалов уровня)
+    """
+    # Неделя не складывается из месяцев, поэтому для нее самый крупный уровень - сутки
+    finest_fit = "day" if target == "week" else target
+    candidates = ROLLUP_GRANULARITIES[:ROLLUP_GRANULARITIES.index(finest_fit) + 1]
+    for granularity in reversed(candidates):
+        if all(value is None or is_aligned(value, granularity) for value in (start, end)):
+            return granularity
+    return None
+
+
+def aggregate_periods(db, period: str, point_id: Optional[int] = None,
+                      start: Optional[datetime] = None, end: Optional[datetime] = None,
+                      newest_first: bool = False, limit: Optional[int] = None) -> Optional[List[dict]]:
+    """
+    Средние ttr/q и число записей по интервалам period (hour/day/week/month) из агрегатов
+    Интервал отбора [start, end]: строки ровно в момент end берутся из исходной таблицы,
+    как в запросе с data_and_time <= end. None - агрегаты не подходят для запроса.
+    """
+    if not ROLLUPS_ENABLED:
+        return None
+    granularity = choose_granularity(period, start, end)
+    if granularity is None:
+        return None
+
+    dialect_name = db.get_bind().dialect.name
+    bucket = truncate_expression(rollup_table.c.bucket_start, period, dialect_name) \
+        if period != granularity else rollup_table.c.bucket_start
+    conditions = [rollup_table.c.granularity == granularity]
+    if point_id is not None:
+        conditions.append(rollup_table.c.id_point == point_id)
+    if start is not None:
+        conditions.append(rollup_table.c.bucket_start >= start)
+    if end is not None:
+        conditions.append(rollup_table.c.bucket_start < end)
+
+    stmt = (
+        select(
+            bucket.label("period"),
+            func.sum(rollup_table.c.record_count),
+            func.sum(rollup_table.c.count_ttr),
+            func.sum(rollup_table.c.sum_ttr),
+            func.sum(rollup_table.c.count_q),
+            func.sum(rollup_table.c.sum_q),
+        )
+        .where(*conditions)
+        .group_by(bucket)
+        .order_by(bucket.desc() if newest_first else bucket)
+    )
+    if limit is not None:
+        stmt = stmt.limit(limit)
+
+    totals = {row[0]: list(row[1:]) for row in db.execute(stmt)}
+
+    if end is not None:
+        # Строки с меткой ровно end не входят в интервалы [start, end)
+        edge = select(
+            func.count(),
+            func.count(raw_table.c.parametr_ttr), func.sum(raw_table.c.parametr_ttr),
+            func.count(raw_table.c.parametr_q), func.sum(raw_table.c.parametr_q),
+        ).where(raw_table.c.data_and_time == end)
+        if point_id is not None:
+            edge = edge.where(raw_table.c.id_point == point_id)
+        edge_row = list(db.execute(edge).first())
+        files = archive.archive_files(end, end)
+        if files:
+            edge_sql = "SELECT count(*), count(parametr_ttr), sum(parametr_ttr), count(parametr_q), sum(parametr_q) " \
+                       "FROM {source} WHERE data_and_time = $end"
+            if point_id is not None:
+                edge_sql += f" AND id_point = {int(point_id)}"
+            for i, value in enumerate(archive.query(edge_sql, {"end": end}, files)[0]):
+                if value is not None:
+                    edge_row[i] = value if edge_row[i] is None else edge_row[i] + value
+        if edge_row[0]:
+            key = truncate_datetime(end, period)
+            current = totals.setdefault(key, [0, 0, None, 0, None])
+            for i, value in enumerate(edge_row):
+                if value is not None:
+                    current[i] = value if current[i] is None else current[i] + value
+
+    periods = sorted(totals, reverse=newest_first)
+    if limit is not None:
+        periods = periods[:limit]
+    result = []
+    for key in periods:
+        record_count, count_ttr, sum_ttr, count_q, sum_q = totals[key]
+        result.append({
+            "period": key,
+            "avg_ttr": sum_ttr / count_ttr if count_ttr else None,
+            "avg_q": sum_q / count_q if count_q else None,
+            "record_count": record_count,
+        })
+    return result
+
+
+def main():
+    from app.database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Агрегаты Calculated_data_rollup")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--point", type=int, action="append", help="пересчитать только указанные точки")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    db = SessionLocal()
+    try:
+        rebuild_all(db, args.point)
+        db.commit()
+    finally:
+        db.close()
+    logger.info("Агрегаты пересчитаны")
+
+
+if __name__ == "__main__":
+    main()
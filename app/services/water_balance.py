@@ -0,0 +1,243 @@
+"""
+Баланс воды по группам точек "вход/выход" (отчет input-output-summary)
+Данные за период передискретизируются к интервалу (час/сутки) одним
+сгруппированным запросом по (id_point, интервал): из часовых/суточных агрегатов
+Calculated_data_rollup, если границы периода с ними совпадают, иначе из исходных
+строк таблицы и холодного архива (суммы по архиву считает DuckDB, суммы одного
+интервала складываются). Влагосодержание и масса воды по ТТР и объему каждого интервала
+считаются векторно через HumidityCalculator (п. 6.2.2 ТЗ).
+
+Единицы: parametr_q - тыс. м³ за запись, parametr_q_H2O - т, ТТР - °C,
+влагосодержание - г/м³, масса воды в отчете - т.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import func, select
+
+from app.models.models import CalculatedData, CalculatedDataRollup
+from app.services import archive
+from app.services.humidity_calculations import HumidityCalculator
+from app.services.rollups import METRIC_COLUMNS, ROLLUPS_ENABLED, choose_granularity, merge_rollup_rows
+from app.utils.time_buckets import EPOCH, epoch_expression, from_epoch, truncate_expression
+from app.utils.units_converter import UnitsConverter
+
+# data_interval отчета -> интервал агрегации
+DATA_INTERVALS = {
+    "hourly": "hour",
+    "daily": "day",
+}
+
+raw_table = CalculatedData.__table__
+rollup_table = CalculatedDataRollup.__table__
+
+# Столбцы результата запроса (порядок совпадает с select в interval_statement)
+_POINT, _PERIOD, _COUNT_TTR, _SUM_TTR, _SUM_Q, _COUNT_H2O, _SUM_H2O, _RECORDS = range(8)
+
+
+def rollup_source(granularity: str, start: datetime, end: datetime) -> Optional[str]:
+    """Уровень агрегатов, из которого считается отчет; None - исходные строки"""
+    return choose_granularity(granularity, start, end) if ROLLUPS_ENABLED else None
+
+
+def interval_statement(point_ids: List[int], start: datetime, end: datetime, granularity: str, dialect_name: str):
+    """
+    Суммы по точке и интервалу за [start, end): число и сумма ТТР, сумма объема,
+    число и сумма расхода воды, число записей. Интервал - секунды от 1970-01-01.
+    """
+    source_granularity = rollup_source(granularity, start, end)
+    if source_granularity is not None:
+        time_column = rollup_table.c.bucket_start
+        point_column = rollup_table.c.id_point
+        aggregates = [
+            func.sum(rollup_table.c.count_ttr),
+            func.sum(rollup_table.c.sum_ttr),
+            func.sum(rollup_table.c.sum_q),
+            func.sum(rollup_table.c.count_q_H2O),
+            func.sum(rollup_table.c.sum_q_H2O),
+            func.sum(rollup_table.c.record_count),
+        ]
+        conditions = [rollup_table.c.granularity == source_granularity]
+    else:
+        time_column = raw_table.c.data_and_time
+        point_column = raw_table.c.id_point
+        aggregates = [
+            func.count(raw_table.c.parametr_ttr),
+            func.sum(raw_table.c.parametr_ttr),
+            func.sum(raw_table.c.parametr_q),
+            func.count(raw_table.c.parametr_q_H2O),
+            func.sum(raw_table.c.parametr_q_H2O),
+            func.count(),
+        ]
+        conditions = []
+
+    if source_granularity == granularity:
+        bucket = time_column
+    else:
+        bucket = truncate_expression(time_column, granularity, dialect_name)
+    conditions += [point_column.in_(point_ids), time_column >= start, time_column < end]
+    return (
+        select(point_column, epoch_expression(bucket, dialect_name), *aggregates)
+        .where(*conditions)
+        .group_by(point_column, bucket)
+    )
+
+
+def archive_intervals(point_ids: List[int], start: datetime, end: datetime, granularity: str,
+                      files: List[str]) -> List[tuple]:
+    """Суммы по точке и интервалу из файлов архива в форме строк interval_statement"""
+    rows = archive.interval_rollups(granularity, point_ids, start, end, METRIC_COLUMNS, files)
+    return [
+        (row["id_point"], (row["bucket_start"] - EPOCH).total_seconds(), row["count_ttr"], row["sum_ttr"],
+         row["sum_q"], row["count_q_H2O"], row["sum_q_H2O"], row["record_count"])
+        for row in merge_rollup_rows(rows)
+    ]
+
+
+def merge_intervals(rows) -> List[tuple]:
+    """Сложить суммы строк одной точки и интервала (части из таблицы и архива)"""
+    merged: Dict[tuple, list] = {}
+    for row in rows:
+        # Секунды из julianday() в SQLite отличаются от точных в микросекундах
+        period = round(float(row[_PERIOD]), 3)
+        current = merged.get((row[_POINT], period))
+        if current is None:
+            current = merged[(row[_POINT], period)] = list(row)
+            current[_PERIOD] = period
+            continue
+        for i in range(_COUNT_TTR, _RECORDS + 1):
+            if row[i] is not None:
+                current[i] = row[i] if current[i] is None else current[i] + row[i]
+    return [tuple(row) for row in merged.values()]
+
+
+def _value(value, digits: int):
+    return None if value is None or np.isnan(value) else round(float(value), digits)
+
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(denominator > 0, numerator / np.where(denominator > 0, denominator, 1), np.nan)
+
+
+def compute_balance(rows, input_point_ids: List[int], output_point_ids: List[int]) -> dict:
+    """Показатели точек, групп и интервалов по строкам interval_statement"""
+    # Row не кортеж: без преобразования NumPy разбирает каждую строку как последовательность по ключам
+    data = np.array([tuple(row) for row in rows], dtype=float).reshape(-1, 8)
+    point_ids = np.unique(np.array(input_point_ids + output_point_ids, dtype=np.int64))
+    point_index = np.searchsorted(point_ids, data[:, _POINT].astype(np.int64))
+    points = len(point_ids)
+
+    # Интервалы: средняя ТТР, объем в м³, влагосодержание и масса воды по формуле
+    count_ttr = np.nan_to_num(data[:, _COUNT_TTR])
+    dew_point = _ratio(np.nan_to_num(data[:, _SUM_TTR]), count_ttr)
+    volume = np.nan_to_num(data[:, _SUM_Q])
+    volume_m3 = UnitsConverter.convert_volume_array(np.maximum(volume, 0), "thousand_cubic_meters", "cubic_meter")
+    water_content = np.full(len(data), np.nan)
+    water_grams = np.zeros(len(data))
+    measured = ~np.isnan(dew_point)
+    water_content[measured] = HumidityCalculator.calculate_humidity_content_array(dew_point[measured])
+    with_volume = measured & (volume_m3 > 0)
+    water_grams[with_volume] = HumidityCalculator.calculate_water_mass_array(
+        water_content[with_volume], volume_m3[with_volume]
+    )
+    water = UnitsConverter.convert_mass_array(water_grams, "gram", "ton")
+    reported_water = np.nan_to_num(data[:, _SUM_H2O])
+    has_reported = np.nan_to_num(data[:, _COUNT_H2O]) > 0
+
+    def per_point(weights) -> np.ndarray:
+        return np.bincount(point_index, weights=weights, minlength=points)
+
+    intervals = per_point(None)
+    point_measured = per_point(measured)
+    point_dew_point = _ratio(per_point(np.where(measured, dew_point, 0)), point_measured)
+    point_volume = per_point(volume)
+    point_volume_m3 = per_point(np.where(with_volume, volume_m3, 0))
+    point_water = per_point(water)
+    point_water_grams = per_point(water_grams)
+    point_reported = per_point(reported_water)
+    point_has_reported = per_point(has_reported) > 0
+
+    def point_rows(ids: List[int]) -> List[dict]:
+        result = []
+        for point_id in ids:
+            i = np.searchsorted(point_ids, point_id)
+            result.append({
+                "point_id": point_id,
+                "intervals_count": int(intervals[i]),
+                "avg_dew_point": _value(point_dew_point[i], 2),
+                "avg_volume": _value(point_volume[i] / intervals[i] if intervals[i] else np.nan, 3),
+                "total_volume": _value(point_volume[i], 3),
+                "avg_water_content": _value(_ratio(point_water_grams[i], point_volume_m3[i]), 6),
+                "total_water": _value(point_water[i], 6),
+                "reported_water": _value(point_reported[i], 6) if point_has_reported[i] else None,
+            })
+        return result
+
+    def group_totals(ids: List[int]) -> dict:
+        member = np.isin(point_ids[point_index], ids)
+        grams = water_grams[member].sum()
+        volume_total_m3 = volume_m3[member & with_volume].sum()
+        content = grams / volume_total_m3 if volume_total_m3 > 0 else np.nan
+        return {
+            "water": float(water[member].sum()),
+            "volume": float(volume[member].sum()),
+            "dew_point": np.nanmean(dew_point[member & measured]) if np.any(member & measured) else np.nan,
+            "water_content": content,
+            # ТТР смеси газа группы по суммарному влагосодержанию
+            "mixture_dew_point": float(HumidityCalculator.calculate_mixture_dew_point_array(content, method="exact"))
+            if not np.isnan(content) else np.nan,
+            "member": member,
+        }
+
+    inputs = group_totals(input_point_ids)
+    outputs = group_totals(output_point_ids)
+
+    periods, period_index = np.unique(data[:, _PERIOD], return_inverse=True)
+    period_input = np.bincount(period_index, weights=np.where(inputs["member"], water, 0), minlength=len(periods))
+    period_output = np.bincount(period_index, weights=np.where(outputs["member"], water, 0), minlength=len(periods))
+
+    return {
+        "summary": {
+            "input_points_count": len(input_point_ids),
+            "output_points_count": len(output_point_ids),
+            "input_total_water": _value(inputs["water"], 6),
+            "output_total_water": _value(outputs["water"], 6),
+            "water_difference": _value(outputs["water"] - inputs["water"], 6),
+            "input_total_volume": _value(inputs["volume"], 3),
+            "output_total_volume": _value(outputs["volume"], 3),
+            "avg_input_dew_point": _value(inputs["dew_point"], 2),
+            "avg_output_dew_point": _value(outputs["dew_point"], 2),
+            "dew_point_difference": _value(outputs["dew_point"] - inputs["dew_point"], 2),
+            "input_water_content": _value(inputs["water_content"], 6),
+            "output_water_content": _value(outputs["water_content"], 6),
+            "input_mixture_dew_point": _value(inputs["mixture_dew_point"], 2),
+            "output_mixture_dew_point": _value(outputs["mixture_dew_point"], 2),
+        },
+        "input_points": point_rows(input_point_ids),
+        "output_points": point_rows(output_point_ids),
+        "intervals": [
+            {
+                "period": from_epoch(period),
+                "input_water": round(float(input_water), 6),
+                "output_water": round(float(output_water), 6),
+                "water_difference": round(float(output_water - input_water), 6),
+            }
+            for period, input_water, output_water in zip(periods.tolist(), period_input.tolist(), period_output.tolist())
+        ],
+    }
+
+
+def balance_report(db, input_point_ids: List[int], output_point_ids: List[int],
+                   start: datetime, end: datetime, granularity: str) -> dict:
+    """Отчет по синхронной сессии (вызывается через AsyncSession.run_sync)"""
+    point_ids = sorted(set(input_point_ids) | set(output_point_ids))
+    if not point_ids:
+        return compute_balance([], input_point_ids, output_point_ids)
+    rows = db.execute(interval_statement(point_ids, start, end, granularity, db.get_bind().dialect.name)).all()
+    # Агрегаты учитывают архивные строки, исходные строки архивных месяцев - только в файлах архива
+    files = archive.archive_files(start, end) if rollup_source(granularity, start, end) is None else []
+    if files:
+        rows = merge_intervals(list(rows) + archive_intervals(point_ids, start, end, granularity, files))
+    return compute_balance(rows, input_point_ids, output_point_ids)
@@ -0,0 +1,215 @@
+"""
+Поиск мест попадания воды: ступенчатый рост ТТР и расхода воды по точкам
+Ряды читаются серверным курсором в порядке (id_point, data_and_time) и
+обрабатываются за один проход: ряд точки собирается из блоков курсора и
+проверяется, как только начинается следующая точка. Ступенька ищется
+сравнением средних в скользящих окнах до и после каждого отсчета
+(суммы нарастающим итогом NumPy). Группы точек считаются в пуле процессов.
+Строки холодного архива за период объединяются со строками таблицы в том же порядке.
+"""
+import heapq
+import itertools
+import os
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+
+from app.database import SessionLocal
+from app.models.models import CalculatedData
+from app.services import archive
+from app.utils.time_buckets import epoch_expression, from_epoch
+
+# Отсчетов в окне до и после ступеньки
+WATER_INTRUSION_WINDOW = int(os.getenv("WATER_INTRUSION_WINDOW", "12"))
+# Минимальная значимость: рост среднего в единицах шума разности средних окон
+WATER_INTRUSION_MIN_SEVERITY = float(os.getenv("WATER_INTRUSION_MIN_SEVERITY", "6"))
+# Строк за одно чтение из курсора
+WATER_INTRUSION_CHUNK_SIZE = 20000
+# Относительная погрешность float: меньший разброс разностей считается нулевым
+NOISE_TOLERANCE = 1e-9
+
+# Параметр отчета -> столбец Calculated_data и минимальный рост среднего
+# (ТТР в °C, расход воды в единицах parametr_q_H2O)
+PARAMETERS = {
+    "ttr": ("parametr_ttr", 1.0),
+    "q_H2O": ("parametr_q_H2O", 0.01),
+}
+PARAMETER_NAMES = {
+    "ttr": "ТТР",
+    "q_H2O": "расход воды",
+}
+
+raw_table = CalculatedData.__table__
+
+
+def noise_scale(values: np.ndarray) -> float:
+    """
+    Оценка шума ряда по первым разностям (медианное абсолютное отклонение):
+    одиночные ступеньки и выбросы на нее почти не влияют. Если больше половины
+    разностей одинаковые (квантованный ряд), MAD равно нулю и шум оценивается по СКО
+    разностей. Ноль - если и СКО на уровне погрешности float (постоянный ряд,
+    равномерный рост с шагом квантования).
+    """
+    if len(values) < 3:
+        return 0.0
+    diffs = np.diff(values)
+    # Разности квантованного ряда (шаг 0.1) несут погрешность float порядка 1e-15 вместо нуля
+    tolerance = NOISE_TOLERANCE * max(1.0, float(np.abs(values).max()))
+    mad = np.median(np.abs(diffs - np.median(diffs)))
+    if mad > tolerance:
+        # 1.4826 * MAD - СКО для нормального шума; разность двух отсчетов имеет СКО в sqrt(2) раз больше
+        return 1.4826 * mad / np.sqrt(2)
+    std = float(np.std(diffs))
+    return std / np.sqrt(2) if std > tolerance else 0.0
+
+
+def detect_steps(values: np.ndarray, window: int = WATER_INTRUSION_WINDOW,
+                 min_severity: float = WATER_INTRUSION_MIN_SEVERITY,
+                 min_change: float = 0.0) -> List[Tuple[int, float, float, float]]:
+    """
+    Ступеньки роста ряда: (индекс первого отсчета после ступеньки, среднее до,
+    среднее после, значимость). Из соседних (ближе окна) срабатываний
+    остается одно с наибольшей значимостью.
+    """
+    n = len(values)
+    if n < 2 * window:
+        return []
+    sums = np.concatenate(([0.0], np.cumsum(values)))
+    # Для отсчета i: окно до [i - window, i), окно после [i, i + window)
+    positions = np.arange(window, n - window + 1)
+    before = (sums[positions] - sums[positions - window]) / window
+    after = (sums[positions + window] - sums[positions]) / window
+    change = after - before
+
+    scale = noise_scale(values) * np.sqrt(2.0 / window)
+    if scale == 0:
+        # Шум не оценить (постоянный ряд) - ступенек нет
+        return []
+    severity = change / scale
+
+    candidates = np.flatnonzero((severity >= min_severity) & (change >= min_change))
+    if not len(candidates):
+        return []
+    # Группы срабатываний, разделенные промежутком больше окна, - отдельные события
+    groups = np.split(candidates, np.flatnonzero(np.diff(candidates) > window) + 1)
+    events = []
+    for group in groups:
+        best = group[np.argmax(severity[group])]
+        events.append((int(positions[best]), float(before[best]), float(after[best]), float(severity[best])))
+    return events
+
+
+def detect_point_events(point_id: int, times: np.ndarray, columns: Dict[str, np.ndarray],
+                        window: int, min_severity: float) -> List[dict]:
+    events = []
+    for parameter, (_, min_change) in PARAMETERS.items():
+        values = columns[parameter]
+        present = ~np.isnan(values)
+        series_times, series = times[present], values[present]
+        for index, before, after, severity in detect_steps(series, window, min_severity, min_change):
+            events.append({
+                "point_id": point_id,
+                "parameter": parameter,
+                "event_date": from_epoch(float(series_times[index])),
+                "value_before": before,
+                "value_after": after,
+                "change": after - before,
+                "severity": severity,
+            })
+    return events
+
+
+def iter_point_series(point_ids: List[int], start: Optional[datetime], end: Optional[datetime],
+                      chunk_size: int = WATER_INTRUSION_CHUNK_SIZE) -> Iterator[Tuple[int, np.ndarray, Dict[str, np.ndarray]]]:
+    """
+    Ряды точек (id_point, время в секундах, {параметр: значения}) по одному за раз
+    В памяти находится один блок курсора и ряд текущей точки.
+    """
+    db = SessionLocal()
+    columns = [raw_table.c[column] for column, _ in PARAMETERS.values()]
+    # Время секундами: массив собирается из чисел, без разбора datetime по строкам
+    seconds = epoch_expression(raw_table.c.data_and_time, db.get_bind().dialect.name)
+    stmt = select(raw_table.c.id_point, seconds, *columns).where(
+        raw_table.c.id_point.in_(point_ids),
+        raw_table.c.data_and_time.isnot(None),
+    )
+    if start is not None:
+        stmt = stmt.where(raw_table.c.data_and_time >= start)
+    if end is not None:
+        stmt = stmt.where(raw_table.c.data_and_time < end)
+    stmt = stmt.order_by(raw_table.c.id_point, raw_table.c.data_and_time)
+
+    current_id = None
+    parts: List[tuple] = []
+
+    def flush():
+        times = np.concatenate([part[0] for part in parts])
+        values = {
+            parameter: np.concatenate([part[1][parameter] for part in parts])
+            for parameter in PARAMETERS
+        }
+        return current_id, times, values
+
+    try:
+        result = db.execute(stmt, execution_options={"yield_per": chunk_size})
+        chunks = result.partitions()
+        files = archive.archive_files(start, end)
+        if files:
+            archive_rows = archive.iter_rows(
+                ["id_point", "epoch(data_and_time)", *[column for column, _ in PARAMETERS.values()]],
+                ["id_point", "data_and_time"], files, point_ids, start, end,
+            )
+            rows = heapq.merge(itertools.chain.from_iterable(chunks), archive_rows, key=lambda row: (row[0], row[1]))
+            chunks = iter(lambda: list(itertools.islice(rows, chunk_size)), [])
+        for chunk in chunks:
+            fields = list(zip(*chunk))
+            ids = np.array(fields[0], dtype=np.int64)
+            times = np.array(fields[1], dtype=float)
+            # None -> NaN
+            values = {parameter: np.array(fields[2 + i], dtype=float) for i, parameter in enumerate(PARAMETERS)}
+            # Границы точек внутри блока
+            bounds = np.concatenate(([0], np.flatnonzero(np.diff(ids)) + 1, [len(ids)]))
+            for left, right in zip(bounds[:-1], bounds[1:]):
+                point_id = int(ids[left])
+                if point_id != current_id and parts:
+                    yield flush()
+                    parts = []
+                current_id = point_id
+                parts.append((times[left:right], {p: v[left:right] for p, v in values.items()}))
+        if parts:
+            yield flush()
+    finally:
+        db.close()
+
+
+def scan_points(point_ids: List[int], start: Optional[datetime], end: Optional[datetime],
+                window: int = WATER_INTRUSION_WINDOW,
+                min_severity: float = WATER_INTRUSION_MIN_SEVERITY) -> List[dict]:
+    """События группы точек (задача пула процессов)"""
+    events = []
+    for point_id, times, values in iter_point_series(point_ids, start, end):
+        events.extend(detect_point_events(point_id, times, values, window, min_severity))
+    return events
+
+
+def split_points(point_ids: List[int], groups: int) -> List[List[int]]:
+    """Группы точек для пула: по несколько групп на процесс, чтобы выровнять нагрузку"""
+    groups = max(1, min(groups, len(point_ids)))
+    return [list(map(int, group)) for group in np.array_split(np.array(point_ids), groups) if len(group)]
+
+
+def rank_events(events: List[dict], names: Dict[int, str], limit: Optional[int] = None) -> List[dict]:
+    """События по убыванию значимости с названием точки и описанием"""
+    events = sorted(events, key=lambda event: (-event["severity"], event["event_date"], event["point_id"]))
+    if limit is not None:
+        events = events[:limit]
+    for event in events:
+        event["location"] = names.get(event["point_id"])
+        event["event_type"] = "Рост ТТР" if event["parameter"] == "ttr" else "Рост расхода воды"
+        event["description"] = (
+            f"{PARAMETER_NAMES[event['parameter']]}: {event['value_before']:.3f} -> {event['value_after']:.3f} "
+            f"(+{event['change']:.3f}, значимость {event['severity']:.1f})"
+        )
+    return events
@@ -0,0 +1,282 @@
+"""
+Расход воды parametr_q_H2O по ТТР и объему газа (п. 6.2.2 ТЗ)
+При загрузке значение может вычисляться сервером вместо переданного клиентом
+(derive_q_h2o=true или DERIVE_Q_H2O_ON_INGEST=true). Пересчет накопленных
+строк, например после изменения констант формулы:
+
+    python -m app.services.water_mass backfill --workers 4
+
+Строки обрабатываются диапазонами id_data в пуле процессов; выполненные
+диапазоны записываются в файл контрольной точки, повторный запуск продолжает
+с невыполненных. Изменившиеся значения пишутся пачками UPDATE ... FROM (VALUES ...).
+Затем пересчитываются агрегаты и превышения порога, сбрасывается кэш ответов
+(при CACHE_BACKEND=memory кэш воркеров API сбрасывается только по TTL).
+Контрольная точка удаляется только после этого: если изменения были, повторный
+запуск пересчитывает агрегаты и превышения, даже когда все диапазоны выполнены.
+
+Единицы: ТТР - °C, parametr_q - тыс. м³ за запись, parametr_q_H2O - т.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Float, Integer, bindparam, cast, column, func, select, update, values
+
+from app.database import SessionLocal
+from app.models.models import CalculatedData
+from app.services import excursions, rollups
+from app.services.cache import CALCULATED_DATA_TAG, response_cache
+from app.services.humidity_calculations import HumidityCalculator
+from app.services.process_pool import PROCESS_POOL_START_METHOD, PROCESS_POOL_WORKERS, _init_worker
+from app.utils.units_converter import UnitsConverter
+
+logger = logging.getLogger(__name__)
+
+# Значение по умолчанию параметра derive_q_h2o эндпоинтов загрузки
+DERIVE_Q_H2O_ON_INGEST = os.getenv("DERIVE_Q_H2O_ON_INGEST", "false").lower() == "true"
+# Строк id_data в одном диапазоне пересчета и строк в одной команде UPDATE
+BACKFILL_CHUNK_SIZE = 50000
+BACKFILL_WRITE_BATCH = 5000
+BACKFILL_CHECKPOINT = os.path.join(tempfile.gettempdir(), "q_h2o_backfill.json")
+
+raw_table = CalculatedData.__table__
+
+
+def derive_q_h2o(dew_points, volumes) -> np.ndarray:
+    """
+    Масса воды, т, по массивам ТТР и объема (тыс. м³): W = w(ТТР) * V
+    NaN, если ТТР или объем не заданы либо объем отрицательный
+    """
+    dew_points = np.asarray(dew_points, dtype=np.float64)
+    volumes = np.asarray(volumes, dtype=np.float64)
+    result = np.full(len(dew_points), np.nan)
+    valid = ~np.isnan(dew_points) & ~np.isnan(volumes) & (volumes >= 0)
+    content = HumidityCalculator.calculate_humidity_content_array(dew_points[valid])
+    volume_m3 = UnitsConverter.convert_volume_array(volumes[valid], "thousand_cubic_meters", "cubic_meter")
+    # calculate_water_mass_array не принимает нулевой объем, а нулевой расход газа - нулевой расход воды
+    result[valid] = UnitsConverter.convert_mass_array(content * volume_m3, "gram", "ton")
+    return result
+
+
+def _nullable(array: np.ndarray) -> List[Optional[float]]:
+    return [None if np.isnan(value) else value for value in array.tolist()]
+
+
+def fill_q_h2o(rows: List[Dict]):
+    """Заменить parametr_q_H2O в значениях строк на рассчитанное по parametr_ttr и parametr_q"""
+    if not rows:
+        return
+    derived = derive_q_h2o(
+        np.array([row.get("parametr_ttr") for row in rows], dtype=float),
+        np.array([row.get("parametr_q") for row in rows], dtype=float),
+    )
+    for row, value in zip(rows, _nullable(derived)):
+        row["parametr_q_H2O"] = value
+
+
+def write_q_h2o(db, updates: List[Tuple[int, Optional[float]]]):
+    """Записать пары (id_data, parametr_q_H2O) пачками"""
+    for start in range(0, len(updates), BACKFILL_WRITE_BATCH):
+        batch = updates[start:start + BACKFILL_WRITE_BATCH]
+        if db.get_bind().dialect.name == "postgresql":
+            # Одна команда на пачку: UPDATE ... FROM (VALUES (id, q), ...) AS v
+            new_values = values(column("id_data", Integer), column("q_h2o", Float), name="v").data(batch)
+            db.execute(
+                update(raw_table)
+                .where(raw_table.c.id_data == new_values.c.id_data)
+                .values({"parametr_q_H2O": cast(new_values.c.q_h2o, Float)})
+            )
+        else:
+            db.execute(
+                update(raw_table)
+                .where(raw_table.c.id_data == bindparam("b_id_data"))
+                .values({"parametr_q_H2O": bindparam("b_q_h2o")}),
+                [{"b_id_data": id_data, "b_q_h2o": q_h2o} for id_data, q_h2o in batch],
+            )
+
+
+def backfill_range(first_id: int, end_id: int) -> Tuple[int, int]:
+    """Пересчитать строки с id_data в [first_id, end_id) (задача пула процессов): (прочитано, изменено)"""
+    db = SessionLocal()
+    try:
+        rows = db.execute(
+            select(raw_table.c.id_data, raw_table.c.parametr_ttr, raw_table.c.parametr_q, raw_table.c.parametr_q_H2O)
+            .where(raw_table.c.id_data >= first_id, raw_table.c.id_data < end_id)
+        ).all()
+        if not rows:
+            return 0, 0
+        ids, dew_points, volumes, current = zip(*rows)
+        derived = derive_q_h2o(np.array(dew_points, dtype=float), np.array(volumes, dtype=float))
+        current = np.array(current, dtype=float)
+        # Переписываем только изменившиеся значения
+        changed = np.flatnonzero(~((derived == current) | (np.isnan(derived) & np.isnan(current))))
+        updates = list(zip([ids[i] for i in changed.tolist()], _nullable(derived[changed])))
+        write_q_h2o(db, updates)
+        db.commit()
+        return len(rows), len(updates)
+    finally:
+        db.close()
+
+
+class Checkpoint:
+    """
+    Выполненные диапазоны пересчета в JSON-файле (запись через временный файл)
+    needs_rollups, needs_excursions - в таблице есть записанные изменения,
+    агрегаты (превышения порога) еще не пересчитаны
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.state: Optional[dict] = None
+
+    def load(self) -> Optional[dict]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = None
+        return self.state
+
+    def start(self, first_id: int, last_id: int, chunk_size: int,
+              needs_rollups: bool = False, needs_excursions: bool = False):
+        self.state = {"first_id": first_id, "last_id": last_id, "chunk_size": chunk_size, "done": [],
+                      "needs_rollups": needs_rollups, "needs_excursions": needs_excursions}
+        self.save()
+
+    def mark_done(self, chunk_start: int, updated: int):
+        self.state["done"].append(chunk_start)
+        if updated:
+            self.state["needs_rollups"] = True
+            self.state["needs_excursions"] = True
+        self.save()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _run_ranges(ranges: List[Tuple[int, int]], workers: int) -> Iterable[Tuple[int, Tuple[int, int]]]:
+    """(начало диапазона, результат backfill_range) по мере выполнения"""
+    if workers <= 1:
+        for first_id, end_id in ranges:
+            yield first_id, backfill_range(first_id, end_id)
+        return
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context(PROCESS_POOL_START_METHOD),
+        initializer=_init_worker,
+    ) as executor:
+        futures = {executor.submit(backfill_range, first_id, end_id): first_id for first_id, end_id in ranges}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def _rebuild_derived(needs_rollups: bool, needs_excursions: bool):
+    """Запись шла в обход CRUD: агрегаты и превышения по parametr_q_H2O пересчитываются целиком"""
+    if needs_rollups:
+        db = SessionLocal()
+        try:
+            rollups.rebuild_all(db)
+            db.commit()
+        finally:
+            db.close()
+    if needs_excursions:
+        db = SessionLocal()
+        try:
+            excursions.rebuild_all(db)
+            db.commit()
+        finally:
+            db.close()
+    if needs_rollups or needs_excursions:
+        response_cache.invalidate({CALCULATED_DATA_TAG})
+
+
+def backfill(chunk_size: int = BACKFILL_CHUNK_SIZE, workers: int = PROCESS_POOL_WORKERS,
+             checkpoint_path: str = BACKFILL_CHECKPOINT, restart: bool = False,
+             rebuild_rollups: bool = True, rebuild_excursions: bool = True) -> Dict[str, int]:
+    """
+    Пересчитать parametr_q_H2O всех строк. Продолжает прерванный пересчет по контрольной
+    точке (restart=True - начать заново); файл удаляется после пересчета агрегатов и превышений.
+    """
+    checkpoint = Checkpoint(checkpoint_path)
+    state = checkpoint.load()
+    # Изменения прерванного запуска уже в таблице: при restart их агрегаты и превышения тоже
+    # нужно пересчитать (в контрольной точке без флага изменения считаются возможными)
+    needs_rollups = bool(state and state.get("needs_rollups", True))
+    needs_excursions = bool(state and state.get("needs_excursions", True))
+    if restart:
+        state = None
+    if state is not None:
+        logger.info(f"Продолжение пересчета: выполнено диапазонов {len(state['done'])}")
+    else:
+        db = SessionLocal()
+        try:
+            first_id, last_id = db.execute(select(func.min(raw_table.c.id_data), func.max(raw_table.c.id_data))).one()
+        finally:
+            db.close()
+        if first_id is None:
+            _rebuild_derived(rebuild_rollups and needs_rollups, rebuild_excursions and needs_excursions)
+            checkpoint.remove()
+            return {"ranges": 0, "rows": 0, "updated": 0}
+        # Границы фиксируются при старте: строки, добавленные позже, уже рассчитаны при загрузке
+        checkpoint.start(first_id, last_id, chunk_size, needs_rollups, needs_excursions)
+        state = checkpoint.state
+
+    done = set(state["done"])
+    ranges = [
+        (first_id, min(first_id + state["chunk_size"], state["last_id"] + 1))
+        for first_id in range(state["first_id"], state["last_id"] + 1, state["chunk_size"])
+        if first_id not in done
+    ]
+    totals = {"ranges": 0, "rows": 0, "updated": 0}
+    started = time.monotonic()
+    for first_id, (rows, updated) in _run_ranges(ranges, workers):
+        checkpoint.mark_done(first_id, updated)
+        totals["ranges"] += 1
+        totals["rows"] += rows
+        totals["updated"] += updated
+        logger.info(
+            f"Диапазон {first_id}: строк {rows}, изменено {updated} "
+            f"({totals['ranges']}/{len(ranges)}, {time.monotonic() - started:.1f} с)"
+        )
+
+    _rebuild_derived(
+        rebuild_rollups and state.get("needs_rollups", True),
+        rebuild_excursions and state.get("needs_excursions", True),
+    )
+    checkpoint.remove()
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пересчет parametr_q_H2O по ТТР и объему газа")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE, help="строк id_data в диапазоне")
+    parser.add_argument("--workers", type=int, default=PROCESS_POOL_WORKERS, help="процессов пересчета")
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT, help="файл контрольной точки")
+    parser.add_argument("--restart", action="store_true", help="начать заново, не продолжая по контрольной точке")
+    parser.add_argument("--skip-rollups", action="store_true", help="не пересчитывать агрегаты")
+    parser.add_argument("--skip-excursions", action="store_true", help="не пересчитывать превышения порога")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    totals = backfill(args.chunk_size, args.workers, args.checkpoint, args.restart,
+                      not args.skip_rollups, not args.skip_excursions)
+    logger.info(f"Пересчет завершен: диапазонов {totals['ranges']}, строк {totals['rows']}, изменено {totals['updated']}")
+
+
+if __name__ == "__main__":
+    main()
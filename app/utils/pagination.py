@@ -0,0 +1,56 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+# Заголовок ответа с курсором следующей страницы
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Упаковать ключ последней строки страницы в непрозрачный токен"""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, types: Sequence[type]) -> tuple:
+    """
+    Распаковать токен курсора; ValueError если токен поврежден
+    Значение типа datetime может быть null (ключ строки без времени).
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(payload, list) or len(payload) != len(types):
+        raise ValueError("Invalid cursor")
+    try:
+        return tuple(
+            (None if value is None else datetime.fromisoformat(value)) if value_type is datetime
+            else value_type(value)
+            for value, value_type in zip(payload, types)
+        )
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def next_cursor(rows: List[Any], limit: int, key: Callable[[Any], Sequence[Any]]) -> Optional[str]:
+    """Курсор следующей страницы, если текущая заполнена целиком"""
+    if limit <= 0 or len(rows) < limit:
+        return None
+    return encode_cursor(key(rows[-1]))
+
+
+def set_next_cursor(response, rows: List[Any], limit: int, key: Callable[[Any], Sequence[Any]]):
+    """Передать курсор следующей страницы в заголовке X-Next-Cursor"""
+    cursor = next_cursor(rows, limit, key)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+
+
+def next_cursor_headers(rows: List[Any], limit: int, key: Callable[[Any], Sequence[Any]]) -> Dict[str, str]:
+    """Заголовок X-Next-Cursor для ответа, который эндпоинт возвращает сам (Response)"""
+    cursor = next_cursor(rows, limit, key)
+    return {NEXT_CURSOR_HEADER: cursor} if cursor else {}
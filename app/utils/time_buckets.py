@@ -0,0 +1,100 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import DateTime, Float, cast, extract, func, literal_column, type_coerce
+
+EPOCH = datetime(1970, 1, 1)
+
+# Поддерживаемые интервалы агрегации временных рядов
+GRANULARITIES = ("hour", "day", "week", "month")
+
+# Модификаторы strftime() для усечения даты в SQLite (в PostgreSQL используется date_trunc)
+_SQLITE_MODIFIERS = {
+    "hour": (),
+    "day": ("'start of day'",),
+    "week": ("'weekday 0'", "'-6 days'", "'start of day'"),
+    "month": ("'start of month'",),
+}
+# Формат хранения DateTime в SQLite: результат должен сравниваться со значениями столбцов как строка
+_SQLITE_FORMATS = {
+    "hour": "'%Y-%m-%d %H:00:00.000000'",
+    "day": "'%Y-%m-%d 00:00:00.000000'",
+    "week": "'%Y-%m-%d 00:00:00.000000'",
+    "month": "'%Y-%m-%d 00:00:00.000000'",
+}
+
+
+def truncate_expression(column, granularity: str, dialect_name: str):
+    """
+    SQL-выражение начала интервала для столбца времени
+    Единица интервала подставляется литералом: одинаковое выражение в SELECT
+    и GROUP BY иначе получает разные параметры и не группируется в PostgreSQL.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unsupported granularity: {granularity}")
+    if dialect_name == "sqlite":
+        expression = func.strftime(
+            literal_column(_SQLITE_FORMATS[granularity]),
+            column,
+            *[literal_column(m) for m in _SQLITE_MODIFIERS[granularity]]
+        )
+    else:
+        expression = func.date_trunc(literal_column(f"'{granularity}'"), column)
+    return type_coerce(expression, DateTime)
+
+
+def epoch_expression(column, dialect_name: str):
+    """
+    Секунды от 1970-01-01 для столбца времени (значение без часового пояса как UTC)
+    Массивы времени собираются из чисел без создания объектов datetime в Python.
+    """
+    if dialect_name == "sqlite":
+        return (func.julianday(column) - 2440587.5) * 86400.0
+    return cast(extract("epoch", column), Float)
+
+
+def from_epoch(seconds: float) -> datetime:
+    """
+    Обратное к epoch_expression: datetime без часового пояса
+    Округление до миллисекунд: julianday() в SQLite дает погрешность в микросекундах.
+    """
+    return EPOCH + timedelta(milliseconds=round(seconds * 1000))
+
+
+def truncate_datetime(value: datetime, granularity: str) -> datetime:
+    """Начало интервала, содержащего value"""
+    if granularity == "hour":
+        return value.replace(minute=0, second=0, microsecond=0)
+    day = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unsupported granularity: {granularity}")
+
+
+def bucket_end(start: datetime, granularity: str) -> datetime:
+    """Начало следующего интервала"""
+    if granularity == "hour":
+        return start + timedelta(hours=1)
+    if granularity == "day":
+        return start + timedelta(days=1)
+    if granularity == "week":
+        return start + timedelta(weeks=1)
+    if granularity == "month":
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    raise ValueError(f"Unsupported granularity: {granularity}")
+
+
+def is_aligned(value: datetime, granularity: str) -> bool:
+    return truncate_datetime(value, granularity) == value
+
+
+def parse_datetime(value) -> datetime:
+    """Дата/время из строки ISO или date"""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return datetime.fromisoformat(value)
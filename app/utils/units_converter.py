@@ -1,5 +1,7 @@
 from typing import Dict, Any
 
+import numpy as np
+
 class UnitsConverter:
     """Конвертер единиц измерения"""
     # Коэффициенты преобразования для объема
@@ -42,6 +44,44 @@ class UnitsConverter:
         base_value = value * cls.MASS_CONVERSIONS[from_unit]
         return base_value / cls.MASS_CONVERSIONS[to_unit]
     
+    @classmethod
+    def convert_volume_array(cls, values, from_unit: str, to_unit: str) -> np.ndarray:
+        """Конвертировать массив объемов"""
+        if from_unit not in cls.VOLUME_CONVERSIONS or to_unit not in cls.VOLUME_CONVERSIONS:
+            raise ValueError(f"Unsupported volume units: {from_unit} -> {to_unit}")
+        
+        values = np.asarray(values, dtype=np.float64)
+        if np.any(values < 0):
+            raise ValueError("Объем не может быть отрицательным")
+            
+        base_values = values * cls.VOLUME_CONVERSIONS[from_unit]
+        return base_values / cls.VOLUME_CONVERSIONS[to_unit]
+    
+    @classmethod
+    def convert_mass_array(cls, values, from_unit: str, to_unit: str) -> np.ndarray:
+        """Конвертировать массив масс"""
+        if from_unit not in cls.MASS_CONVERSIONS or to_unit not in cls.MASS_CONVERSIONS:
+            raise ValueError(f"Unsupported mass units: {from_unit} -> {to_unit}")
+        
+        values = np.asarray(values, dtype=np.float64)
+        if np.any(values < 0):
+            raise ValueError("Масса не может быть отрицательной")
+            
+        base_values = values * cls.MASS_CONVERSIONS[from_unit]
+        return base_values / cls.MASS_CONVERSIONS[to_unit]
+    
+    @classmethod
+    def convert_dew_point_array(cls, values, from_unit: str, to_unit: str) -> np.ndarray:
+        """Конвертировать массив температур (пока только Цельсий поддерживается)"""
+        if from_unit != 'celsius' or to_unit != 'celsius':
+            raise ValueError("Only Celsius temperature is currently supported")
+        
+        values = np.asarray(values, dtype=np.float64)
+        if np.any(values < -273.15):
+            raise ValueError("Температура не может быть ниже абсолютного нуля")
+            
+        return values
+    
     @classmethod
     def convert_dew_point(cls, value: float, from_unit: str, to_unit: str) -> float:
         """Конвертировать температуру (пока только Цельсий поддерживается)"""
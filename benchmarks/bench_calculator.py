@@ -0,0 +1,97 @@
+"""
+Бенчмарк пакетного расчета влагосодержания (п. 6.2.2 ТЗ)
+Сравнивает скалярный цикл HumidityCalculator с векторными методами
+и эндпоинтом /api/v1/calculator/batch (JSON и бинарное тело).
+
+Запуск: python benchmarks/bench_calculator.py [количество_строк]
+"""
+import sys
+import os
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+import numpy as np
+
+from app.services.humidity_calculations import HumidityCalculator
+from app.utils.units_converter import UnitsConverter
+
+
+def report(name: str, rows: int, seconds: float):
+    print(f"{name:<32} {rows:>10} строк  {seconds:8.3f} с  {rows / seconds:14,.0f} строк/с")
+
+
+def bench_scalar(dew_points: np.ndarray, volumes: np.ndarray) -> np.ndarray:
+    start = time.perf_counter()
+    result = []
+    for t, v in zip(dew_points.tolist(), volumes.tolist()):
+        base_volume = UnitsConverter.convert_volume(v, 'thousand_cubic_meters', 'cubic_meter')
+        w = HumidityCalculator.calculate_humidity_content(t)
+        result.append(HumidityCalculator.calculate_water_mass(w, base_volume))
+    report("скалярный цикл", len(dew_points), time.perf_counter() - start)
+    return np.array(result)
+
+
+def bench_vectorized(dew_points: np.ndarray, volumes: np.ndarray) -> np.ndarray:
+    start = time.perf_counter()
+    base_volumes = UnitsConverter.convert_volume_array(volumes, 'thousand_cubic_meters', 'cubic_meter')
+    w = HumidityCalculator.calculate_humidity_content_array(dew_points)
+    result = HumidityCalculator.calculate_water_mass_array(w, base_volumes)
+    report("векторный NumPy", len(dew_points), time.perf_counter() - start)
+    return result
+
+
+def bench_mixture_dew_point(humidities: np.ndarray):
+    start = time.perf_counter()
+    for w in humidities.tolist():
+        HumidityCalculator.calculate_mixture_dew_point(w)
+    report("ТТР смеси: скалярный (таблица)", len(humidities), time.perf_counter() - start)
+
+    for method in HumidityCalculator.DEW_POINT_METHODS:
+        start = time.perf_counter()
+        HumidityCalculator.calculate_mixture_dew_point_array(humidities, method=method)
+        report(f"ТТР смеси: векторный ({method})", len(humidities), time.perf_counter() - start)
+
+
+def bench_endpoint(dew_points: np.ndarray, volumes: np.ndarray):
+    """Замер через HTTP-слой (нужны fastapi и доступная БД для app.main)"""
+    try:
+        from fastapi.testclient import TestClient
+        from app.main import app
+    except Exception as e:
+        print(f"эндпоинт пропущен: {e}")
+        return
+    client = TestClient(app)
+
+    start = time.perf_counter()
+    response = client.post("/api/v1/calculator/batch", json={
+        "dew_points": dew_points.tolist(),
+        "gas_volumes": volumes.tolist()
+    })
+    response.raise_for_status()
+    report("/calculator/batch (JSON)", len(dew_points), time.perf_counter() - start)
+
+    start = time.perf_counter()
+    response = client.post(
+        "/api/v1/calculator/batch",
+        content=np.concatenate([dew_points, volumes]).astype("<f8").tobytes(),
+        headers={"Content-Type": "application/octet-stream"}
+    )
+    response.raise_for_status()
+    report("/calculator/batch (binary)", len(dew_points), time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    rng = np.random.default_rng(42)
+    dew_points = rng.uniform(-30.0, 20.0, rows)
+    volumes = rng.uniform(100.0, 5000.0, rows)
+
+    scalar = bench_scalar(dew_points, volumes)
+    vectorized = bench_vectorized(dew_points, volumes)
+    rel_diff = np.max(np.abs(vectorized - scalar) / scalar)
+    print(f"макс. относительное расхождение скаляр/вектор: {rel_diff:.2e}")
+    bench_mixture_dew_point(rng.uniform(0.03, 1.0, rows))
+    bench_endpoint(dew_points, volumes)
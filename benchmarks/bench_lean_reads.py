@@ -0,0 +1,127 @@
+"""
+Бенчмарк стоимости строки списочных эндпоинтов Calculated_data
+Сравнивает прежний путь (объекты ORM -> валидация response_model
+List[CalculatedData] -> json стандартной библиотеки, как делает FastAPI)
+с облегченным (кортежи Core -> словари -> orjson, app/services/lean_read.py).
+
+По умолчанию данные генерируются в SQLite в памяти; --app-db читает первые
+--rows строк из БД приложения (DATABASE_URL).
+
+Запуск: python benchmarks/bench_lean_reads.py [--rows 100000] [--repeats 5] [--app-db]
+"""
+import sys
+import os
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from pydantic import TypeAdapter
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from app.database import Base
+from app.models.models import CalculatedData, MeasuringPoint
+from app.schemas.schemas import CalculatedData as CalculatedDataSchema
+from app.services.lean_read import DATA_SELECT_COLUMNS, encode_rows
+
+response_adapter = TypeAdapter(List[CalculatedDataSchema])
+
+
+def generate(engine, rows: int, points: int = 10):
+    Base.metadata.create_all(engine)
+    start = datetime(2024, 1, 1)
+    with engine.begin() as connection:
+        connection.execute(insert(MeasuringPoint), [{"id_point": i, "name_point": f"Точка {i}"} for i in range(1, points + 1)])
+        connection.execute(insert(CalculatedData), [{
+            "data_and_time": start + timedelta(minutes=i),
+            "parametr_ttr": -20 + (i % 300) / 10,
+            "parametr_q": 500 + i % 2500,
+            "parametr_q_H2O": (i % 200) / 1000,
+            "parametr_q_H2O_porog": 0.15,
+            "id_point": 1 + i % points,
+        } for i in range(rows)])
+
+
+def orm_path(session: Session, rows: int) -> tuple:
+    """Прежний путь: время выборки с созданием объектов, валидации и кодирования"""
+    timings = {}
+    started = time.perf_counter()
+    objects = list(session.scalars(select(CalculatedData).order_by(CalculatedData.data_and_time).limit(rows)))
+    timings["выборка ORM"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    content = response_adapter.dump_python(response_adapter.validate_python(objects, from_attributes=True), mode="json")
+    timings["валидация схемой"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    timings["json"] = time.perf_counter() - started
+    session.expunge_all()
+    return timings, body
+
+
+def lean_path(session: Session, rows: int) -> tuple:
+    """Облегченный путь: кортежи Core и orjson"""
+    timings = {}
+    started = time.perf_counter()
+    result = list(session.execute(
+        select(*DATA_SELECT_COLUMNS).order_by(CalculatedData.data_and_time).limit(rows)
+    ))
+    timings["выборка Core"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    body = encode_rows(result)
+    timings["словари + orjson"] = time.perf_counter() - started
+    return timings, body
+
+
+def measure(path, session: Session, rows: int, repeats: int):
+    runs = [path(session, rows) for _ in range(repeats)]
+    stages = {name: statistics.median(run[0][name] for run in runs) for name in runs[0][0]}
+    return stages, runs[-1][1]
+
+
+def report(title: str, stages: dict, rows: int):
+    print(title)
+    for name, seconds in stages.items():
+        print(f"  {name:<24} {seconds * 1000:10.1f} мс  {seconds / rows * 1e6:8.2f} мкс/строка")
+    total = sum(stages.values())
+    print(f"  {'итого':<24} {total * 1000:10.1f} мс  {total / rows * 1e6:8.2f} мкс/строка")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--app-db", action="store_true", help="читать строки из БД приложения (DATABASE_URL)")
+    args = parser.parse_args()
+
+    if args.app_db:
+        from app.database import engine
+    else:
+        engine = create_engine("sqlite://")
+        generate(engine, args.rows)
+
+    with Session(engine) as session:
+        before, before_body = measure(orm_path, session, args.rows, args.repeats)
+        after, after_body = measure(lean_path, session, args.rows, args.repeats)
+
+    rows = len(json.loads(after_body))
+    if json.loads(before_body) != json.loads(after_body):
+        raise SystemExit("Ответы путей различаются")
+    print(f"{rows} строк, медиана {args.repeats} повторов")
+    total_before = report("ORM + Pydantic + json:", before, rows)
+    total_after = report("Core + orjson:", after, rows)
+    print(f"ускорение: {total_before / total_after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Бенчмарк запросов временных рядов до и после индексов миграции 0002
+Работает с PostgreSQL из DATABASE_URL. Скрипт генерирует набор данных,
+замеряет запросы эндпоинтов без индексов, создает индексы и замеряет снова.
+
+Запуск (отдельная БД, таблицы создаются миграциями):
+    alembic upgrade head
+    python benchmarks/bench_time_series_indexes.py --rows 10000000 --points 200 --generate
+"""
+import sys
+import os
+import argparse
+import statistics
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(current_dir)
+sys.path.insert(0, project_root)
+
+from sqlalchemy import text
+
+from app.database import engine
+
+INDEXES = {
+    "ix_calculated_data_point_time": 'CREATE INDEX ix_calculated_data_point_time ON "Calculated_data" (id_point, data_and_time)',
+    "ix_calculated_data_time_id": 'CREATE INDEX ix_calculated_data_time_id ON "Calculated_data" (data_and_time, id_data)',
+    "ix_calculated_data_time_brin": 'CREATE INDEX ix_calculated_data_time_brin ON "Calculated_data" USING brin (data_and_time)',
+}
+
+# Запросы, которые выполняют эндпоинты (параметры подставляются ниже)
+QUERIES = {
+    "get_by_point (первая страница)": """
+        SELECT * FROM "Calculated_data" WHERE id_point = :point_id
+        ORDER BY data_and_time, id_data LIMIT 100
+    """,
+    "/calculated-data/?cursor= (страница по курсору)": """
+        SELECT * FROM "Calculated_data" WHERE (data_and_time, id_data) > (:day_start, 0)
+        ORDER BY data_and_time, id_data LIMIT 100
+    """,
+    "/calculated-data/date-range (сутки, точка)": """
+        SELECT * FROM "Calculated_data"
+        WHERE data_and_time BETWEEN :day_start AND :day_end AND id_point = :point_id
+        ORDER BY data_and_time
+    """,
+    "/calculated-data/date-range (сутки, все точки)": """
+        SELECT * FROM "Calculated_data"
+        WHERE data_and_time BETWEEN :day_start AND :day_end
+        ORDER BY data_and_time
+    """,
+    "/measuring-points/{id}/statistics": """
+        SELECT COUNT(*), AVG(parametr_ttr), AVG(parametr_q), MIN(data_and_time), MAX(data_and_time)
+        FROM "Calculated_data" WHERE id_point = :point_id
+    """,
+    "/reports/daily (сутки)": """
+        SELECT mp.id_point, COUNT(cd.id_data), AVG(cd.parametr_ttr), MIN(cd.parametr_ttr), MAX(cd.parametr_ttr)
+        FROM "Measuring_point" mp
+        LEFT JOIN "Calculated_data" cd ON mp.id_point = cd.id_point
+            AND cd.data_and_time >= :day_start AND cd.data_and_time < :day_end
+        GROUP BY mp.id_point
+    """,
+}
+
+
+def generate(connection, rows: int, points: int):
+    """Почасовые ряды по points точкам, всего rows строк"""
+    print(f"Генерация {rows} строк по {points} точкам...")
+    connection.execute(text('TRUNCATE "Calculated_data", "Measuring_point" RESTART IDENTITY CASCADE'))
+    connection.execute(text("""
+        INSERT INTO "Measuring_point" (id_point, name_point)
+        SELECT i, 'Точка ' || i FROM generate_series(1, :points) AS i
+    """), {"points": points})
+    connection.execute(text("""
+        INSERT INTO "Calculated_data" (data_and_time, parametr_ttr, parametr_q, "parametr_q_H2O", "parametr_q_H2O_porog", id_point)
+        SELECT TIMESTAMP '2020-01-01' + (i / :points) * INTERVAL '1 hour',
+               -20 + random() * 30, 500 + random() * 2500, random() * 0.2, 0.15,
+               1 + i % :points
+        FROM generate_series(0, :rows - 1) AS i
+    """), {"rows": rows, "points": points})
+    connection.execute(text('ANALYZE "Calculated_data"'))
+
+
+def measure(connection, params: dict, repeats: int) -> dict:
+    results = {}
+    for name, sql in QUERIES.items():
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            connection.execute(text(sql), params).fetchall()
+            timings.append(time.perf_counter() - start)
+        results[name] = statistics.median(timings)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--points", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--generate", action="store_true", help="пересоздать тестовые данные")
+    args = parser.parse_args()
+
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("Бенчмарк рассчитан на PostgreSQL")
+
+    with engine.connect() as connection:
+        connection = connection.execution_options(isolation_level="AUTOCOMMIT")
+        if args.generate:
+            generate(connection, args.rows, args.points)
+
+        last = connection.execute(text('SELECT MAX(data_and_time) FROM "Calculated_data"')).scalar()
+        params = {
+            "point_id": args.points // 2 or 1,
+            "day_start": last.replace(hour=0, minute=0, second=0) if last else None,
+            "day_end": last.replace(hour=23, minute=59, second=59) if last else None,
+        }
+
+        for name in INDEXES:
+            connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        before = measure(connection, params, args.repeats)
+
+        for ddl in INDEXES.values():
+            connection.execute(text(ddl))
+        connection.execute(text('ANALYZE "Calculated_data"'))
+        after = measure(connection, params, args.repeats)
+
+    print(f"{'запрос':<48} {'без индексов, мс':>18} {'с индексами, мс':>18}")
+    for name in QUERIES:
+        print(f"{name:<48} {before[name] * 1000:18.1f} {after[name] * 1000:18.1f}")
+
+
+if __name__ == "__main__":
+    main()
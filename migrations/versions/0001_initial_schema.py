@@ -0,0 +1,51 @@
+"""Исходная схема: Measuring_point и Calculated_data
+
+Совпадает со схемой, которую создавал Base.metadata.create_all.
+Для такой существующей БД достаточно выполнить `alembic stamp 0001`.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "Measuring_point",
+        sa.Column("id_point", sa.Integer(), nullable=False),
+        sa.Column("name_point", sa.String(length=100), nullable=True),
+        sa.Column("id_parametr_ttr", sa.Float(), nullable=True),
+        sa.Column("id_parametr_q", sa.Float(), nullable=True),
+        sa.Column("id_parent_point", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(["id_parent_point"], ["Measuring_point.id_point"]),
+        sa.PrimaryKeyConstraint("id_point"),
+    )
+    op.create_index("ix_Measuring_point_id_point", "Measuring_point", ["id_point"])
+    op.create_table(
+        "Calculated_data",
+        sa.Column("id_data", sa.Integer(), nullable=False),
+        sa.Column("data_and_time", sa.DateTime(), nullable=True),
+        sa.Column("parametr_ttr", sa.Float(), nullable=True),
+        sa.Column("parametr_q", sa.Float(), nullable=True),
+        sa.Column("parametr_q_H2O", sa.Float(), nullable=True),
+        sa.Column("parametr_q_H2O_porog", sa.Float(), nullable=True),
+        sa.Column("id_point", sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(["id_point"], ["Measuring_point.id_point"]),
+        sa.PrimaryKeyConstraint("id_data"),
+    )
+    op.create_index("ix_Calculated_data_id_data", "Calculated_data", ["id_data"])
+
+
+def downgrade():
+    op.drop_index("ix_Calculated_data_id_data", table_name="Calculated_data")
+    op.drop_table("Calculated_data")
+    op.drop_index("ix_Measuring_point_id_point", table_name="Measuring_point")
+    op.drop_table("Measuring_point")
@@ -0,0 +1,37 @@
+"""Индексы временных рядов для Calculated_data
+
+- составной B-tree (id_point, data_and_time): выборки по точке и периоду,
+  статистика точки, суточный отчет;
+- B-tree (data_and_time, id_data): постраничный список всех строк по курсору
+  (ORDER BY data_and_time, id_data LIMIT n без сортировки);
+- BRIN по data_and_time: выборки по диапазону дат без фильтра по точке.
+  Данные поступают по времени, поэтому BRIN остается компактным.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index("ix_calculated_data_point_time", "Calculated_data", ["id_point", "data_and_time"])
+    op.create_index("ix_calculated_data_time_id", "Calculated_data", ["data_and_time", "id_data"])
+    op.create_index(
+        "ix_calculated_data_time_brin",
+        "Calculated_data",
+        ["data_and_time"],
+        postgresql_using="brin",
+    )
+
+
+def downgrade():
+    op.drop_index("ix_calculated_data_time_brin", table_name="Calculated_data")
+    op.drop_index("ix_calculated_data_time_id", table_name="Calculated_data")
+    op.drop_index("ix_calculated_data_point_time", table_name="Calculated_data")
@@ -0,0 +1,125 @@
+"""Помесячное секционирование Calculated_data (опционально, только PostgreSQL)
+
+Выполняется только при явном запросе:
+    alembic -x partitioning=monthly upgrade head
+или CALCULATED_DATA_PARTITIONING=monthly. Без него ревизия ничего не меняет;
+включить секционирование позже можно через downgrade 0002 и повторный upgrade.
+
+Таблица пересоздается как PARTITION BY RANGE (data_and_time) с первичным ключом
+(id_data, data_and_time), данные копируются, последовательность id_data сохраняется.
+Секции создаются с месяца первой записи до текущего месяца + MONTHS_AHEAD,
+плюс секция DEFAULT. Новые секции далее создает python -m app.services.partitions.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+import os
+
+from alembic import context, op
+import sqlalchemy as sa
+
+from app.services.partitions import (
+    TABLE_NAME,
+    create_default_partition,
+    ensure_monthly_partitions,
+    is_partitioned,
+)
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+OLD_TABLE = f"{TABLE_NAME}_unpartitioned"
+QUOTED_COLUMNS = 'id_data, data_and_time, parametr_ttr, parametr_q, "parametr_q_H2O", "parametr_q_H2O_porog", id_point'
+
+
+def partitioning_requested() -> bool:
+    mode = context.get_x_argument(as_dictionary=True).get(
+        "partitioning", os.getenv("CALCULATED_DATA_PARTITIONING", "")
+    )
+    return mode == "monthly"
+
+
+def create_time_series_indexes():
+    op.create_index("ix_calculated_data_point_time", TABLE_NAME, ["id_point", "data_and_time"])
+    op.create_index("ix_calculated_data_time_id", TABLE_NAME, ["data_and_time", "id_data"])
+    op.create_index("ix_calculated_data_time_brin", TABLE_NAME, ["data_and_time"], postgresql_using="brin")
+
+
+def swap_table(create_sql: str):
+    """Переименовать текущую таблицу и создать на ее месте новую по create_sql"""
+    connection = op.get_bind()
+    sequence = connection.execute(
+        sa.text("SELECT pg_get_serial_sequence(:table_name, 'id_data')"), {"table_name": f'"{TABLE_NAME}"'}
+    ).scalar()
+
+    primary_key = connection.execute(
+        sa.text("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:table_name) AND contype = 'p'"),
+        {"table_name": f'"{TABLE_NAME}"'}
+    ).scalar()
+
+    op.execute(f'ALTER TABLE "{TABLE_NAME}" RENAME TO "{OLD_TABLE}"')
+    # Имя индекса первичного ключа должно освободиться для новой таблицы
+    if primary_key:
+        op.execute(f'ALTER TABLE "{OLD_TABLE}" RENAME CONSTRAINT "{primary_key}" TO "{OLD_TABLE}_pkey"')
+    # Последовательность не должна удалиться вместе со старой таблицей
+    op.execute(f"ALTER SEQUENCE {sequence} OWNED BY NONE")
+    op.execute(create_sql.format(sequence=sequence))
+    return sequence
+
+
+def finish_swap(sequence: str):
+    op.execute(f'INSERT INTO "{TABLE_NAME}" ({QUOTED_COLUMNS}) SELECT {QUOTED_COLUMNS} FROM "{OLD_TABLE}"')
+    op.execute(f'DROP TABLE "{OLD_TABLE}"')
+    op.execute(f'ALTER SEQUENCE {sequence} OWNED BY "{TABLE_NAME}".id_data')
+    create_time_series_indexes()
+
+
+def upgrade():
+    connection = op.get_bind()
+    if connection.dialect.name != "postgresql" or not partitioning_requested() or is_partitioned(connection):
+        return
+
+    nulls = connection.execute(sa.text(f'SELECT COUNT(*) FROM "{TABLE_NAME}" WHERE data_and_time IS NULL')).scalar()
+    if nulls:
+        raise RuntimeError(f"{nulls} строк без data_and_time нельзя разместить в секциях")
+    first_record = connection.execute(sa.text(f'SELECT MIN(data_and_time) FROM "{TABLE_NAME}"')).scalar()
+
+    sequence = swap_table(f"""
+        CREATE TABLE "{TABLE_NAME}" (
+            id_data INTEGER NOT NULL DEFAULT nextval('{{sequence}}'),
+            data_and_time TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            parametr_ttr FLOAT,
+            parametr_q FLOAT,
+            "parametr_q_H2O" FLOAT,
+            "parametr_q_H2O_porog" FLOAT,
+            id_point INTEGER REFERENCES "Measuring_point" (id_point),
+            PRIMARY KEY (id_data, data_and_time)
+        ) PARTITION BY RANGE (data_and_time)
+    """)
+    ensure_monthly_partitions(connection, first_month=first_record)
+    create_default_partition(connection)
+    finish_swap(sequence)
+
+
+def downgrade():
+    connection = op.get_bind()
+    if not is_partitioned(connection):
+        return
+
+    sequence = swap_table(f"""
+        CREATE TABLE "{TABLE_NAME}" (
+            id_data INTEGER NOT NULL DEFAULT nextval('{{sequence}}') PRIMARY KEY,
+            data_and_time TIMESTAMP WITHOUT TIME ZONE,
+            parametr_ttr FLOAT,
+            parametr_q FLOAT,
+            "parametr_q_H2O" FLOAT,
+            "parametr_q_H2O_porog" FLOAT,
+            id_point INTEGER REFERENCES "Measuring_point" (id_point)
+        )
+    """)
+    op.create_index("ix_Calculated_data_id_data", TABLE_NAME, ["id_data"])
+    finish_swap(sequence)
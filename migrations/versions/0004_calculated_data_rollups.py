@@ -0,0 +1,48 @@
+"""Таблица агрегатов Calculated_data_rollup (час, сутки, месяц по точке)
+
+Таблица поддерживается CRUD при каждой записи в Calculated_data
+(app/services/rollups.py). При создании заполняется из существующих данных;
+после правок в обход API пересчет выполняется командой:
+    python -m app.services.rollups rebuild
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from app.services.rollups import rebuild_all
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+METRICS = ("ttr", "q", "q_H2O")
+
+
+def upgrade():
+    columns = [
+        sa.Column("granularity", sa.String(5), primary_key=True),
+        sa.Column("id_point", sa.Integer, sa.ForeignKey("Measuring_point.id_point"), primary_key=True),
+        sa.Column("bucket_start", sa.DateTime, primary_key=True),
+        sa.Column("record_count", sa.Integer),
+    ]
+    for metric in METRICS:
+        columns += [
+            sa.Column(f"count_{metric}", sa.Integer),
+            sa.Column(f"sum_{metric}", sa.Float),
+            sa.Column(f"min_{metric}", sa.Float),
+            sa.Column(f"max_{metric}", sa.Float),
+        ]
+    op.create_table("Calculated_data_rollup", *columns)
+
+    # Сессия на соединении миграции: пересчет идет в той же транзакции
+    rebuild_all(Session(bind=op.get_bind()))
+
+
+def downgrade():
+    op.drop_table("Calculated_data_rollup")
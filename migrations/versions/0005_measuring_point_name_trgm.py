@@ -0,0 +1,36 @@
+"""Триграммный GIN-индекс для поиска точек измерений по названию (только PostgreSQL)
+
+Индекс построен по нормализованному названию replace(lower(name_point), 'ё', 'е')
+с gin_trgm_ops: поиск по подстроке (LIKE '%...%') и по сходству (<%) в
+app/services/name_search.py используют его вместо полного сканирования.
+Требует расширение pg_trgm (входит в contrib).
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+from app.services.name_search import NORMALIZED_NAME_SQL
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute(
+        f'CREATE INDEX ix_measuring_point_name_trgm ON "Measuring_point" '
+        f"USING gin (({NORMALIZED_NAME_SQL}) gin_trgm_ops)"
+    )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("DROP INDEX IF EXISTS ix_measuring_point_name_trgm")
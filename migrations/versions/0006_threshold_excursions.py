@@ -0,0 +1,51 @@
+"""Таблица превышений порога расхода воды Threshold_excursion
+
+Превышения поддерживаются CRUD при каждой записи в Calculated_data
+(app/services/excursions.py). При создании таблица заполняется по
+существующим данным; после правок в обход API пересчет выполняется командой:
+    python -m app.services.excursions rebuild
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from app.services.excursions import rebuild_all
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "Threshold_excursion",
+        sa.Column("id_excursion", sa.Integer, primary_key=True),
+        sa.Column("id_point", sa.Integer, sa.ForeignKey("Measuring_point.id_point"), nullable=False),
+        sa.Column("started_at", sa.DateTime, nullable=False),
+        sa.Column("ended_at", sa.DateTime),
+        sa.Column("threshold", sa.Float),
+        sa.Column("peak_value", sa.Float),
+        sa.Column("peak_at", sa.DateTime),
+        sa.Column("sample_count", sa.Integer),
+    )
+    op.create_index("ix_threshold_excursion_point_start", "Threshold_excursion", ["id_point", "started_at"])
+    # Частичный индекс открытых превышений: список открытых не читает закрытые
+    op.create_index(
+        "ix_threshold_excursion_open", "Threshold_excursion", ["id_point"],
+        postgresql_where=sa.text("ended_at IS NULL"), sqlite_where=sa.text("ended_at IS NULL"),
+    )
+
+    # Сессия на соединении миграции: пересчет идет в той же транзакции
+    rebuild_all(Session(bind=op.get_bind()))
+
+
+def downgrade():
+    op.drop_index("ix_threshold_excursion_open", table_name="Threshold_excursion")
+    op.drop_index("ix_threshold_excursion_point_start", table_name="Threshold_excursion")
+    op.drop_table("Threshold_excursion")
@@ -0,0 +1,33 @@
+from types import SimpleNamespace
+
+from app.services.name_search import NameSearchIndex
+
+
+def make_index(names):
+    return NameSearchIndex([
+        SimpleNamespace(_mapping={"id_point": i, "name_point": name}) for i, name in enumerate(names, start=1)
+    ])
+
+
+def test_query_longer_than_all_names():
+    index = make_index(["abcd", "xy"])
+    contains, prefix = index._substring_hits("xyaaaaaaa")
+    assert not contains.any() and not prefix.any()
+    assert index.search("xyaaaaaaa") == []
+
+
+def test_match_near_end_of_names():
+    index = make_index(["abcd", "xy"])
+    contains, prefix = index._substring_hits("xy")
+    assert contains.tolist() == [False, True]
+    assert prefix.tolist() == [False, True]
+    # Запрос выходит за конец последнего названия
+    contains, _ = index._substring_hits("xyz")
+    assert not contains.any()
+
+
+def test_substring_and_prefix():
+    index = make_index(["КС-17 Вход", "Выход КС-17", "ГРС"])
+    contains, prefix = index._substring_hits("кс-17")
+    assert contains.tolist() == [True, True, False]
+    assert prefix.tolist() == [True, False, False]
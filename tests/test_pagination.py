@@ -0,0 +1,16 @@
+from datetime import datetime
+
+import pytest
+
+from app.utils.pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    key = (datetime(2024, 1, 1, 12, 30), 42)
+    assert decode_cursor(encode_cursor(key), (datetime, int)) == key
+
+
+def test_cursor_without_time():
+    assert decode_cursor(encode_cursor((None, 7)), (datetime, int)) == (None, 7)
+    with pytest.raises(ValueError):
+        decode_cursor(encode_cursor((None,)), (int,))
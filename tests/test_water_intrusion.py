@@ -0,0 +1,44 @@
+import numpy as np
+
+from app.services.water_intrusion import PARAMETERS, detect_steps, noise_scale
+
+
+def test_flat_series_has_no_events():
+    assert detect_steps(np.full(200, 0.05)) == []
+    assert detect_steps(np.zeros(200), min_change=0.0) == []
+
+
+def test_quantized_noise_has_no_events():
+    _, min_change = PARAMETERS["q_H2O"]
+    for seed in range(20):
+        rng = np.random.default_rng(seed)
+        values = np.round(0.05 + rng.normal(0, 0.003, 1000), 2)
+        assert detect_steps(values) == []
+        assert detect_steps(values, min_change=min_change) == []
+
+
+def test_step_in_quantized_series():
+    _, min_change = PARAMETERS["q_H2O"]
+    rng = np.random.default_rng(0)
+    values = np.round(0.05 + rng.normal(0, 0.003, 1000), 2)
+    values[500:] += 0.05
+    events = detect_steps(values, min_change=min_change)
+    assert [event[0] for event in events] == [500]
+
+
+def test_step_without_noise():
+    events = detect_steps(np.concatenate((np.zeros(50), np.ones(50))), min_change=0.5)
+    assert len(events) == 1
+    index, before, after, _ = events[0]
+    assert (index, before, after) == (50, 0.0, 1.0)
+
+
+def test_float_rounding_in_quantized_series():
+    # Рост на шаг 0.1 за отсчет: разности равны 0.1 с погрешностью float ~1e-16, MAD не нулевое
+    values = 20.0 + np.cumsum(np.full(300, 0.1))
+    assert noise_scale(values) == 0.0
+    assert detect_steps(values) == []
+    rng = np.random.default_rng(0)
+    noisy = values + np.round(rng.normal(0, 0.04, 300), 1)
+    assert np.isfinite([event[3] for event in detect_steps(noisy)]).all()
+    assert all(event[3] < 1e6 for event in detect_steps(noisy))